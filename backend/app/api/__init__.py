@@ -1,2 +1,2 @@
 # api package
-from . import inference, history, files
+from . import inference, history, files, metrics
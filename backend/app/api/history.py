@@ -1,31 +1,73 @@
 """
 历史记录 API 路由
 """
+from datetime import datetime, timezone
+from typing import Optional
+
 from fastapi import APIRouter, HTTPException, Query
+from fastapi.concurrency import run_in_threadpool
 from pydantic import BaseModel
 
+from app.core.config import get_settings
+from app.models.task import TaskStatus
+from app.services.history_query import TaskFilters
 from app.services.inference import inference_service
 from app.schemas.inference import HistoryListResponse, HistoryRecord, StatsInfo
 
 router = APIRouter(prefix="/history", tags=["历史记录"])
+settings = get_settings()
 
 
 class BatchDeleteRequest(BaseModel):
     ids: list[str]
 
 
+def _utc_naive(value: Optional[datetime]) -> Optional[datetime]:
+    """数据库中的时间是不带时区的 UTC，带时区的查询参数先换算"""
+    if value is None or value.tzinfo is None:
+        return value
+    return value.astimezone(timezone.utc).replace(tzinfo=None)
+
+
 @router.get("", response_model=HistoryListResponse)
 async def get_history_list(
     page: int = Query(default=1, ge=1),
     pageSize: int = Query(default=20, ge=1, le=100),
+    cursor: Optional[str] = Query(default=None),
+    status: Optional[TaskStatus] = Query(default=None),
+    createdFrom: Optional[datetime] = Query(default=None),
+    createdTo: Optional[datetime] = Query(default=None),
+    filename: Optional[str] = Query(default=None, max_length=255),
+    minTumorVolume: Optional[float] = Query(default=None, ge=0),
+    maxTumorVolume: Optional[float] = Query(default=None, ge=0),
 ):
     """
-    获取历史记录列表
+    获取历史记录列表 (按创建时间倒序)
 
-    - **page**: 页码 (从1开始)
+    - **page**: 页码 (从1开始)，传入 cursor 时忽略；按页码最多跳过 history_max_offset 条记录，更深的页需用 cursor
     - **pageSize**: 每页数量
+    - **cursor**: 上一页响应中的 nextCursor，深度翻页时不再随页码变慢
+    - **status**: 按任务状态过滤
+    - **createdFrom** / **createdTo**: 创建时间范围 (UTC，左闭右开)
+    - **filename**: 文件名前缀
+    - **minTumorVolume** / **maxTumorVolume**: 肿瘤体积范围 (mm³)
     """
-    tasks, total = inference_service.get_task_list(page, pageSize)
+    if not cursor and (page - 1) * pageSize > settings.history_max_offset:
+        # OFFSET 要逐条扫过被跳过的记录，深度翻页只走游标
+        raise HTTPException(status_code=400, detail="页码过深，请使用 cursor 翻页")
+
+    filters = TaskFilters(
+        status=status,
+        created_from=_utc_naive(createdFrom),
+        created_to=_utc_naive(createdTo),
+        filename_prefix=filename or None,
+        min_tumor_volume=minTumorVolume,
+        max_tumor_volume=maxTumorVolume,
+    )
+    try:
+        tasks, total, next_cursor = await inference_service.get_task_list_async(page, pageSize, filters, cursor)
+    except ValueError:
+        raise HTTPException(status_code=400, detail="无效的分页游标")
 
     records = []
     for task in tasks:
@@ -34,16 +76,13 @@ async def get_history_list(
             filename=task.filename,
             uploadTime=task.created_at.isoformat() if task.created_at else "",
             status=task.status.value,
-            stats=StatsInfo(
-                kidneyVolume=task.kidney_volume,
-                tumorVolume=task.tumor_volume,
-                processingTime=task.processing_time,
-            ) if task.kidney_volume is not None else None,
+            stats=StatsInfo.from_task(task) if task.kidney_volume is not None else None,
             originalUrl=f"/files/{task.id}/original.nii.gz",
-            segmentationUrl=f"/files/{task.id}/segmentation.nii.gz" if task.segmentation_path else None,
+            segmentationUrl=f"/files/{task.id}/segmentation.nii.gz?v={task.generation or 0}" if task.segmentation_path else None,
+            segmentationEvicted=task.status == TaskStatus.COMPLETED and not task.segmentation_path,
         ))
 
-    return HistoryListResponse(total=total, records=records)
+    return HistoryListResponse(total=total, records=records, nextCursor=next_cursor)
 
 
 @router.get("/{record_id}", response_model=HistoryRecord)
@@ -53,7 +92,7 @@ async def get_history_record(record_id: str):
 
     - **record_id**: 记录 ID
     """
-    task = inference_service.get_task(record_id)
+    task = await inference_service.get_task_async(record_id)
     if not task:
         raise HTTPException(status_code=404, detail="记录不存在")
 
@@ -62,13 +101,10 @@ async def get_history_record(record_id: str):
         filename=task.filename,
         uploadTime=task.created_at.isoformat() if task.created_at else "",
         status=task.status.value,
-        stats=StatsInfo(
-            kidneyVolume=task.kidney_volume,
-            tumorVolume=task.tumor_volume,
-            processingTime=task.processing_time,
-        ) if task.kidney_volume is not None else None,
+        stats=StatsInfo.from_task(task) if task.kidney_volume is not None else None,
         originalUrl=f"/files/{task.id}/original.nii.gz",
-        segmentationUrl=f"/files/{task.id}/segmentation.nii.gz" if task.segmentation_path else None,
+        segmentationUrl=f"/files/{task.id}/segmentation.nii.gz?v={task.generation or 0}" if task.segmentation_path else None,
+        segmentationEvicted=task.status == TaskStatus.COMPLETED and not task.segmentation_path,
     )
 
 
@@ -79,7 +115,7 @@ async def delete_history_record(record_id: str):
 
     - **record_id**: 记录 ID
     """
-    success = inference_service.delete_task(record_id)
+    success = await run_in_threadpool(inference_service.delete_task, record_id)
     if not success:
         raise HTTPException(status_code=404, detail="记录不存在")
 
@@ -91,11 +127,25 @@ async def batch_delete_history(request: BatchDeleteRequest):
     """
     批量删除历史记录
 
+    数据库记录在一个事务中删除，任务目录由后台回收，接口立即返回回收作业 ID，
+    可通过 GET /history/reclaim-jobs/{jobId} 查询回收进度。
+
     - **ids**: 要删除的记录 ID 列表
     """
-    deleted = 0
-    for record_id in request.ids:
-        if inference_service.delete_task(record_id):
-            deleted += 1
+    deleted, job = await run_in_threadpool(inference_service.delete_tasks, request.ids)
+
+    return {"message": f"已删除 {len(deleted)} 条记录", "deleted": len(deleted), "jobId": job.id}
+
+
+@router.get("/reclaim-jobs/{job_id}")
+async def get_reclaim_job(job_id: str):
+    """
+    查询文件回收作业状态
+
+    - **job_id**: 批量删除返回的 jobId
+    """
+    job = inference_service.reclaimer.get(job_id)
+    if not job:
+        raise HTTPException(status_code=404, detail="回收作业不存在")
 
-    return {"message": f"已删除 {deleted} 条记录"}
+    return job.to_dict()
@@ -1,15 +1,27 @@
 """
 推理 API 路由
 """
+import asyncio
+import hashlib
+import json
 import shutil
+import time
+import uuid
 from pathlib import Path
-from fastapi import APIRouter, UploadFile, File, HTTPException, Query
-from fastapi.responses import FileResponse
+from typing import Tuple
+from fastapi import APIRouter, UploadFile, File, HTTPException, Query, Request
+from fastapi.concurrency import run_in_threadpool
+from fastapi.responses import FileResponse, StreamingResponse
 
 from app.core.config import get_settings
+from app.services.eta import AdmissionRejected
+from app.services.events import task_events
 from app.services.inference import inference_service
+from app.services.metrics import admission_rejected
 from app.models.task import TaskStatus
 from app.schemas.inference import (
+    InferenceBatchRequest,
+    InferenceBatchResponse,
     InferenceStartResponse,
     InferenceStatusResponse,
     InferenceResultResponse,
@@ -20,10 +32,11 @@ router = APIRouter(prefix="/inference", tags=["推理"])
 settings = get_settings()
 
 
-async def _save_upload_file(file: UploadFile, dest: Path, max_size: int) -> int:
-    """逐块写入上传文件，避免一次性读入内存"""
+async def _save_upload_file(file: UploadFile, dest: Path, max_size: int) -> Tuple[int, str]:
+    """逐块写入上传文件，避免一次性读入内存；边写边计算 sha256，返回 (大小, 摘要)"""
     chunk_size = 8 * 1024 * 1024  # 8MB
     total = 0
+    digest = hashlib.sha256()
     with open(dest, "wb") as f:
         while True:
             chunk = await file.read(chunk_size)
@@ -35,9 +48,33 @@ async def _save_upload_file(file: UploadFile, dest: Path, max_size: int) -> int:
                     status_code=400,
                     detail=f"文件大小超过限制 ({max_size // 1024 // 1024}MB)"
                 )
+            digest.update(chunk)
             f.write(chunk)
     await file.seek(0)
-    return total
+    return total, digest.hexdigest()
+
+
+async def _admit(task_ids: list, use_cache: bool = True) -> dict:
+    """准入检查并返回各任务的预计完成时间 (秒)；排队等待超过上限时返回 429/503 并带 Retry-After"""
+    try:
+        return await run_in_threadpool(inference_service.admit, task_ids, use_cache)
+    except AdmissionRejected as e:
+        admission_rejected.inc(code=str(e.status_code))
+        raise HTTPException(status_code=e.status_code, detail=str(e), headers={"Retry-After": str(e.retry_after)})
+
+
+def _ensure_not_running(task_id: str):
+    """
+    已取消的任务在旧批次结束前不能重新启动: 旧批次结束时会清理 input/、output/ 和分割结果，
+    这些路径此时已属于新的推理
+    """
+    if inference_service.is_running(task_id):
+        raise HTTPException(status_code=409, detail=f"任务上一次推理仍在结束中，请稍后重试: {task_id}")
+
+
+def _upload_temp_path(filename: str) -> Path:
+    """临时文件名加随机前缀，避免同名文件并发上传互相覆盖"""
+    return settings.temp_dir / f"{uuid.uuid4().hex}_{Path(filename).name}"
 
 
 @router.post("/upload", response_model=InferenceStartResponse)
@@ -58,10 +95,13 @@ async def upload_file_only(
             detail=f"不支持的文件格式，请上传 {settings.allowed_extensions}"
         )
 
-    temp_path = settings.temp_dir / file.filename
+    temp_path = _upload_temp_path(file.filename)
     try:
-        await _save_upload_file(file, temp_path, settings.max_upload_size)
-        task_id = inference_service.create_task(file.filename, temp_path)
+        upload_start = time.time()
+        _, digest = await _save_upload_file(file, temp_path, settings.max_upload_size)
+        task_id = await run_in_threadpool(
+            inference_service.create_task, file.filename, temp_path, digest, time.time() - upload_start
+        )
         return InferenceStartResponse(
             taskId=task_id,
             status="queued",
@@ -77,47 +117,91 @@ async def start_inference_task(task_id: str):
     """
     根据已上传的任务 ID 启动推理
     """
-    task = inference_service.get_task(task_id)
+    task = await inference_service.get_task_async(task_id)
     if not task:
         raise HTTPException(status_code=404, detail="任务不存在")
 
     if task.status == TaskStatus.PROCESSING:
         raise HTTPException(status_code=400, detail="任务正在处理中")
+    _ensure_not_running(task_id)
+
+    etas = await _admit([task_id])
 
     # 重置状态并清理旧产物后启动
-    inference_service.prepare_task_for_run(task_id, message="排队中...")
-    inference_service.start_inference(task_id)
+    await run_in_threadpool(inference_service.prepare_task_for_run, task_id, "排队中...")
+    status = await run_in_threadpool(inference_service.start_inference, task_id)
     return InferenceStartResponse(
         taskId=task_id,
-        status="queued",
-        estimatedTime=120,
+        status=status.value,
+        estimatedTime=0 if status == TaskStatus.COMPLETED else etas.get(task_id, 0),
     )
 
 
 @router.post("/{task_id}/retry", response_model=InferenceStartResponse)
 async def retry_inference_task(task_id: str):
     """
-    对已失败/已完成的任务重新发起推理，无需重新上传
+    对已失败/已完成/已取消的任务重新发起推理，无需重新上传
     """
-    task = inference_service.get_task(task_id)
+    task = await inference_service.get_task_async(task_id)
     if not task:
         raise HTTPException(status_code=404, detail="任务不存在")
 
     if task.status == TaskStatus.PROCESSING:
         raise HTTPException(status_code=400, detail="任务正在处理中")
 
-    if task.status not in (TaskStatus.FAILED, TaskStatus.COMPLETED, TaskStatus.QUEUED):
+    if task.status not in (TaskStatus.FAILED, TaskStatus.COMPLETED, TaskStatus.QUEUED, TaskStatus.CANCELLED):
         raise HTTPException(status_code=400, detail=f"当前状态不支持重试: {task.status.value}")
+    _ensure_not_running(task_id)
 
-    inference_service.prepare_task_for_run(task_id, message="重新排队中...")
-    inference_service.start_inference(task_id)
+    # 重试时跳过结果缓存，强制重新推理
+    etas = await _admit([task_id], use_cache=False)
+    await run_in_threadpool(inference_service.prepare_task_for_run, task_id, "重新排队中...")
+    status = await run_in_threadpool(inference_service.start_inference, task_id, False)
     return InferenceStartResponse(
         taskId=task_id,
-        status="queued",
-        estimatedTime=120,
+        status=status.value,
+        estimatedTime=etas.get(task_id, 0),
     )
 
 
+@router.post("/batch", response_model=InferenceBatchResponse)
+async def start_inference_batch(body: InferenceBatchRequest):
+    """
+    批量启动已上传任务的推理
+
+    任务一次性入队，工作线程按 inference_batch_size 整批领取，模型只加载一次，
+    病例之间预处理与推理流水线执行，结果分别写回各自的任务目录。
+    """
+    task_ids = list(dict.fromkeys(body.taskIds))
+    if not task_ids:
+        raise HTTPException(status_code=400, detail="任务列表不能为空")
+
+    for task_id in task_ids:
+        task = await inference_service.get_task_async(task_id)
+        if not task:
+            raise HTTPException(status_code=404, detail=f"任务不存在: {task_id}")
+        if task.status == TaskStatus.PROCESSING:
+            raise HTTPException(status_code=400, detail=f"任务正在处理中: {task_id}")
+        _ensure_not_running(task_id)
+
+    etas = await _admit(task_ids)
+
+    def prepare_and_start():
+        for task_id in task_ids:
+            inference_service.prepare_task_for_run(task_id, message="批量排队中...")
+        return inference_service.start_inference_batch(task_ids)
+
+    statuses = await run_in_threadpool(prepare_and_start)
+    return InferenceBatchResponse(tasks=[
+        InferenceStartResponse(
+            taskId=task_id,
+            status=status.value,
+            estimatedTime=0 if status == TaskStatus.COMPLETED else etas.get(task_id, 0),
+        )
+        for task_id, status in statuses.items()
+    ])
+
+
 @router.post("/start", response_model=InferenceStartResponse)
 async def start_inference(
     file: UploadFile = File(...),
@@ -140,21 +224,30 @@ async def start_inference(
             detail=f"不支持的文件格式，请上传 {settings.allowed_extensions}"
         )
 
+    # 积压已超限时在接收文件之前拒绝
+    await _admit([])
+
     # 保存上传文件
-    temp_path = settings.temp_dir / file.filename
+    temp_path = _upload_temp_path(file.filename)
     try:
-        await _save_upload_file(file, temp_path, settings.max_upload_size)
+        upload_start = time.time()
+        _, digest = await _save_upload_file(file, temp_path, settings.max_upload_size)
 
         # 创建任务
-        task_id = inference_service.create_task(file.filename, temp_path)
+        task_id = await run_in_threadpool(
+            inference_service.create_task, file.filename, temp_path, digest, time.time() - upload_start
+        )
+
+        # 文件已接收，不再拒绝，只预估完成时间
+        etas = await run_in_threadpool(inference_service.admit, [task_id], True, False)
 
-        # 启动异步推理
-        inference_service.start_inference(task_id)
+        # 启动异步推理 (命中结果缓存时直接完成)
+        status = await run_in_threadpool(inference_service.start_inference, task_id)
 
         return InferenceStartResponse(
             taskId=task_id,
-            status="queued",
-            estimatedTime=120,  # 预估2分钟
+            status=status.value,
+            estimatedTime=0 if status == TaskStatus.COMPLETED else etas.get(task_id, 0),
         )
 
     finally:
@@ -170,7 +263,7 @@ async def get_inference_status(task_id: str):
 
     - **task_id**: 任务 ID
     """
-    task = inference_service.get_task(task_id)
+    task = await inference_service.get_task_async(task_id)
     if not task:
         raise HTTPException(status_code=404, detail="任务不存在")
 
@@ -182,6 +275,60 @@ async def get_inference_status(task_id: str):
     )
 
 
+def _format_sse(event: dict) -> str:
+    return f"event: status\ndata: {json.dumps(event, ensure_ascii=False)}\n\n"
+
+
+@router.get("/{task_id}/events")
+async def stream_inference_events(task_id: str, request: Request):
+    """
+    以 Server-Sent Events 推送任务状态/进度变化
+
+    连接建立时先推送一次当前状态，之后只在状态变化时推送，任务结束 (completed/failed/cancelled) 后关闭。
+
+    - **task_id**: 任务 ID
+    """
+    # 先订阅再读快照，避免两者之间的状态变化丢失
+    queue = task_events.subscribe(task_id)
+    task = await inference_service.get_task_async(task_id)
+    if not task:
+        task_events.unsubscribe(task_id, queue)
+        raise HTTPException(status_code=404, detail="任务不存在")
+
+    terminal = {TaskStatus.COMPLETED.value, TaskStatus.FAILED.value, TaskStatus.CANCELLED.value}
+    snapshot = {
+        "taskId": task.id,
+        "status": task.status.value,
+        "progress": task.progress,
+        "message": task.message,
+    }
+
+    async def event_generator():
+        try:
+            yield _format_sse(snapshot)
+            if snapshot["status"] in terminal:
+                return
+            while True:
+                try:
+                    event = await asyncio.wait_for(queue.get(), timeout=settings.sse_keepalive_interval)
+                except asyncio.TimeoutError:
+                    if await request.is_disconnected():
+                        return
+                    yield ": keepalive\n\n"
+                    continue
+                yield _format_sse(event)
+                if event["status"] in terminal:
+                    return
+        finally:
+            task_events.unsubscribe(task_id, queue)
+
+    return StreamingResponse(
+        event_generator(),
+        media_type="text/event-stream",
+        headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"},
+    )
+
+
 @router.get("/{task_id}/result", response_model=InferenceResultResponse)
 async def get_inference_result(task_id: str):
     """
@@ -189,33 +336,54 @@ async def get_inference_result(task_id: str):
 
     - **task_id**: 任务 ID
     """
-    task = inference_service.get_task(task_id)
+    task = await inference_service.get_task_async(task_id)
     if not task:
         raise HTTPException(status_code=404, detail="任务不存在")
 
     if task.status != TaskStatus.COMPLETED:
         raise HTTPException(status_code=400, detail=f"任务未完成，当前状态: {task.status.value}")
 
+    evicted = not task.segmentation_path
     return InferenceResultResponse(
         taskId=task.id,
         originalUrl=f"/files/{task_id}/original.nii.gz",
-        segmentationUrl=f"/files/{task_id}/segmentation.nii.gz",
-        stats=StatsInfo(
-            kidneyVolume=task.kidney_volume,
-            tumorVolume=task.tumor_volume,
-            processingTime=task.processing_time,
-        ),
+        # 按代数区分，重新推理后不命中浏览器缓存；分割已回收时只返回原始影像
+        segmentationUrl=None if evicted else f"/files/{task_id}/segmentation.nii.gz?v={task.generation or 0}",
+        segmentationEvicted=evicted,
+        stats=StatsInfo.from_task(task),
+    )
+
+
+@router.post("/{task_id}/cancel", response_model=InferenceStatusResponse)
+async def cancel_inference_task(task_id: str):
+    """
+    取消排队中 / 处理中的推理任务，保留上传文件，之后可以重试
+
+    处理中的任务在滑窗的下一个区块处停止，工作线程随即空闲；已结束的任务保持原状态。
+
+    - **task_id**: 任务 ID
+    """
+    status = await run_in_threadpool(inference_service.cancel_task, task_id)
+    if status is None:
+        raise HTTPException(status_code=404, detail="任务不存在")
+
+    task = await inference_service.get_task_async(task_id)
+    return InferenceStatusResponse(
+        taskId=task_id,
+        status=status.value,
+        progress=task.progress if task else 0,
+        message=task.message if task else None,
     )
 
 
 @router.delete("/{task_id}")
 async def cancel_inference(task_id: str):
     """
-    取消/删除推理任务
+    取消/删除推理任务 (处理中的推理会先中止)
 
     - **task_id**: 任务 ID
     """
-    success = inference_service.delete_task(task_id)
+    success = await run_in_threadpool(inference_service.delete_task, task_id)
     if not success:
         raise HTTPException(status_code=404, detail="任务不存在")
 
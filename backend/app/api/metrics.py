@@ -0,0 +1,49 @@
+"""
+监控指标 API 路由
+"""
+from datetime import datetime, timedelta
+
+from fastapi import APIRouter, Query
+from fastapi.concurrency import run_in_threadpool
+from fastapi.responses import PlainTextResponse
+
+from app.schemas.metrics import LatencyResponse, StageLatency
+from app.services import metrics
+from app.services.inference import inference_service
+from app.services.timings import latency_percentiles
+
+router = APIRouter(prefix="/metrics", tags=["监控"])
+
+
+@router.get("", response_class=PlainTextResponse)
+async def get_metrics():
+    """
+    Prometheus 文本格式指标
+
+    任务数按状态、处理中任务数、工作线程占用、各路由请求耗时直方图、响应字节数、
+    预览金字塔命中/未命中、推理阶段耗时直方图、预计排队等待、准入拒绝次数
+    """
+    counts = await run_in_threadpool(inference_service.count_tasks_by_status)
+    for status, count in counts.items():
+        metrics.tasks_by_status.set(count, status=status)
+    queue = inference_service.queue
+    metrics.tasks_in_flight.set(queue.in_flight)
+    metrics.workers_busy.set(queue.busy_workers)
+    metrics.workers_total.set(inference_service.settings.inference_workers)
+    metrics.queue_wait.set(await run_in_threadpool(inference_service.estimator.backlog))
+    return PlainTextResponse(metrics.registry.render(), media_type="text/plain; version=0.0.4")
+
+
+@router.get("/latency", response_model=LatencyResponse)
+async def get_stage_latency(
+    hours: float = Query(default=24, gt=0, le=24 * 90, description="统计最近多少小时"),
+):
+    """
+    各推理阶段耗时的 p50/p95/p99 (秒)
+
+    阶段: upload、queue_wait、model_load、lock_wait、preprocess、inference、export、postprocess、stats、preview
+    """
+    until = datetime.utcnow()
+    since = until - timedelta(hours=hours)
+    rows = await run_in_threadpool(latency_percentiles, since, until)
+    return LatencyResponse(since=since, until=until, stages=[StageLatency(**row) for row in rows])
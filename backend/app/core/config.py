@@ -46,6 +46,12 @@ class Settings(BaseSettings):
 
     # 数据库
     database_url: str = f"sqlite:///{(BACKEND_DIR / 'data' / 'kidney_tumor.db').as_posix()}"
+    sqlite_wal: bool = True  # WAL 模式: 读不阻塞写，工作线程写进度时 API 仍可并发读
+    sqlite_busy_timeout_ms: int = 5000  # 遇到写锁时等待而不是立即报 database is locked
+    history_count_ttl: float = 30.0  # 历史记录总数按过滤条件缓存的时长 (秒)
+    history_count_cache_size: int = 256  # 历史记录总数最多缓存多少组过滤条件
+    history_max_offset: int = 10000  # 不带游标时按页码最多跳过的记录数，更深的页必须用游标翻页
+    progress_flush_interval: float = 1.0  # 推理进度先写内存，按该间隔批量落库 (秒)
 
     # 推理配置
     default_fold: int = 0
@@ -54,6 +60,50 @@ class Settings(BaseSettings):
     trainer_class: str = "nnUNetTrainerV2"
     plans_identifier: str = "nnUNetPlansv2.1"
     default_checkpoint: str = "auto"  # auto -> 优先 model_best，缺失则用 model_final_checkpoint
+    inference_timeout: int = 600  # 单个任务推理超时 (秒)
+    enable_tta: bool = False  # 测试时增强 (镜像)，关闭以加快速度
+    tta_mirror_axes: list = []  # 只沿这些轴镜像 (0/1/2，如 [2])，空表示训练时的全部镜像轴；每多一个轴推理量翻倍
+    step_size: float = 0.5  # 滑窗步长 (相对 patch 大小)
+    tile_batch_size: int = 0  # 每次前向推理的滑窗区块数，0 表示按 patch 大小自动选择，1 即逐块推理
+    device_aggregation_mb: int = 2048  # 滑窗结果在设备上累加可用的显存 (MB)，超出时在主机内存中累加，0 表示始终在主机
+    skip_background_tiles: bool = True  # 跳过体表掩膜以外 (空气、检查床) 的滑窗区块，这些体素直接判为背景
+
+    # 结果缓存: 相同输入 + 相同模型配置直接复用已完成任务的分割结果
+    result_cache_enabled: bool = True
+
+    # 常驻推理服务: 模型只加载一次，任务通过 Unix socket 提交，不再每次启动 eval.py
+    model_server_enabled: bool = True
+    model_server_socket: Path = BACKEND_DIR / "data" / "model_server.sock"
+    model_server_stand_in: bool = False  # True -> 使用 CPU 替身模型，无需 GPU/MindSpore
+    model_server_startup_timeout: int = 300  # 等待模型加载完成的超时 (秒)
+
+    # 持久化任务队列
+    inference_workers: int = 2  # 并发推理的工作线程数
+    inference_batch_size: int = 4  # 工作线程一次领取并合并预测的最大任务数 (模型只加载一次)
+    queue_poll_interval: float = 2.0  # 空闲时轮询数据库的间隔 (秒)
+    task_heartbeat_interval: float = 10.0  # 处理中任务的心跳间隔 (秒)
+    task_lease_seconds: float = 60.0  # 心跳超过该时长未更新视为孤儿任务，重新入队
+    task_max_attempts: int = 3  # 超过该领取次数的孤儿任务直接标记失败
+
+    # 耗时预估与准入控制
+    eta_default_tile_seconds: float = 1.0  # 没有历史记录时每个滑窗区块的耗时 (秒)
+    eta_default_overhead: float = 30.0  # 没有历史记录时区块推理以外的耗时 (预处理/导出/统计/预览，秒)
+    eta_smoothing: float = 0.2  # 新完成任务在吞吐滑动平均中的权重
+    eta_history_size: int = 50  # 启动时用最近多少个已完成任务估计吞吐
+    admission_max_wait: float = 0.0  # 预计排队等待超过该时长 (秒) 时拒绝新任务 (429/503 + Retry-After)，0 不限制
+
+    # 状态推送 (SSE)
+    sse_keepalive_interval: float = 15.0  # 无事件时发送心跳注释的间隔 (秒)，防止代理断开空闲连接
+
+    # 预览 (降采样) 生成
+    preview_workers: int = 2  # 预览生成进程数
+
+    # 磁盘容量管理: 各层超出预算 (字节，0 不限制) 时按最近访问时间回收，处理中/排队中的任务不回收
+    storage_budget_original: int = 0  # 上传的原始影像 (按内容去重后的文件)
+    storage_budget_segmentation: int = 0  # 分割结果
+    storage_budget_preview: int = 0  # 预览金字塔 (缺失时会按需重新生成)
+    storage_check_interval: float = 600.0  # 后台回收间隔 (秒)
+    storage_scratch_max_age: float = 86400.0  # temp 目录下残留的批量推理目录超过该时长即删除 (秒)
 
     # 文件限制
     max_upload_size: int = 1024 * 1024 * 1024  # 1GB
@@ -136,6 +186,7 @@ class Settings(BaseSettings):
         self.upload_dir = _resolve_path(Path(self.upload_dir))
         self.result_dir = _resolve_path(Path(self.result_dir))
         self.temp_dir = _resolve_path(Path(self.temp_dir))
+        self.model_server_socket = _resolve_path(Path(self.model_server_socket))
         self.results_folder = _resolve_str(self.results_folder)
         self.nnunet_raw_data_base = _resolve_str(self.nnunet_raw_data_base)
         self.nnunet_preprocessed = _resolve_str(self.nnunet_preprocessed)
@@ -1,10 +1,10 @@
 """
 数据库连接管理
 """
-from sqlalchemy import create_engine
+from sqlalchemy import create_engine, event, inspect, text
 from sqlalchemy.orm import sessionmaker
 from sqlalchemy.ext.asyncio import create_async_engine, AsyncSession
-from contextlib import contextmanager
+from contextlib import asynccontextmanager, contextmanager
 
 from app.core.config import get_settings
 from app.models.task import Base
@@ -23,6 +23,31 @@ async_engine = create_async_engine(
     echo=settings.debug,
 )
 
+
+def configure_sqlite(engine):
+    """
+    每个新连接设置 SQLite pragma
+
+    WAL 下读写互不阻塞；synchronous=NORMAL 在 WAL 下仍保证崩溃一致性，只是断电时可能丢最后几次提交。
+    """
+    if engine.dialect.name != "sqlite":
+        return
+
+    @event.listens_for(engine, "connect")
+    def _set_pragmas(dbapi_connection, connection_record):
+        cursor = dbapi_connection.cursor()
+        if settings.sqlite_wal:
+            cursor.execute("PRAGMA journal_mode=WAL")
+            cursor.execute("PRAGMA synchronous=NORMAL")
+        cursor.execute(f"PRAGMA busy_timeout={int(settings.sqlite_busy_timeout_ms)}")
+        cursor.execute("PRAGMA temp_store=MEMORY")
+        cursor.execute("PRAGMA cache_size=-16000")  # 约 16MB 页缓存
+        cursor.close()
+
+
+configure_sqlite(sync_engine)
+configure_sqlite(async_engine.sync_engine)
+
 # Session 工厂
 SyncSessionLocal = sessionmaker(bind=sync_engine)
 AsyncSessionLocal = sessionmaker(
@@ -35,6 +60,24 @@ AsyncSessionLocal = sessionmaker(
 def init_db():
     """初始化数据库"""
     Base.metadata.create_all(bind=sync_engine)
+    migrate_schema(sync_engine)
+
+
+def migrate_schema(engine):
+    """create_all 不会修改已存在的表，这里为旧数据库补齐新增的列和索引"""
+    inspector = inspect(engine)
+    for table in Base.metadata.sorted_tables:
+        if not inspector.has_table(table.name):
+            continue
+        existing_columns = {c["name"] for c in inspector.get_columns(table.name)}
+        with engine.begin() as conn:
+            for column in table.columns:
+                if column.name in existing_columns:
+                    continue
+                column_type = column.type.compile(dialect=engine.dialect)
+                conn.execute(text(f"ALTER TABLE {table.name} ADD COLUMN {column.name} {column_type}"))
+            for index in table.indexes:
+                index.create(bind=conn, checkfirst=True)
 
 
 @contextmanager
@@ -55,3 +98,10 @@ async def get_async_session():
     """获取异步 Session (用于依赖注入)"""
     async with AsyncSessionLocal() as session:
         yield session
+
+
+@asynccontextmanager
+async def get_async_read_session():
+    """获取异步 Session (服务层只读查询，不阻塞事件循环)"""
+    async with AsyncSessionLocal() as session:
+        yield session
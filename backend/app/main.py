@@ -1,13 +1,19 @@
 """
 KidneyTumorAI 后端主应用
 """
-from fastapi import FastAPI
+import threading
+import time
+
+from fastapi import FastAPI, Request
 from fastapi.middleware.cors import CORSMiddleware
 from fastapi.middleware.gzip import GZipMiddleware
 
 from app.core.config import get_settings
 from app.core.database import init_db
-from app.api import inference, history, files
+from app.api import inference, history, files, metrics
+from app.services.inference import inference_service
+from app.services.metrics import http_request_duration, http_response_bytes, router_label
+from app.services.preview import preview_service
 
 settings = get_settings()
 
@@ -35,6 +41,25 @@ app.add_middleware(
 )
 
 
+# 请求耗时 / 响应字节数指标 (按路由模块统计，流式响应只计到响应头发出)
+@app.middleware("http")
+async def record_request_metrics(request: Request, call_next):
+    start = time.perf_counter()
+    router = router_label(request.url.path)
+    status = 500
+    try:
+        response = await call_next(request)
+        status = response.status_code
+        length = response.headers.get("content-length")
+        if length:
+            http_response_bytes.inc(int(length), router=router)
+        return response
+    finally:
+        http_request_duration.observe(
+            time.perf_counter() - start, router=router, method=request.method, status=status
+        )
+
+
 # 启动事件
 @app.on_event("startup")
 async def startup_event():
@@ -45,12 +70,25 @@ async def startup_event():
     print(f"Model path: {settings.model_path}")
     print(f"Upload dir: {settings.upload_dir}")
     print(f"Result dir: {settings.result_dir}")
+    inference_service.start_workers()
+    if settings.model_server_enabled:
+        # 后台预热常驻推理服务，避免阻塞启动
+        threading.Thread(target=inference_service.warm_up, daemon=True).start()
+
+
+@app.on_event("shutdown")
+async def shutdown_event():
+    """应用关闭时停止工作线程、常驻推理服务和预览进程池"""
+    inference_service.stop_workers()
+    inference_service.shutdown()
+    preview_service.shutdown()
 
 
 # 注册路由
 app.include_router(inference.router, prefix="/api/v1")
 app.include_router(history.router, prefix="/api/v1")
 app.include_router(files.router)  # 文件路由不加 api/v1 前缀
+app.include_router(metrics.router)  # 监控指标同样挂在根路径
 
 # 兼容部分反向代理剥掉 /api 前缀的场景，提供 /v1* 备用入口
 app.include_router(inference.router, prefix="/v1")
@@ -1,2 +1,2 @@
 # models package
-from .task import InferenceTask, TaskStatus, Base
+from .task import InferenceTask, StorageEntry, TaskStageTiming, TaskStatus, Base
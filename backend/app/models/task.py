@@ -2,7 +2,7 @@
 数据库模型
 """
 from datetime import datetime
-from sqlalchemy import Column, String, Integer, Float, DateTime, Enum, Text
+from sqlalchemy import Column, String, Integer, BigInteger, Float, DateTime, Enum, Text, Index, JSON, ForeignKey
 from sqlalchemy.ext.declarative import declarative_base
 import enum
 
@@ -15,11 +15,23 @@ class TaskStatus(str, enum.Enum):
     PROCESSING = "processing"
     COMPLETED = "completed"
     FAILED = "failed"
+    CANCELLED = "cancelled"
 
 
 class InferenceTask(Base):
     """推理任务表"""
     __tablename__ = "inference_tasks"
+    __table_args__ = (
+        # 队列按 (status, queued_at) 领取任务
+        Index("ix_inference_tasks_queue", "status", "queued_at"),
+        # 结果缓存按 (cache_key, status) 查找已完成任务
+        Index("ix_inference_tasks_cache", "cache_key", "status"),
+        # 历史记录按 (created_at, id) 倒序游标分页，可先按状态过滤
+        Index("ix_inference_tasks_created", "created_at", "id"),
+        Index("ix_inference_tasks_status_created", "status", "created_at", "id"),
+        # 文件名前缀过滤
+        Index("ix_inference_tasks_filename", "filename"),
+    )
 
     id = Column(String(36), primary_key=True)
     filename = Column(String(255), nullable=False)
@@ -34,6 +46,26 @@ class InferenceTask(Base):
     kidney_volume = Column(Float, nullable=True)  # mm³
     tumor_volume = Column(Float, nullable=True)   # mm³
     processing_time = Column(Float, nullable=True)  # seconds
+    kidney_left_volume = Column(Float, nullable=True)   # mm³，不含肿瘤
+    kidney_right_volume = Column(Float, nullable=True)  # mm³，不含肿瘤
+    tumor_count = Column(Integer, nullable=True)
+    lesions = Column(JSON, nullable=True)  # [{"volume", "voxels", "bbox", "side"}]
+
+    # 内容寻址: 输入文件 sha256，以及 (输入 + 模型配置) 的结果缓存键
+    input_digest = Column(String(64), nullable=True)
+    cache_key = Column(String(64), nullable=True)
+
+    # 任务代数: 每次重新推理 +1，预览金字塔和结果 URL 按代数区分
+    generation = Column(Integer, default=0)
+
+    # 持久化队列: queued_at 非空表示已入队 (仅上传未启动的任务为空)
+    queued_at = Column(DateTime, nullable=True)
+    worker_id = Column(String(64), nullable=True)  # 当前租约持有者
+    heartbeat_at = Column(DateTime, nullable=True)  # 租约心跳
+    attempts = Column(Integer, default=0)  # 已领取次数
+
+    # 滑窗区块数: 上传时按 NIfTI 头预估，推理完成后改为实际值，用于耗时预估
+    num_tiles = Column(Integer, nullable=True)
 
     # 时间戳
     created_at = Column(DateTime, default=datetime.utcnow)
@@ -51,7 +83,43 @@ class InferenceTask(Base):
                 "kidneyVolume": self.kidney_volume,
                 "tumorVolume": self.tumor_volume,
                 "processingTime": self.processing_time,
+                "kidneyLeftVolume": self.kidney_left_volume,
+                "kidneyRightVolume": self.kidney_right_volume,
+                "tumorCount": self.tumor_count,
+                "lesions": self.lesions,
             } if self.kidney_volume is not None else None,
             "createdAt": self.created_at.isoformat() if self.created_at else None,
             "completedAt": self.completed_at.isoformat() if self.completed_at else None,
         }
+
+
+class TaskStageTiming(Base):
+    """任务各阶段耗时，每次推理每个阶段一行"""
+    __tablename__ = "task_stage_timings"
+    __table_args__ = (
+        # 按 (阶段, 时间窗口) 统计分位数
+        Index("ix_task_stage_timings_stage", "stage", "recorded_at"),
+    )
+
+    id = Column(Integer, primary_key=True, autoincrement=True)
+    task_id = Column(String(36), ForeignKey("inference_tasks.id"), nullable=False, index=True)
+    stage = Column(String(32), nullable=False)
+    duration = Column(Float, nullable=False)  # seconds
+    recorded_at = Column(DateTime, default=datetime.utcnow)
+
+
+class StorageEntry(Base):
+    """磁盘占用台账: 按存储层记录文件/目录大小和最近访问时间，容量回收不必遍历目录树"""
+    __tablename__ = "storage_entries"
+    __table_args__ = (
+        # 按层统计总量，并按最近访问时间 (LRU) 挑选回收对象
+        Index("ix_storage_entries_tier", "tier", "last_access_at"),
+    )
+
+    id = Column(Integer, primary_key=True, autoincrement=True)
+    tier = Column(String(16), nullable=False)  # original / segmentation / preview / scratch
+    path = Column(String(512), nullable=False, unique=True)
+    task_id = Column(String(36), nullable=True, index=True)  # 按摘要共享的原始文件为空
+    size_bytes = Column(BigInteger, default=0)
+    created_at = Column(DateTime, default=datetime.utcnow)
+    last_access_at = Column(DateTime, default=datetime.utcnow)
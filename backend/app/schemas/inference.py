@@ -13,6 +13,16 @@ class InferenceStartResponse(BaseModel):
     estimatedTime: int
 
 
+class InferenceBatchRequest(BaseModel):
+    """批量推理请求"""
+    taskIds: list[str]
+
+
+class InferenceBatchResponse(BaseModel):
+    """批量推理响应"""
+    tasks: list[InferenceStartResponse]
+
+
 class InferenceStatusResponse(BaseModel):
     """推理状态响应"""
     taskId: str
@@ -21,18 +31,43 @@ class InferenceStatusResponse(BaseModel):
     message: Optional[str] = None
 
 
+class LesionInfo(BaseModel):
+    """单个肿瘤病灶"""
+    volume: float  # mm³
+    voxels: int
+    bbox: list[list[int]]  # 体素下标 [[start, stop], ...]
+    side: Optional[str] = None  # left / right
+
+
 class StatsInfo(BaseModel):
     """统计信息"""
     kidneyVolume: Optional[float] = None
     tumorVolume: Optional[float] = None
     processingTime: Optional[float] = None
+    kidneyLeftVolume: Optional[float] = None
+    kidneyRightVolume: Optional[float] = None
+    tumorCount: Optional[int] = None
+    lesions: Optional[list[LesionInfo]] = None
+
+    @classmethod
+    def from_task(cls, task) -> "StatsInfo":
+        return cls(
+            kidneyVolume=task.kidney_volume,
+            tumorVolume=task.tumor_volume,
+            processingTime=task.processing_time,
+            kidneyLeftVolume=task.kidney_left_volume,
+            kidneyRightVolume=task.kidney_right_volume,
+            tumorCount=task.tumor_count,
+            lesions=task.lesions,
+        )
 
 
 class InferenceResultResponse(BaseModel):
     """推理结果响应"""
     taskId: str
     originalUrl: str
-    segmentationUrl: str
+    segmentationUrl: Optional[str] = None
+    segmentationEvicted: bool = False  # 分割结果已按存储预算回收，只能查看原始影像
     stats: StatsInfo
 
 
@@ -45,9 +80,11 @@ class HistoryRecord(BaseModel):
     stats: Optional[StatsInfo] = None
     originalUrl: str
     segmentationUrl: Optional[str] = None
+    segmentationEvicted: bool = False
 
 
 class HistoryListResponse(BaseModel):
     """历史记录列表响应"""
     total: int
     records: list[HistoryRecord]
+    nextCursor: Optional[str] = None  # 下一页游标，没有更多记录时为空
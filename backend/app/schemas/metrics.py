@@ -0,0 +1,25 @@
+"""
+监控指标 schemas
+"""
+from datetime import datetime
+from typing import Optional
+
+from pydantic import BaseModel
+
+
+class StageLatency(BaseModel):
+    """单个阶段的耗时分布 (秒)"""
+    stage: str
+    count: int
+    mean: float
+    p50: Optional[float] = None
+    p95: Optional[float] = None
+    p99: Optional[float] = None
+    max: float
+
+
+class LatencyResponse(BaseModel):
+    """分阶段耗时统计响应"""
+    since: datetime
+    until: datetime
+    stages: list[StageLatency]
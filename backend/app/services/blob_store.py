@@ -0,0 +1,30 @@
+"""
+内容寻址的文件存储
+
+上传文件按 sha256 摘要只保存一份，任务目录里的 original.nii.gz 通过硬链接指向它。
+"""
+from pathlib import Path
+
+from app.services.staging import link_or_copy
+
+
+class BlobStore:
+    """按摘要存放文件: <root>/<前两位>/<digest>.nii.gz"""
+
+    def __init__(self, root: Path):
+        self.root = Path(root)
+
+    def path_for(self, digest: str) -> Path:
+        return self.root / digest[:2] / f"{digest}.nii.gz"
+
+    def contains(self, digest: str) -> bool:
+        return self.path_for(digest).exists()
+
+    def put(self, src: Path, digest: str) -> Path:
+        """把 src 存入仓库 (已存在则跳过)，返回仓库内路径；src 保持不变"""
+        dest = self.path_for(digest)
+        if dest.exists():
+            return dest
+        # link_or_copy 先写入唯一的临时文件再原子替换，并发写入同一摘要时结果一致
+        link_or_copy(src, dest)
+        return dest
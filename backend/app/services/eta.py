@@ -0,0 +1,201 @@
+"""
+推理耗时预估与准入控制
+
+单个任务的耗时 = 滑窗区块数 x 每区块耗时 + 区块推理以外的固定开销 (预处理/导出/后处理/统计/预览)。
+
+- 区块数由 NIfTI 头 (形状、体素间距) 推算: 按 plans.pkl 的目标间距重采样后，按 patch 大小和 step_size 计算滑窗步数
+- 每区块耗时和固定开销来自本机已完成任务的历史记录 (启动时从数据库读取，之后按指数滑动平均更新)
+- 新任务的排队等待 = (排队中任务的预估耗时 + 处理中任务的剩余耗时) / 工作线程数
+
+预计排队等待超过 admission_max_wait 时拒绝新任务并返回 Retry-After，而不是让任务在队列里等到超时。
+"""
+import math
+import pickle
+import threading
+from dataclasses import dataclass
+from pathlib import Path
+from typing import Dict, List, Optional, Sequence, Tuple
+
+from sqlalchemy import func, select
+
+from app.core.database import get_sync_session
+from app.models.task import InferenceTask, TaskStageTiming, TaskStatus
+
+# 区块推理以外、按任务计入的阶段 (model_load 由常驻服务预热，不计入)
+OVERHEAD_STAGES = ("preprocess", "export", "postprocess", "stats", "preview")
+
+# 缺少 plans.pkl 时按 KiTS 3d_fullres 的默认配置估算 (nnU-Net 轴顺序 z, y, x)
+DEFAULT_PATCH_SIZE = (128, 128, 128)
+DEFAULT_TARGET_SPACING = (0.78125, 0.78125, 0.78125)
+# 没有历史数据时的典型区块数
+DEFAULT_TILES = 100
+
+
+class AdmissionRejected(Exception):
+    """预计排队等待超过 SLA: 503 表示积压已超限，429 表示本次提交的任务过多"""
+
+    def __init__(self, status_code: int, retry_after: int, wait: float):
+        self.status_code = status_code
+        self.retry_after = retry_after
+        self.wait = wait
+        super().__init__(f"预计排队等待 {int(wait)} 秒，超过上限，请 {retry_after} 秒后重试")
+
+
+@dataclass(frozen=True)
+class ModelPlan:
+    """滑窗推理的几何参数 (nnU-Net 轴顺序)"""
+    patch_size: Tuple[int, ...]
+    target_spacing: Tuple[float, ...]
+    transpose: Tuple[int, ...] = (0, 1, 2)
+
+
+def load_plan(model_path: Path) -> ModelPlan:
+    """读取模型目录下的 plans.pkl，取最高分辨率 stage；缺失或无法解析时使用默认配置"""
+    try:
+        with open(Path(model_path) / "plans.pkl", "rb") as f:
+            plans = pickle.load(f)
+        stages = plans["plans_per_stage"]
+        stage = stages[max(stages)]
+        return ModelPlan(
+            patch_size=tuple(int(s) for s in stage["patch_size"]),
+            target_spacing=tuple(float(s) for s in stage["current_spacing"]),
+            transpose=tuple(int(a) for a in plans.get("transpose_forward", (0, 1, 2))),
+        )
+    except Exception:
+        return ModelPlan(DEFAULT_PATCH_SIZE, DEFAULT_TARGET_SPACING)
+
+
+def read_geometry(image_path: Path) -> Tuple[Tuple[int, ...], Tuple[float, ...]]:
+    """只读 NIfTI 头，返回 nnU-Net 轴顺序 (z, y, x) 的形状和体素间距"""
+    import nibabel as nib
+
+    header = nib.load(str(image_path)).header
+    shape = tuple(int(s) for s in header.get_data_shape()[:3])
+    spacing = tuple(float(s) for s in header.get_zooms()[:3])
+    return shape[::-1], spacing[::-1]
+
+
+def sliding_window_tiles(shape: Sequence[int], spacing: Sequence[float], plan: ModelPlan, step_size: float) -> int:
+    """重采样到目标间距后的滑窗区块数 (与 _compute_steps_for_sliding_window 一致，小于 patch 的轴先补齐)"""
+    shape = [shape[axis] for axis in plan.transpose]
+    spacing = [spacing[axis] for axis in plan.transpose]
+    tiles = 1
+    for size, current, target, patch in zip(shape, spacing, plan.target_spacing, plan.patch_size):
+        resampled = max(int(round(size * current / target)), patch)
+        tiles *= int(math.ceil((resampled - patch) / (patch * step_size))) + 1
+    return tiles
+
+
+class RuntimeEstimator:
+    """按本机历史吞吐预估任务耗时和排队等待，线程安全"""
+
+    def __init__(self, settings):
+        self.settings = settings
+        self.tile_seconds = settings.eta_default_tile_seconds
+        self.overhead = settings.eta_default_overhead
+        self.typical_tiles = float(DEFAULT_TILES)
+        self._plan: Optional[ModelPlan] = None
+        self._lock = threading.Lock()
+
+    @property
+    def plan(self) -> ModelPlan:
+        if self._plan is None:
+            self._plan = load_plan(self.settings.model_path)
+        return self._plan
+
+    def count_tiles(self, image_path: Path) -> Optional[int]:
+        """影像的预计区块数，头信息无法读取时返回 None"""
+        try:
+            shape, spacing = read_geometry(image_path)
+        except Exception as e:
+            print(f"ETA: cannot read header of {image_path}: {e}")
+            return None
+        return sliding_window_tiles(shape, spacing, self.plan, self.settings.step_size)
+
+    def estimate(self, num_tiles: Optional[int]) -> float:
+        """单个任务从开始处理到完成的预计耗时 (秒)，区块数未知时按典型区块数估算"""
+        with self._lock:
+            tiles = self.typical_tiles if not num_tiles else num_tiles
+            return self.overhead + tiles * self.tile_seconds
+
+    def observe(self, num_tiles: Optional[int], timings: Dict[str, float]):
+        """用一个已完成任务的阶段耗时更新吞吐"""
+        alpha = self.settings.eta_smoothing
+        inference = timings.get("inference")
+        overhead = sum(timings.get(stage) or 0.0 for stage in OVERHEAD_STAGES)
+        with self._lock:
+            if num_tiles and inference is not None:
+                self.tile_seconds += alpha * (inference / num_tiles - self.tile_seconds)
+                self.typical_tiles += alpha * (num_tiles - self.typical_tiles)
+            self.overhead += alpha * (overhead - self.overhead)
+
+    def load_history(self):
+        """用最近 eta_history_size 个已完成任务的记录初始化吞吐"""
+        limit = max(1, self.settings.eta_history_size)
+        with get_sync_session() as session:
+            rows = session.execute(
+                select(InferenceTask.id, InferenceTask.num_tiles, TaskStageTiming.duration)
+                .join(TaskStageTiming, TaskStageTiming.task_id == InferenceTask.id)
+                .where(TaskStageTiming.stage == "inference", InferenceTask.num_tiles > 0)
+                .order_by(TaskStageTiming.recorded_at.desc())
+                .limit(limit)
+            ).all()
+            if not rows:
+                return
+            task_ids = [row.id for row in rows]
+            stage_means = session.execute(
+                select(func.avg(TaskStageTiming.duration))
+                .where(TaskStageTiming.task_id.in_(task_ids), TaskStageTiming.stage.in_(OVERHEAD_STAGES))
+                .group_by(TaskStageTiming.stage)
+            ).scalars().all()
+
+        total_tiles = sum(row.num_tiles for row in rows)
+        with self._lock:
+            self.tile_seconds = sum(row.duration for row in rows) / total_tiles
+            self.typical_tiles = total_tiles / len(rows)
+            if stage_means:
+                self.overhead = float(sum(stage_means))
+        print(f"ETA: {self.tile_seconds:.3f}s/tile, {self.overhead:.1f}s overhead from {len(rows)} tasks")
+
+    def backlog(self, exclude: Sequence[str] = ()) -> float:
+        """新任务开始处理前的预计等待 (秒): 已入队和处理中任务的剩余耗时按工作线程数分摊"""
+        with get_sync_session() as session:
+            query = select(InferenceTask.num_tiles, InferenceTask.status, InferenceTask.progress).where(
+                (InferenceTask.status == TaskStatus.PROCESSING)
+                | ((InferenceTask.status == TaskStatus.QUEUED) & InferenceTask.queued_at.isnot(None))
+            )
+            if exclude:
+                query = query.where(InferenceTask.id.notin_(list(exclude)))
+            rows = session.execute(query).all()
+
+        remaining = 0.0
+        for row in rows:
+            seconds = self.estimate(row.num_tiles)
+            if row.status == TaskStatus.PROCESSING:
+                seconds *= max(0.0, 1.0 - (row.progress or 0) / 100.0)
+            remaining += seconds
+        return remaining / max(1, self.settings.inference_workers)
+
+    def admit(self, estimates: List[float], exclude: Sequence[str] = (), enforce: bool = True) -> List[float]:
+        """
+        准入检查，返回每个新任务的预计排队等待 (秒)
+
+        新任务依次排在积压之后。积压本身已超过 admission_max_wait 时抛出 503，
+        积压未超限但本次提交的最后一个任务会超限时抛出 429；admission_max_wait 为 0 或 enforce=False 时不限制。
+        exclude 为本次提交的任务，重新提交已在队列中的任务时不重复计入积压。
+        """
+        workers = max(1, self.settings.inference_workers)
+        backlog = self.backlog(exclude)
+        waits = []
+        wait = backlog
+        for seconds in estimates:
+            waits.append(wait)
+            wait += seconds / workers
+
+        limit = self.settings.admission_max_wait
+        if enforce and limit > 0:
+            if backlog > limit:
+                raise AdmissionRejected(503, max(1, math.ceil(backlog - limit)), backlog)
+            if waits and waits[-1] > limit:
+                raise AdmissionRejected(429, max(1, math.ceil(waits[-1] - limit)), waits[-1])
+        return waits
@@ -0,0 +1,69 @@
+"""
+任务状态事件总线 (进程内发布/订阅)
+
+推理工作线程调用 publish()，SSE 连接在事件循环里 subscribe()。
+跨线程投递用 loop.call_soon_threadsafe，发布方不会被慢客户端阻塞。
+"""
+import asyncio
+import threading
+from collections import defaultdict
+from typing import Dict, Optional, Set, Tuple
+
+
+class TaskEventBus:
+    """按任务 ID 分发状态事件"""
+
+    def __init__(self, max_queue_size: int = 100):
+        self.max_queue_size = max_queue_size
+        self._lock = threading.Lock()
+        self._subscribers: Dict[str, Set[Tuple[asyncio.AbstractEventLoop, asyncio.Queue]]] = defaultdict(set)
+
+    def subscribe(self, task_id: str) -> asyncio.Queue:
+        """在事件循环中调用，返回接收该任务事件的队列"""
+        loop = asyncio.get_running_loop()
+        queue: asyncio.Queue = asyncio.Queue(maxsize=self.max_queue_size)
+        with self._lock:
+            self._subscribers[task_id].add((loop, queue))
+        return queue
+
+    def unsubscribe(self, task_id: str, queue: asyncio.Queue):
+        with self._lock:
+            subscribers = self._subscribers.get(task_id)
+            if not subscribers:
+                return
+            for item in list(subscribers):
+                if item[1] is queue:
+                    subscribers.discard(item)
+            if not subscribers:
+                del self._subscribers[task_id]
+
+    def subscriber_count(self, task_id: Optional[str] = None) -> int:
+        with self._lock:
+            if task_id is not None:
+                return len(self._subscribers.get(task_id, ()))
+            return sum(len(s) for s in self._subscribers.values())
+
+    def publish(self, task_id: str, event: dict):
+        """线程安全，可在任意线程调用"""
+        with self._lock:
+            subscribers = list(self._subscribers.get(task_id, ()))
+        for loop, queue in subscribers:
+            try:
+                loop.call_soon_threadsafe(self._deliver, queue, event)
+            except RuntimeError:
+                # 事件循环已关闭
+                self.unsubscribe(task_id, queue)
+
+    @staticmethod
+    def _deliver(queue: asyncio.Queue, event: dict):
+        if queue.full():
+            # 客户端跟不上时丢弃最旧的进度事件，只保留最新状态
+            try:
+                queue.get_nowait()
+            except asyncio.QueueEmpty:
+                pass
+        queue.put_nowait(event)
+
+
+# 单例
+task_events = TaskEventBus()
@@ -0,0 +1,114 @@
+"""
+历史记录查询: 游标分页、服务端过滤和总数缓存
+
+按 (created_at, id) 倒序做游标 (keyset) 分页，翻到多深都只扫描一页大小的索引区间；
+总数按过滤条件缓存一段时间，避免每次翻页都对全表 COUNT。
+"""
+import base64
+import threading
+import time
+from collections import OrderedDict
+from dataclasses import dataclass
+from datetime import datetime
+from typing import Callable, Optional, Tuple
+
+from sqlalchemy import and_, or_
+
+from app.models.task import InferenceTask, TaskStatus
+
+
+@dataclass(frozen=True)
+class TaskFilters:
+    """历史记录过滤条件，字段为 None 表示不过滤"""
+    status: Optional[TaskStatus] = None
+    created_from: Optional[datetime] = None
+    created_to: Optional[datetime] = None
+    filename_prefix: Optional[str] = None
+    min_tumor_volume: Optional[float] = None
+    max_tumor_volume: Optional[float] = None
+
+    def apply(self, stmt):
+        """给 select / Query 加上 WHERE 条件"""
+        if self.status is not None:
+            stmt = stmt.where(InferenceTask.status == self.status)
+        if self.created_from is not None:
+            stmt = stmt.where(InferenceTask.created_at >= self.created_from)
+        if self.created_to is not None:
+            stmt = stmt.where(InferenceTask.created_at < self.created_to)
+        if self.filename_prefix:
+            # 写成区间比较而不是 LIKE，SQLite 才能走 filename 索引 (区分大小写)
+            stmt = stmt.where(
+                InferenceTask.filename >= self.filename_prefix,
+                InferenceTask.filename < self.filename_prefix + "\U0010ffff",
+            )
+        if self.min_tumor_volume is not None:
+            stmt = stmt.where(InferenceTask.tumor_volume >= self.min_tumor_volume)
+        if self.max_tumor_volume is not None:
+            stmt = stmt.where(InferenceTask.tumor_volume <= self.max_tumor_volume)
+        return stmt
+
+
+def encode_cursor(task: InferenceTask) -> str:
+    """用一页最后一条记录的 (created_at, id) 生成下一页游标"""
+    raw = f"{task.created_at.isoformat()}|{task.id}"
+    return base64.urlsafe_b64encode(raw.encode("utf-8")).decode("ascii").rstrip("=")
+
+
+def decode_cursor(cursor: str) -> Tuple[datetime, str]:
+    """解析游标，格式不对时抛出 ValueError"""
+    try:
+        padded = cursor + "=" * (-len(cursor) % 4)
+        created_at, task_id = base64.urlsafe_b64decode(padded.encode("ascii")).decode("utf-8").split("|", 1)
+        return datetime.fromisoformat(created_at), task_id
+    except (ValueError, UnicodeError) as e:
+        raise ValueError(f"invalid cursor: {cursor}") from e
+
+
+def after_cursor(stmt, cursor: str):
+    """只取排在游标之后的记录 (按 created_at 倒序、id 倒序)"""
+    created_at, task_id = decode_cursor(cursor)
+    return stmt.where(or_(
+        InferenceTask.created_at < created_at,
+        and_(InferenceTask.created_at == created_at, InferenceTask.id < task_id),
+    ))
+
+
+class CountCache:
+    """
+    按过滤条件缓存总数，任务新增/删除时整体失效
+
+    过滤条件含用户输入的文件名前缀，取值不受限制: 最多保留 max_entries 个，按最近使用淘汰，
+    写入时顺带清掉已过期的条目。
+    """
+
+    def __init__(self, ttl: float, max_entries: int = 256, clock: Callable[[], float] = time.monotonic):
+        self.ttl = ttl
+        self.max_entries = max_entries
+        self.clock = clock
+        self._values: "OrderedDict[TaskFilters, Tuple[float, int]]" = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, filters: TaskFilters) -> Optional[int]:
+        with self._lock:
+            entry = self._values.get(filters)
+            if entry is None:
+                return None
+            if self.clock() - entry[0] > self.ttl:
+                del self._values[filters]
+                return None
+            self._values.move_to_end(filters)
+            return entry[1]
+
+    def set(self, filters: TaskFilters, total: int):
+        with self._lock:
+            now = self.clock()
+            for key in [key for key, (stored_at, _) in self._values.items() if now - stored_at > self.ttl]:
+                del self._values[key]
+            self._values[filters] = (now, total)
+            self._values.move_to_end(filters)
+            while len(self._values) > self.max_entries:
+                self._values.popitem(last=False)
+
+    def invalidate(self):
+        with self._lock:
+            self._values.clear()
@@ -3,46 +3,99 @@ nnU-Net 推理服务
 """
 import os
 import sys
+import json
 import time
+import socket
+import hashlib
 import uuid
 import shutil
 import subprocess
+import tempfile
 from pathlib import Path
 from datetime import datetime
-from typing import Optional, Tuple
+from typing import Callable, List, Optional, Tuple
 import threading
-from concurrent.futures import ThreadPoolExecutor
 
-import nibabel as nib
-import numpy as np
+from sqlalchemy import delete, func, select
 
 from app.core.config import get_settings
-from app.core.database import get_sync_session
+from app.core.database import get_async_read_session, get_sync_session
 from app.models.task import InferenceTask, TaskStatus
+from app.services.blob_store import BlobStore
+from app.services.eta import RuntimeEstimator
+from app.services.events import task_events
+from app.services.history_query import CountCache, TaskFilters, after_cursor, encode_cursor
+from app.services.model_server import ModelServerClient
+from app.services.preview import link_pyramid, preview_service
+from app.services.progress import ProgressTracker, parse_progress_line
+from app.services.reclaimer import FileReclaimer, ReclaimJob
+from app.services.staging import link_or_copy
+from app.services.stats import compute_segmentation_stats
+from app.services.storage import StorageManager
+from app.services.timings import delete_stage_timings, record_stage_timings
+from app.services.task_queue import TaskQueue
+from app.services.task_state import ProgressBuffer, RunningBatch
 
 settings = get_settings()
 
-# 线程池用于异步执行推理
-executor = ThreadPoolExecutor(max_workers=2)
-
+# 分割统计写入 InferenceTask 的字段
+STATS_FIELDS = (
+    "kidney_volume",
+    "tumor_volume",
+    "kidney_left_volume",
+    "kidney_right_volume",
+    "tumor_count",
+    "lesions",
+)
+
+# 批量删除时每条 IN (...) 语句的任务数
+DELETE_CHUNK_SIZE = 500
+
 
 class InferenceService:
     """推理服务"""
 
     def __init__(self):
         self.settings = settings
-
-    def create_task(self, filename: str, file_path: Path) -> str:
-        """创建推理任务"""
+        self._model_server: Optional[ModelServerClient] = None
+        self._model_server_lock = threading.Lock()
+        self.queue = TaskQueue(self._run_inference_batch, self.settings)
+        self.progress_buffer = ProgressBuffer(self.settings.progress_flush_interval)
+        self.history_counts = CountCache(self.settings.history_count_ttl, self.settings.history_count_cache_size)
+        self.reclaimer = FileReclaimer(self.settings.result_dir / ".trash")
+        self.storage = StorageManager(self.settings)
+        self.estimator = RuntimeEstimator(self.settings)
+        # 正在执行的批次，按任务 ID 索引，取消任务时用来中止推理
+        self._running: dict = {}
+        self._running_lock = threading.Lock()
+
+    def _blob_store(self) -> BlobStore:
+        return BlobStore(self.settings.upload_dir / "blobs")
+
+    def create_task(self, filename: str, file_path: Path, digest: Optional[str] = None,
+                    upload_time: Optional[float] = None) -> str:
+        """
+        创建推理任务，digest 为上传文件的 sha256 (有则原始文件按摘要只存一份)
+
+        upload_time 为接收上传文件的耗时 (秒)，加上入库耗时记为 upload 阶段。
+        """
+        start_time = time.time()
         task_id = str(uuid.uuid4())
 
         # 创建任务目录
         task_dir = self.settings.result_dir / task_id
         task_dir.mkdir(parents=True, exist_ok=True)
 
-        # 复制原始文件
+        # 原始文件: 存入内容仓库后硬链接到任务目录，重复上传不再占用额外空间
         original_path = task_dir / f"original.nii.gz"
-        shutil.copy(file_path, original_path)
+        if digest:
+            blob_path = self._blob_store().put(file_path, digest)
+            link_or_copy(blob_path, original_path)
+        else:
+            link_or_copy(file_path, original_path)
+
+        # 按 NIfTI 头预估滑窗区块数，排队时据此估算耗时
+        num_tiles = self.estimator.count_tiles(original_path)
 
         # 创建数据库记录
         with get_sync_session() as session:
@@ -51,21 +104,199 @@ class InferenceService:
                 filename=filename,
                 original_path=str(original_path),
                 status=TaskStatus.QUEUED,
+                input_digest=digest,
+                num_tiles=num_tiles,
             )
             session.add(task)
-
+        self.history_counts.invalidate()
+        # 按摘要共享的原始文件只登记一份
+        if digest:
+            self.storage.register("original", blob_path)
+        else:
+            self.storage.register("original", original_path, task_id)
+
+        if upload_time is not None:
+            record_stage_timings(task_id, {"upload": upload_time + (time.time() - start_time)})
         return task_id
 
-    def start_inference(self, task_id: str):
-        """启动异步推理"""
-        executor.submit(self._run_inference, task_id)
+    def start_workers(self):
+        """启动推理工作线程 (恢复重启前遗留的任务)、进度落库线程和文件回收线程"""
+        try:
+            self.estimator.load_history()
+        except Exception as e:
+            print(f"ETA history error: {e}")
+        self.progress_buffer.start()
+        self.queue.start()
+        self.reclaimer.sweep()
+        self.storage.start()
+
+    def stop_workers(self):
+        self.queue.stop()
+        self.progress_buffer.stop()
+        self.reclaimer.stop()
+        self.storage.stop()
+
+    def start_inference(self, task_id: str, use_cache: bool = True) -> TaskStatus:
+        """
+        启动推理: 命中结果缓存时直接完成，否则放入持久化队列由工作线程异步执行
+
+        Returns:
+            启动后的任务状态 (COMPLETED 表示复用了已有结果)
+        """
+        return self.start_inference_batch([task_id], use_cache=use_cache)[task_id]
+
+    def start_inference_batch(self, task_ids: List[str], use_cache: bool = True) -> dict:
+        """
+        批量启动推理: 未命中缓存的任务一次性入队，工作线程整批领取后合并为一次预测
+
+        Returns:
+            {task_id: 启动后的任务状态}
+        """
+        statuses = {}
+        pending = []
+        for task_id in task_ids:
+            with get_sync_session() as session:
+                task = session.query(InferenceTask).filter_by(id=task_id).first()
+                if not task:
+                    raise ValueError(f"Task {task_id} not found")
+                cache_key = self._result_cache_key(task.input_digest) if task.input_digest else None
+                task.cache_key = cache_key
+
+            if use_cache and cache_key and self.settings.result_cache_enabled:
+                if self._reuse_cached_result(task_id, cache_key):
+                    statuses[task_id] = TaskStatus.COMPLETED
+                    continue
+            statuses[task_id] = TaskStatus.QUEUED
+            pending.append(task_id)
+
+        if pending:
+            skipped = set(self.queue.enqueue_many(pending))
+            with get_sync_session() as session:
+                tasks = session.query(InferenceTask).filter(InferenceTask.id.in_(pending)).all()
+                snapshots = [(t.id, t.status, t.progress, t.message) for t in tasks]
+            for snapshot in snapshots:
+                if snapshot[0] in skipped:
+                    # 检查之后被其它请求抢先启动，已在处理中: 报告实际状态
+                    statuses[snapshot[0]] = snapshot[1]
+                else:
+                    self._publish_status(*snapshot)
+        return statuses
+
+    def _result_cache_key(self, input_digest: str) -> str:
+        """结果缓存键: 输入摘要 + 影响分割结果的模型配置"""
+        checkpoint_name = self._resolve_checkpoint_name()
+        checkpoint_file = Path(self.settings.model_path) / f"fold_{self.settings.default_fold}" / f"{checkpoint_name}.ckpt"
+        # 同一路径下重新训练的模型通过 checkpoint 的大小和修改时间区分
+        checkpoint_stat = None
+        if checkpoint_file.exists():
+            stat = checkpoint_file.stat()
+            checkpoint_stat = [stat.st_size, stat.st_mtime_ns]
+        stand_in = self.settings.model_server_enabled and self.settings.model_server_stand_in
+        payload = {
+            "input": input_digest,
+            "model_path": str(self.settings.model_path),
+            "checkpoint": checkpoint_name,
+            "checkpoint_stat": checkpoint_stat,
+            "fold": self.settings.default_fold,
+            "tta": self.settings.enable_tta,
+            "step_size": self.settings.step_size,
+            "predictor": "stand_in" if stand_in else "nnunet",
+        }
+        if self.settings.skip_background_tiles:
+            payload["tile_skipping"] = True
+        if self.settings.enable_tta and self.settings.tta_mirror_axes:
+            payload["tta_axes"] = sorted(int(a) for a in self.settings.tta_mirror_axes)
+        return hashlib.sha256(json.dumps(payload, sort_keys=True).encode("utf-8")).hexdigest()
+
+    def _find_cached_source(self, session, cache_key: str, task_id: str) -> Optional[InferenceTask]:
+        """缓存键相同、分割文件仍然存在的最近一个已完成任务"""
+        candidates = (
+            session.query(InferenceTask)
+            .filter(
+                InferenceTask.cache_key == cache_key,
+                InferenceTask.status == TaskStatus.COMPLETED,
+                InferenceTask.id != task_id,
+                InferenceTask.segmentation_path.isnot(None),
+            )
+            .order_by(InferenceTask.completed_at.desc())
+            .limit(5)
+            .all()
+        )
+        # 源任务的文件可能已被删除，取第一个仍然存在的
+        return next((c for c in candidates if Path(c.segmentation_path).exists()), None)
 
+    def _reuse_cached_result(self, task_id: str, cache_key: str) -> bool:
+        """查找缓存键相同的已完成任务，链接其分割结果并复制统计信息"""
+        start_time = time.time()
+        with get_sync_session() as session:
+            source = self._find_cached_source(session, cache_key, task_id)
+            if source is None:
+                return False
+
+            task = session.query(InferenceTask).filter_by(id=task_id).first()
+            segmentation_path = Path(task.original_path).parent / "segmentation.nii.gz"
+            segmentation_shared = link_or_copy(Path(source.segmentation_path), segmentation_path) != "copy"
+
+            task.status = TaskStatus.COMPLETED
+            task.progress = 100
+            task.message = "分割完成 (复用已有结果)"
+            task.segmentation_path = str(segmentation_path)
+            for field in STATS_FIELDS:
+                setattr(task, field, getattr(source, field))
+            task.processing_time = time.time() - start_time
+            task.completed_at = datetime.utcnow()
+            self.progress_buffer.discard(task_id)
+            print(f"Task {task_id} reused result of {source.id}")
+
+            # 预览金字塔同样复用，源任务没有完整金字塔时后台生成
+            task_dir = segmentation_path.parent
+            generation = task.generation or 0
+            preview_shared = link_pyramid(Path(source.segmentation_path).parent, source.generation or 0, task_dir,
+                                          generation)
+            if not preview_shared:
+                preview_service.schedule_pyramid(task_id, task_dir, generation)
+        # 硬链接共享的数据已记在源任务名下，这里登记为 0 字节
+        self._register_results(task_id, task_dir, segmentation_shared, preview_shared)
+        self._publish_status(task_id, TaskStatus.COMPLETED, 100, "分割完成 (复用已有结果)")
+        return True
+
+    def admit(self, task_ids: List[str], use_cache: bool = True, enforce: bool = True) -> dict:
+        """
+        准入检查并预估各任务的完成时间 {task_id: 秒}
+
+        预计排队等待超过 admission_max_wait 时抛出 AdmissionRejected (enforce=False 时只预估)。
+        命中结果缓存的任务不占用工作线程，不参与检查，预估为 0。
+        """
+        with get_sync_session() as session:
+            tasks = {task.id: task for task in session.query(InferenceTask).filter(InferenceTask.id.in_(task_ids))}
+            pending, estimates, etas = [], [], {}
+            for task_id in task_ids:
+                task = tasks.get(task_id)
+                if task is None:
+                    continue
+                if use_cache and task.input_digest and self.settings.result_cache_enabled:
+                    cache_key = self._result_cache_key(task.input_digest)
+                    if self._find_cached_source(session, cache_key, task_id) is not None:
+                        etas[task_id] = 0
+                        continue
+                num_tiles = task.num_tiles
+                if num_tiles is None:
+                    # 旧任务没有预估区块数，按原始文件头补算
+                    num_tiles = task.num_tiles = self.estimator.count_tiles(Path(task.original_path))
+                pending.append(task_id)
+                estimates.append(self.estimator.estimate(num_tiles))
+
+        waits = self.estimator.admit(estimates, exclude=task_ids, enforce=enforce)
+        for task_id, wait, seconds in zip(pending, waits, estimates):
+            etas[task_id] = int(round(wait + seconds))
+        return etas
+
     def prepare_task_for_run(self, task_id: str, message: str = "排队中..."):
         """清理旧产物，重置任务状态，支持失败后重新推理"""
         task_dir = self.settings.result_dir / task_id
 
-        # 清理旧的输入/输出/分割文件，但保留 original.nii.gz
-        for sub_dir in ["input", "output"]:
+        # 清理旧的输入/输出/分割文件和预览金字塔，但保留 original.nii.gz
+        for sub_dir in ["input", "output", "preview"]:
             shutil.rmtree(task_dir / sub_dir, ignore_errors=True)
         seg_file = task_dir / "segmentation.nii.gz"
         if seg_file.exists():
@@ -80,188 +311,538 @@ class InferenceService:
             task.status = TaskStatus.QUEUED
             task.progress = 0
             task.message = message
-            task.kidney_volume = None
-            task.tumor_volume = None
+            for field in STATS_FIELDS:
+                setattr(task, field, None)
             task.processing_time = None
             task.completed_at = None
             task.segmentation_path = None
+            task.queued_at = None
+            task.worker_id = None
+            task.heartbeat_at = None
+            task.attempts = 0
+            task.generation = (task.generation or 0) + 1
+            self.storage.forget([task_id], ("segmentation", "preview", "scratch"), session=session)
+        self.progress_buffer.discard(task_id)
 
-    def _run_inference(self, task_id: str):
-        """执行推理 (在后台线程中运行)"""
-        start_time = time.time()
-
-        try:
-            # 更新状态为处理中
-            self._update_task_status(task_id, TaskStatus.PROCESSING, progress=10, message="正在准备推理...")
-
-            # 获取任务信息
-            with get_sync_session() as session:
-                task = session.query(InferenceTask).filter_by(id=task_id).first()
-                if not task:
-                    raise ValueError(f"Task {task_id} not found")
-                original_path = Path(task.original_path)
-
-            task_dir = original_path.parent
-
-            # 准备输入目录 (nnU-Net 需要 _0000 后缀)
-            input_dir = task_dir / "input"
-            input_dir.mkdir(exist_ok=True)
-            input_file = input_dir / f"{task_id}_0000.nii.gz"
-            shutil.copy(original_path, input_file)
-
-            # 输出目录
-            output_dir = task_dir / "output"
-            output_dir.mkdir(exist_ok=True)
-
-            self._update_task_status(task_id, TaskStatus.PROCESSING, progress=20, message="正在执行分割推理...")
-
-            # 调用 nnU-Net 推理
-            success, error_msg = self._call_nnunet_predict(input_dir, output_dir, task_id)
-
-            if not success:
-                raise RuntimeError(error_msg or "nnU-Net 推理失败")
-
-            self._update_task_status(task_id, TaskStatus.PROCESSING, progress=80, message="正在处理分割结果...")
-
-            # 找到输出文件
-            output_files = list(output_dir.glob("*.nii.gz"))
-            if not output_files:
-                raise RuntimeError("未找到分割结果文件")
-
-            # 重命名并移动到结果目录
-            segmentation_path = task_dir / "segmentation.nii.gz"
-            shutil.move(str(output_files[0]), str(segmentation_path))
-
-            self._update_task_status(task_id, TaskStatus.PROCESSING, progress=90, message="正在计算体积统计...")
-
-            # 计算统计信息
-            kidney_volume, tumor_volume = self._calculate_volumes(segmentation_path, original_path)
-
-            # 处理时间
-            processing_time = time.time() - start_time
-
-            # 更新任务完成
-            with get_sync_session() as session:
-                task = session.query(InferenceTask).filter_by(id=task_id).first()
-                task.status = TaskStatus.COMPLETED
-                task.progress = 100
-                task.message = "分割完成"
-                task.segmentation_path = str(segmentation_path)
-                task.kidney_volume = kidney_volume
-                task.tumor_volume = tumor_volume
-                task.processing_time = processing_time
-                task.completed_at = datetime.utcnow()
-
-            # 清理临时文件
-            shutil.rmtree(input_dir, ignore_errors=True)
-            shutil.rmtree(output_dir, ignore_errors=True)
+    def _run_inference(self, task_id: str):
+        """执行单个任务的推理 (在后台线程中运行)"""
+        self._run_inference_batch([task_id])
+
+    def _run_inference_batch(self, task_ids: List[str]):
+        """
+        批量执行推理 (在后台线程中运行)
+
+        所有病例在一次预测中完成: 模型只加载一次，预处理下一例与当前例的推理重叠，
+        结果再按任务分发回各自的任务目录。
+        """
+        batch = RunningBatch(task_ids)
+        with self._running_lock:
+            for task_id in task_ids:
+                self._running[task_id] = batch
+        try:
+            self._run_batch(batch)
+        finally:
+            with self._running_lock:
+                for task_id in task_ids:
+                    if self._running.get(task_id) is batch:
+                        del self._running[task_id]
+                deleted = sorted(batch.deleted)
+            if deleted:
+                # 批次已不再读写这些任务目录
+                self.reclaimer.submit(self.settings.result_dir / task_id for task_id in deleted)
+
+    def _run_batch(self, batch: RunningBatch):
+        start_time = time.time()
+        jobs = []
+        for task_id in batch.task_ids:
+            try:
+                job = self._stage_task_input(task_id)
+            except Exception as e:
+                self._fail_task(task_id, e)
+                continue
+            if job is not None:
+                jobs.append(job)
+        batch.keep([job["task_id"] for job in jobs])
+        if not jobs:
+            return
 
-        except Exception as e:
-            print(f"Inference error: {e}")
-            self._update_task_status(
-                task_id,
-                TaskStatus.FAILED,
-                progress=0,
-                message=f"推理失败: {str(e)}"
+        try:
+            message = "正在执行分割推理..." if len(jobs) == 1 else f"正在执行分割推理 (本批 {len(jobs)} 例)..."
+            for job in jobs:
+                self._update_task_status(job["task_id"], TaskStatus.PROCESSING, progress=20, message=message)
+
+            # 调用 nnU-Net 推理，滑窗区块等进度实时写入各任务
+            tracker = ProgressTracker(
+                [job["task_id"] for job in jobs],
+                lambda task_id, progress, msg: self._update_task_status(task_id, TaskStatus.PROCESSING, progress, msg),
             )
+            success, error_msg = self._predict_cases([job["case"] for job in jobs], on_progress=tracker, batch=batch)
 
-    def _call_nnunet_predict(self, input_dir: Path, output_dir: Path, task_id: str) -> Tuple[bool, str]:
-        """调用 nnU-Net 预测脚本"""
-        try:
-            # 选择 checkpoint
-            checkpoint_name = self.settings.default_checkpoint
-            model_dir = Path(self.settings.model_path)
-            if checkpoint_name == "auto":
-                checkpoint_name = "model_best"
-                fold_dir = model_dir / f"fold_{self.settings.default_fold}"
-                if fold_dir.exists():
-                    if (fold_dir / "model_best.ckpt").exists():
-                        checkpoint_name = "model_best"
-                    elif (fold_dir / "model_final_checkpoint.ckpt").exists():
-                        checkpoint_name = "model_final_checkpoint"
-
-            # 构建命令
-            cmd = [
-                sys.executable,
-                str(self.settings.nnunet_root / "eval.py"),
-                "-i", str(input_dir),
-                "-o", str(output_dir),
-                "-t", self.settings.task_name,
-                "-m", self.settings.default_model,
-                "-tr", self.settings.trainer_class,
-                "-p", self.settings.plans_identifier,
-                "-f", str(self.settings.default_fold),
-                "-chk", checkpoint_name,
-                "--disable_tta",  # 禁用测试时增强以加快速度
-            ]
-
-            # 设置环境变量
-            env = os.environ.copy()
-            env["nnUNet_raw_data_base"] = self.settings.nnunet_raw_data_base
-            env["nnUNet_preprocessed"] = self.settings.nnunet_preprocessed
-            env["RESULTS_FOLDER"] = self.settings.results_folder
-
-            # 如果提供了具体模型路径，自动把 RESULTS_FOLDER 指向该模型所在的 RESULTS_FOLDER 目录
-            model_path = Path(self.settings.model_path)
-            if model_path.exists():
-                try:
-                    env["RESULTS_FOLDER"] = str(model_path.parents[3])
-                    print(f"Using RESULTS_FOLDER from model_path: {env['RESULTS_FOLDER']}")
-                except Exception as e:
-                    print(f"Failed to derive RESULTS_FOLDER from model_path: {e}")
-
-            print(f"Running inference command: {' '.join(cmd)}")
-
-            # 执行命令
-            result = subprocess.run(
-                cmd,
-                cwd=str(self.settings.nnunet_root),
-                env=env,
-                capture_output=True,
-                text=True,
-                timeout=600,  # 10分钟超时
-            )
-
-            if result.returncode != 0:
-                err_msg = result.stderr.strip() or "nnU-Net 推理失败"
-                print(f"nnU-Net stderr: {result.stderr}")
-                return False, err_msg
+            if not success:
+                raise RuntimeError(error_msg or "nnU-Net 推理失败")
+        except Exception as e:
+            for job in jobs:
+                if batch.is_cancelled(job["task_id"]):
+                    self._discard_cancelled(job)
+                else:
+                    self._fail_task(job["task_id"], e)
+            return
+
+        # 推理期间被取消的任务不再收尾
+        cancelled = [job for job in jobs if batch.is_cancelled(job["task_id"])]
+        for job in cancelled:
+            self._discard_cancelled(job)
+        jobs = [job for job in jobs if not batch.is_cancelled(job["task_id"])]
+        if not jobs:
+            return
 
-            print(f"nnU-Net stdout: {result.stdout}")
-            return True, ""
+        for job in jobs:
+            job["timings"].update(tracker.timings[job["task_id"]])
+            job["tiles"] = tracker.tiles.get(job["task_id"])
 
-        except subprocess.TimeoutExpired:
-            print("nnU-Net inference timeout")
-            return False, "nnU-Net inference timeout"
-        except Exception as e:
-            err_msg = f"nnU-Net call error: {e}"
-            print(err_msg)
-            return False, err_msg
-
-    def _calculate_volumes(self, seg_path: Path, orig_path: Path) -> Tuple[float, float]:
-        """计算肾脏和肿瘤体积 (mm³)"""
+        # 推理耗时按病例数均摊
+        shared_time = (time.time() - start_time) / len(jobs)
+        for job in jobs:
+            try:
+                self._finalize_task(job, shared_time)
+            except Exception as e:
+                self._fail_task(job["task_id"], e)
+
+    def _stage_task_input(self, task_id: str) -> Optional[dict]:
+        """准备单个任务的输入 / 输出目录，任务在领取后已被取消时返回 None"""
+        # 更新状态为处理中
+        self._update_task_status(task_id, TaskStatus.PROCESSING, progress=10, message="正在准备推理...")
+
+        # 获取任务信息
+        with get_sync_session() as session:
+            task = session.query(InferenceTask).filter_by(id=task_id).first()
+            if not task:
+                raise ValueError(f"Task {task_id} not found")
+            if task.status == TaskStatus.CANCELLED:
+                return None
+            original_path = Path(task.original_path)
+            generation = task.generation or 0
+            queue_wait = (datetime.utcnow() - task.queued_at).total_seconds() if task.queued_at else None
+
+        task_dir = original_path.parent
+
+        # 准备输入目录 (nnU-Net 需要 _0000 后缀)，硬链接原始文件，不复制数据
+        input_dir = task_dir / "input"
+        input_dir.mkdir(exist_ok=True)
+        input_file = input_dir / f"{task_id}_0000.nii.gz"
+        link_or_copy(original_path, input_file)
+
+        # 输出目录
+        output_dir = task_dir / "output"
+        output_dir.mkdir(exist_ok=True)
+
+        # 登记为临时目录: 失败或进程中断时由容量管理线程清理
+        self.storage.register("scratch", input_dir, task_id, size=0)
+        self.storage.register("scratch", output_dir, task_id, size=0)
+
+        return {
+            "task_id": task_id,
+            "task_dir": task_dir,
+            "generation": generation,
+            "input_dir": input_dir,
+            "output_dir": output_dir,
+            "timings": {"queue_wait": queue_wait},
+            "case": {
+                "task_id": task_id,
+                "input_files": [str(input_file)],
+                "output_file": str(output_dir / f"{task_id}.nii.gz"),
+            },
+        }
+
+    def _finalize_task(self, job: dict, inference_time: float):
+        """推理完成后的收尾: 移动结果、统计、预览、更新任务"""
+        start_time = time.time()
+        task_id, task_dir, output_dir = job["task_id"], job["task_dir"], job["output_dir"]
+
+        self._update_task_status(task_id, TaskStatus.PROCESSING, progress=80, message="正在处理分割结果...")
+
+        # 找到输出文件
+        output_files = list(output_dir.glob("*.nii.gz"))
+        if not output_files:
+            raise RuntimeError("未找到分割结果文件")
+
+        # 重命名并移动到结果目录
+        segmentation_path = task_dir / "segmentation.nii.gz"
+        shutil.move(str(output_files[0]), str(segmentation_path))
+
+        self._update_task_status(task_id, TaskStatus.PROCESSING, progress=90, message="正在计算体积统计...")
+
+        # 计算统计信息
+        stage_start = time.time()
+        stats = self._calculate_stats(segmentation_path)
+        job["timings"]["stats"] = time.time() - stage_start
+
+        # 生成预览金字塔，失败不影响任务结果 (查看时会在后台重新生成)
+        self._update_task_status(task_id, TaskStatus.PROCESSING, progress=95, message="正在生成预览...")
+        stage_start = time.time()
         try:
-            # 加载分割结果
-            seg_nii = nib.load(str(seg_path))
-            seg_data = seg_nii.get_fdata()
+            preview_service.build_pyramid(task_id, task_dir, job["generation"])
+        except Exception as e:
+            print(f"Preview pyramid error for {task_id}: {e}")
+        job["timings"]["preview"] = time.time() - stage_start
+
+        # 处理时间
+        processing_time = inference_time + (time.time() - start_time)
 
-            # 获取体素尺寸
-            voxel_dims = seg_nii.header.get_zooms()[:3]
-            voxel_volume = float(np.prod(voxel_dims))  # mm³
+        # 更新任务完成 (收尾期间被取消或删除的任务不再写回)
+        with get_sync_session() as session:
+            task = session.query(InferenceTask).filter_by(id=task_id).first()
+            if task is None or task.status == TaskStatus.CANCELLED:
+                self._discard_cancelled(job)
+                return
+            task.status = TaskStatus.COMPLETED
+            task.progress = 100
+            task.message = "分割完成"
+            task.segmentation_path = str(segmentation_path)
+            for field in STATS_FIELDS:
+                setattr(task, field, stats.get(field))
+            task.processing_time = processing_time
+            task.completed_at = datetime.utcnow()
+            if job.get("tiles"):
+                task.num_tiles = job["tiles"]
+        self.progress_buffer.discard(task_id)
+        self._publish_status(task_id, TaskStatus.COMPLETED, 100, "分割完成")
+        try:
+            record_stage_timings(task_id, job["timings"])
+        except Exception as e:
+            print(f"Stage timing error for {task_id}: {e}")
+        self.estimator.observe(job.get("tiles"), job["timings"])
+
+        # 清理临时文件
+        shutil.rmtree(job["input_dir"], ignore_errors=True)
+        shutil.rmtree(output_dir, ignore_errors=True)
+        self.storage.forget([task_id], ("scratch",))
+        self._register_results(task_id, task_dir)
+
+    def _register_results(self, task_id: str, task_dir: Path, segmentation_shared: bool = False,
+                          preview_shared: bool = False):
+        """分割结果和预览金字塔登记到容量台账 (与其它任务共享的按 0 字节登记)，失败不影响任务结果"""
+        try:
+            self.storage.register("segmentation", task_dir / "segmentation.nii.gz", task_id,
+                                  size=0 if segmentation_shared else None)
+            self.storage.register("preview", task_dir / "preview", task_id, size=0 if preview_shared else None)
+        except Exception as e:
+            print(f"Storage ledger error for {task_id}: {e}")
+
+    def _discard_cancelled(self, job: dict):
+        """清理被取消任务的本次产物"""
+        print(f"Task {job['task_id']} cancelled")
+        for sub_dir in ("input", "output"):
+            shutil.rmtree(job["task_dir"] / sub_dir, ignore_errors=True)
+        (job["task_dir"] / "segmentation.nii.gz").unlink(missing_ok=True)
+        self.storage.forget([job["task_id"]], ("scratch",))
+        self.progress_buffer.discard(job["task_id"])
+
+    def cancel_task(self, task_id: str) -> Optional[TaskStatus]:
+        """
+        取消排队中 / 处理中的任务: 排队中的不会再被领取，处理中的在滑窗的下一个 tile 处停止
+        (eval.py 子进程整批被取消时直接结束)，工作线程随即空闲。
+
+        Returns:
+            取消后的任务状态 (已结束的任务保持原状态)，任务不存在时返回 None
+        """
+        with get_sync_session() as session:
+            task = session.query(InferenceTask).filter_by(id=task_id).first()
+            if not task:
+                return None
+            if task.status not in (TaskStatus.QUEUED, TaskStatus.PROCESSING):
+                return task.status
+            task.status = TaskStatus.CANCELLED
+            task.message = "已取消"
+            task.queued_at = None
+            task.worker_id = None
+            task.heartbeat_at = None
+            progress = task.progress
+        self.progress_buffer.discard(task_id)
+        self.history_counts.invalidate()
+        self._signal_cancel(task_id)
+        self._publish_status(task_id, TaskStatus.CANCELLED, progress or 0, "已取消")
+        return TaskStatus.CANCELLED
+
+    def is_running(self, task_id: str) -> bool:
+        """任务是否仍在某个执行中的批次里 (已取消的任务在旧批次结束、清理完产物之前同样返回 True)"""
+        with self._running_lock:
+            return task_id in self._running
+
+    def _signal_cancel(self, task_id: str):
+        """通知正在执行该任务的批次停止推理"""
+        with self._running_lock:
+            batch = self._running.get(task_id)
+        if batch is None:
+            return
+        batch.cancel(task_id)
+        if self.settings.model_server_enabled and self._model_server is not None:
+            self._model_server.cancel([task_id])
+
+    def _fail_task(self, task_id: str, error: Exception):
+        print(f"Inference error: {error}")
+        # 失败时同样清理 input/ output/，保留原始文件以便重试
+        task_dir = self.settings.result_dir / task_id
+        for sub_dir in ("input", "output"):
+            shutil.rmtree(task_dir / sub_dir, ignore_errors=True)
+        self._update_task_status(
+            task_id,
+            TaskStatus.FAILED,
+            progress=0,
+            message=f"推理失败: {str(error)}"
+        )
+
+    def _tta_args(self) -> list:
+        """测试时增强的命令行参数 (eval.py 和 serve.py 相同)"""
+        if not self.settings.enable_tta:
+            return ["--disable_tta"]  # 禁用测试时增强以加快速度
+        if self.settings.tta_mirror_axes:
+            return ["--tta_axes"] + [str(int(a)) for a in self.settings.tta_mirror_axes]
+        return []
+
+    def _resolve_checkpoint_name(self) -> str:
+        """选择 checkpoint: auto 时优先 model_best，缺失则用 model_final_checkpoint"""
+        checkpoint_name = self.settings.default_checkpoint
+        model_dir = Path(self.settings.model_path)
+        if checkpoint_name == "auto":
+            checkpoint_name = "model_best"
+            fold_dir = model_dir / f"fold_{self.settings.default_fold}"
+            if fold_dir.exists():
+                if (fold_dir / "model_best.ckpt").exists():
+                    checkpoint_name = "model_best"
+                elif (fold_dir / "model_final_checkpoint.ckpt").exists():
+                    checkpoint_name = "model_final_checkpoint"
+        return checkpoint_name
+
+    def _build_nnunet_env(self) -> dict:
+        """构建 nnU-Net 子进程的环境变量"""
+        env = os.environ.copy()
+        env["nnUNet_raw_data_base"] = self.settings.nnunet_raw_data_base
+        env["nnUNet_preprocessed"] = self.settings.nnunet_preprocessed
+        env["RESULTS_FOLDER"] = self.settings.results_folder
+
+        # 如果提供了具体模型路径，自动把 RESULTS_FOLDER 指向该模型所在的 RESULTS_FOLDER 目录
+        model_path = Path(self.settings.model_path)
+        if model_path.exists():
+            try:
+                env["RESULTS_FOLDER"] = str(model_path.parents[3])
+                print(f"Using RESULTS_FOLDER from model_path: {env['RESULTS_FOLDER']}")
+            except Exception as e:
+                print(f"Failed to derive RESULTS_FOLDER from model_path: {e}")
+        return env
+
+    def _get_model_server(self) -> ModelServerClient:
+        """获取常驻推理服务客户端 (首次调用时创建)"""
+        with self._model_server_lock:
+            if self._model_server is None:
+                socket_path = self.settings.model_server_socket
+                cmd = [
+                    sys.executable,
+                    str(self.settings.nnunet_root / "serve.py"),
+                    "--socket", str(socket_path),
+                    "-t", self.settings.task_name,
+                    "-m", self.settings.default_model,
+                    "-tr", self.settings.trainer_class,
+                    "-p", self.settings.plans_identifier,
+                    "-f", str(self.settings.default_fold),
+                    "-chk", self._resolve_checkpoint_name(),
+                    "--step_size", str(self.settings.step_size),
+                    "--tile_batch_size", str(self.settings.tile_batch_size),
+                    "--device_aggregation_mb", str(self.settings.device_aggregation_mb),
+                ]
+                cmd.extend(self._tta_args())
+                if not self.settings.skip_background_tiles:
+                    cmd.append("--disable_tile_skipping")
+                if self.settings.model_server_stand_in:
+                    cmd.append("--stand_in")
+                self._model_server = ModelServerClient(
+                    socket_path=socket_path,
+                    command=cmd,
+                    cwd=self.settings.nnunet_root,
+                    env=self._build_nnunet_env(),
+                    log_path=self.settings.temp_dir / "model_server.log",
+                    startup_timeout=self.settings.model_server_startup_timeout,
+                )
+            return self._model_server
+
+    def warm_up(self):
+        """预先拉起常驻推理服务，首个任务无需等待模型加载"""
+        if not self.settings.model_server_enabled:
+            return
+        try:
+            self._get_model_server().ensure_running()
+        except Exception as e:
+            print(f"Model server warm-up failed: {e}")
+
+    def shutdown(self):
+        """关闭常驻推理服务"""
+        if self._model_server is not None:
+            self._model_server.stop()
+
+    def _call_nnunet_predict(self, input_dir: Path, output_dir: Path, task_id: str) -> Tuple[bool, str]:
+        """单个病例推理: input_dir/{task_id}_XXXX.nii.gz -> output_dir/{task_id}.nii.gz"""
+        case = {
+            "task_id": task_id,
+            "input_files": [str(p) for p in sorted(input_dir.glob(f"{task_id}_*.nii.gz"))],
+            "output_file": str(output_dir / f"{task_id}.nii.gz"),
+        }
+        return self._predict_cases([case])
+
+    def _predict_cases(self, cases: List[dict], on_progress: Optional[Callable[[dict], None]] = None,
+                       batch: Optional[RunningBatch] = None) -> Tuple[bool, str]:
+        """
+        一次预测多个病例 [{"task_id", "input_files", "output_file"}]
+
+        优先提交给常驻推理服务，未启用时回退到 eval.py 子进程。on_progress 接收 nnU-Net 的进度事件，
+        batch 用于取消时找到 eval.py 子进程。
+        """
+        if self.settings.model_server_enabled:
+            return self._call_model_server(cases, on_progress)
+        return self._call_eval_script(cases, on_progress, batch)
+
+    def _call_model_server(self, cases: List[dict], on_progress: Optional[Callable[[dict], None]] = None) -> Tuple[bool, str]:
+        """把病例提交给常驻推理服务"""
+        try:
+            payload = [{"input_files": case["input_files"], "output_file": case["output_file"]} for case in cases]
+            timeout = self.settings.inference_timeout * len(cases)
+            # 其它工作线程的批次各自最多占用服务 inference_timeout * inference_batch_size，超时即被取消
+            queue_timeout = self.settings.model_server_startup_timeout + self.settings.inference_timeout * \
+                self.settings.inference_batch_size * max(0, self.settings.inference_workers - 1)
+            return self._get_model_server().predict(payload, timeout=timeout, on_progress=on_progress,
+                                                    queue_timeout=queue_timeout)
+        except socket.timeout:
+            print("Model server inference timeout")
+            return False, "nnU-Net inference timeout"
+        except Exception as e:
+            err_msg = f"model server call error: {e}"
+            print(err_msg)
+            return False, err_msg
+
+    def _call_eval_script(self, cases: List[dict], on_progress: Optional[Callable[[dict], None]] = None,
+                          batch: Optional[RunningBatch] = None) -> Tuple[bool, str]:
+        """调用 nnU-Net 预测脚本，所有病例放进同一个输入目录，一次运行完成"""
+        batch_dir = Path(tempfile.mkdtemp(prefix="batch_", dir=str(self.settings.temp_dir)))
+        try:
+            input_dir = batch_dir / "input"
+            output_dir = batch_dir / "output"
+            input_dir.mkdir()
+            output_dir.mkdir()
+            for case in cases:
+                for input_file in case["input_files"]:
+                    link_or_copy(Path(input_file), input_dir / Path(input_file).name)
+
+            checkpoint_name = self._resolve_checkpoint_name()
+
+            # 构建命令
+            cmd = [
+                sys.executable,
+                str(self.settings.nnunet_root / "eval.py"),
+                "-i", str(input_dir),
+                "-o", str(output_dir),
+                "-t", self.settings.task_name,
+                "-m", self.settings.default_model,
+                "-tr", self.settings.trainer_class,
+                "-p", self.settings.plans_identifier,
+                "-f", str(self.settings.default_fold),
+                "-chk", checkpoint_name,
+                "--step_size", str(self.settings.step_size),
+                "--tile_batch_size", str(self.settings.tile_batch_size),
+                "--device_aggregation_mb", str(self.settings.device_aggregation_mb),
+                "--progress_json",
+            ]
+            cmd.extend(self._tta_args())
+            if not self.settings.skip_background_tiles:
+                cmd.append("--disable_tile_skipping")
 
-            # 计算体积
-            # 标签 1: 肾脏, 标签 2: 肿瘤
-            kidney_voxels = np.sum(seg_data == 1)
-            tumor_voxels = np.sum(seg_data == 2)
+            # 设置环境变量
+            env = self._build_nnunet_env()
 
-            kidney_volume = float(kidney_voxels * voxel_volume)
-            tumor_volume = float(tumor_voxels * voxel_volume)
+            print(f"Running inference command: {' '.join(cmd)}")
 
-            return kidney_volume, tumor_volume
+            # 执行命令，逐行读取输出，进度事件实时交给 on_progress
+            returncode, output = self._run_streaming(
+                cmd, env, self.settings.inference_timeout * len(cases), on_progress,
+                on_start=batch.attach_process if batch is not None else None,
+            )
 
+            if returncode != 0:
+                err_msg = "\n".join(output[-20:]).strip() or "nnU-Net 推理失败"
+                print("nnU-Net output:\n" + "\n".join(output))
+                return False, err_msg
+
+            print("nnU-Net stdout:\n" + "\n".join(output))
+
+            # 按病例 ID 把结果分发回各自的输出路径 (eval.py 会加 Segmentation_ 前缀)
+            for case in cases:
+                for name in (f"Segmentation_{case['task_id']}.nii.gz", f"{case['task_id']}.nii.gz"):
+                    produced = output_dir / name
+                    if produced.exists():
+                        Path(case["output_file"]).parent.mkdir(parents=True, exist_ok=True)
+                        shutil.move(str(produced), case["output_file"])
+                        break
+            return True, ""
+
+        except subprocess.TimeoutExpired:
+            print("nnU-Net inference timeout")
+            return False, "nnU-Net inference timeout"
+        except Exception as e:
+            err_msg = f"nnU-Net call error: {e}"
+            print(err_msg)
+            return False, err_msg
+        finally:
+            shutil.rmtree(batch_dir, ignore_errors=True)
+
+    def _run_streaming(self, cmd: list, env: dict, timeout: float,
+                       on_progress: Optional[Callable[[dict], None]] = None,
+                       on_start: Optional[Callable[[subprocess.Popen], None]] = None) -> Tuple[int, List[str]]:
+        """
+        运行子进程并逐行读取 stdout/stderr，返回 (returncode, 非进度输出行)
+
+        超时后杀掉子进程并抛出 subprocess.TimeoutExpired。on_start 在子进程启动后接收 Popen 对象。
+        """
+        process = subprocess.Popen(
+            cmd,
+            cwd=str(self.settings.nnunet_root),
+            env=env,
+            stdout=subprocess.PIPE,
+            stderr=subprocess.STDOUT,
+            text=True,
+            bufsize=1,
+        )
+        timed_out = threading.Event()
+
+        def kill():
+            timed_out.set()
+            process.kill()
+
+        if on_start is not None:
+            on_start(process)
+        timer = threading.Timer(timeout, kill)
+        timer.start()
+        output = []
+        try:
+            for line in process.stdout:
+                event = parse_progress_line(line)
+                if event is not None:
+                    if on_progress is not None:
+                        on_progress(event)
+                    continue
+                output.append(line.rstrip("\n"))
+            process.wait()
+        finally:
+            timer.cancel()
+            process.stdout.close()
+        if timed_out.is_set():
+            raise subprocess.TimeoutExpired(cmd, timeout)
+        return process.returncode, output
+
+    def _calculate_stats(self, seg_path: Path) -> dict:
+        """计算肾脏/肿瘤体积、左右肾体积和肿瘤病灶信息 (体积单位 mm³)"""
+        try:
+            return compute_segmentation_stats(seg_path)
         except Exception as e:
             print(f"Volume calculation error: {e}")
-            return 0.0, 0.0
+            return {"kidney_volume": 0.0, "tumor_volume": 0.0}
 
     def _update_task_status(
         self,
@@ -270,13 +851,32 @@ class InferenceService:
         progress: int = 0,
         message: str = None
     ):
-        """更新任务状态"""
-        with get_sync_session() as session:
-            task = session.query(InferenceTask).filter_by(id=task_id).first()
-            if task:
+        """
+        更新任务状态: 处理中的进度变化先写内存，由进度落库线程批量写入；状态变化立即写库
+
+        已取消的任务不再被推理线程的迟到更新覆盖。
+        """
+        if not self.progress_buffer.buffer(task_id, status, progress, message):
+            with get_sync_session() as session:
+                task = session.query(InferenceTask).filter_by(id=task_id).first()
+                if not task or task.status == TaskStatus.CANCELLED:
+                    return
                 task.status = status
                 task.progress = progress
                 task.message = message
+            self.progress_buffer.track(task_id, status, progress, message)
+            # 状态变化会影响按状态过滤的总数
+            self.history_counts.invalidate()
+        self._publish_status(task_id, status, progress, message)
+
+    def _publish_status(self, task_id: str, status: TaskStatus, progress: int, message: Optional[str]):
+        """向 SSE 订阅者推送状态变化"""
+        task_events.publish(task_id, {
+            "taskId": task_id,
+            "status": status.value,
+            "progress": progress,
+            "message": message,
+        })
 
     def get_task(self, task_id: str) -> Optional[InferenceTask]:
         """获取任务信息"""
@@ -285,39 +885,121 @@ class InferenceService:
             if task:
                 # Detach from session
                 session.expunge(task)
-            return task
+        return self.progress_buffer.overlay(task)
 
-    def get_task_list(self, page: int = 1, page_size: int = 20) -> Tuple[list, int]:
-        """获取任务列表"""
+    async def get_task_async(self, task_id: str) -> Optional[InferenceTask]:
+        """获取任务信息 (异步引擎，供 API 读取)"""
+        async with get_async_read_session() as session:
+            task = await session.get(InferenceTask, task_id)
+            if task:
+                session.expunge(task)
+        return self.progress_buffer.overlay(task)
+
+    def _task_list_statements(self, filters: TaskFilters, page: int, page_size: int, cursor: Optional[str]):
+        """任务列表和总数的查询语句: 有游标时按 (created_at, id) 取下一页，否则按页码偏移"""
+        stmt = filters.apply(select(InferenceTask)).order_by(
+            InferenceTask.created_at.desc(), InferenceTask.id.desc()
+        )
+        if cursor:
+            stmt = after_cursor(stmt, cursor)
+        else:
+            stmt = stmt.offset((page - 1) * page_size)
+        # 多取一条判断是否还有下一页
+        stmt = stmt.limit(page_size + 1)
+        count_stmt = filters.apply(select(func.count(InferenceTask.id)))
+        return stmt, count_stmt
+
+    def _task_list_result(self, tasks: list, page_size: int, total: int) -> Tuple[list, int, Optional[str]]:
+        next_cursor = encode_cursor(tasks[page_size - 1]) if len(tasks) > page_size else None
+        return [self.progress_buffer.overlay(task) for task in tasks[:page_size]], total, next_cursor
+
+    def get_task_list(self, page: int = 1, page_size: int = 20, filters: Optional[TaskFilters] = None,
+                      cursor: Optional[str] = None) -> Tuple[list, int, Optional[str]]:
+        """获取任务列表，返回 (任务, 总数, 下一页游标)"""
+        filters = filters or TaskFilters()
+        stmt, count_stmt = self._task_list_statements(filters, page, page_size, cursor)
         with get_sync_session() as session:
-            total = session.query(InferenceTask).count()
-            tasks = (
-                session.query(InferenceTask)
-                .order_by(InferenceTask.created_at.desc())
-                .offset((page - 1) * page_size)
-                .limit(page_size)
-                .all()
-            )
+            tasks = list(session.execute(stmt).scalars().all())
+            total = self.history_counts.get(filters)
+            if total is None:
+                total = session.scalar(count_stmt)
+                self.history_counts.set(filters, total)
             # Detach from session
             for task in tasks:
                 session.expunge(task)
-            return tasks, total
+        return self._task_list_result(tasks, page_size, total)
+
+    async def get_task_list_async(self, page: int = 1, page_size: int = 20, filters: Optional[TaskFilters] = None,
+                                  cursor: Optional[str] = None) -> Tuple[list, int, Optional[str]]:
+        """获取任务列表 (异步引擎，供 API 读取)，返回 (任务, 总数, 下一页游标)"""
+        filters = filters or TaskFilters()
+        stmt, count_stmt = self._task_list_statements(filters, page, page_size, cursor)
+        async with get_async_read_session() as session:
+            tasks = list((await session.execute(stmt)).scalars().all())
+            total = self.history_counts.get(filters)
+            if total is None:
+                total = await session.scalar(count_stmt)
+                self.history_counts.set(filters, total)
+            for task in tasks:
+                session.expunge(task)
+        return self._task_list_result(tasks, page_size, total)
+
+    def count_tasks_by_status(self) -> dict:
+        """各状态的任务数"""
+        with get_sync_session() as session:
+            rows = (
+                session.query(InferenceTask.status, func.count(InferenceTask.id))
+                .group_by(InferenceTask.status)
+                .all()
+            )
+        counts = {status.value: 0 for status in TaskStatus}
+        for status, count in rows:
+            if status is not None:
+                counts[status.value] = count
+        return counts
 
     def delete_task(self, task_id: str) -> bool:
         """删除任务"""
+        deleted, _ = self.delete_tasks([task_id])
+        return bool(deleted)
+
+    def delete_tasks(self, task_ids: List[str]) -> Tuple[List[str], ReclaimJob]:
+        """
+        在一个事务里批量删除任务记录，任务目录 (结果、预览金字塔) 交给后台回收
+
+        正在推理的任务先取消，其目录等所在批次结束后再回收，不在批次仍在写入时移走。
+        Returns:
+            (实际删除的任务 ID, 回收作业 (不含仍在推理的任务目录))
+        """
+        task_ids = list(dict.fromkeys(task_ids))
+        deleted = []
         with get_sync_session() as session:
-            task = session.query(InferenceTask).filter_by(id=task_id).first()
-            if not task:
-                return False
-
-            # 删除文件
-            task_dir = self.settings.result_dir / task_id
-            if task_dir.exists():
-                shutil.rmtree(task_dir, ignore_errors=True)
-
-            # 删除数据库记录
-            session.delete(task)
-            return True
+            # 分块避免超过 SQLite 绑定参数上限
+            for start in range(0, len(task_ids), DELETE_CHUNK_SIZE):
+                chunk = task_ids[start:start + DELETE_CHUNK_SIZE]
+                existing = list(session.scalars(select(InferenceTask.id).where(InferenceTask.id.in_(chunk))))
+                if not existing:
+                    continue
+                delete_stage_timings(session, existing)
+                self.storage.forget(existing, session=session)
+                session.execute(delete(InferenceTask).where(InferenceTask.id.in_(existing)))
+                deleted.extend(existing)
+
+        reclaim = []
+        for task_id in deleted:
+            # 正在推理的任务立即中止，释放工作线程
+            self._signal_cancel(task_id)
+            self.progress_buffer.discard(task_id)
+            with self._running_lock:
+                batch = self._running.get(task_id)
+                if batch is not None:
+                    batch.deleted.add(task_id)
+                else:
+                    reclaim.append(task_id)
+        if deleted:
+            self.history_counts.invalidate()
+        job = self.reclaimer.submit(self.settings.result_dir / task_id for task_id in reclaim)
+        return deleted, job
 
 
 # 单例
@@ -0,0 +1,231 @@
+"""
+Prometheus 文本格式的进程内指标
+
+不依赖 prometheus_client。计数器和直方图按线程分片: 每个线程只写自己的 dict，热路径上不加锁，
+/metrics 采集时再把各分片相加 (线程退出后分片保留，累计值不会丢失)。
+Gauge 只在采集时由 /metrics 设置。
+"""
+import bisect
+import threading
+from typing import Dict, List, Sequence, Tuple
+
+# 请求耗时 (秒)
+LATENCY_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+# 推理阶段耗时 (秒)
+STAGE_BUCKETS = (0.1, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0, 60.0, 120.0, 300.0, 600.0)
+
+
+class _Sharded:
+    """每个线程一份数据，首次写入时登记分片"""
+
+    def __init__(self):
+        self._local = threading.local()
+        self._shards: List[dict] = []
+        self._register_lock = threading.Lock()
+
+    def _shard(self) -> dict:
+        shard = getattr(self._local, "shard", None)
+        if shard is None:
+            shard = {}
+            with self._register_lock:
+                self._shards.append(shard)
+            self._local.shard = shard
+        return shard
+
+    def _all_shards(self) -> List[dict]:
+        with self._register_lock:
+            return list(self._shards)
+
+
+def _label_key(labelnames: Sequence[str], labels: dict) -> Tuple[str, ...]:
+    return tuple(str(labels.get(name, "")) for name in labelnames)
+
+
+def _format_labels(labelnames: Sequence[str], key: Tuple[str, ...], extra: str = "") -> str:
+    parts = [f'{name}="{_escape(value)}"' for name, value in zip(labelnames, key)]
+    if extra:
+        parts.append(extra)
+    return "{" + ",".join(parts) + "}" if parts else ""
+
+
+def _escape(value: str) -> str:
+    return value.replace("\\", "\\\\").replace("\n", "\\n").replace('"', '\\"')
+
+
+def _format_value(value: float) -> str:
+    if value == float("inf"):
+        return "+Inf"
+    return repr(float(value)) if isinstance(value, float) else str(value)
+
+
+class Counter(_Sharded):
+    """单调递增计数器"""
+
+    type = "counter"
+
+    def __init__(self, name: str, documentation: str, labelnames: Sequence[str] = ()):
+        super().__init__()
+        self.name = name
+        self.documentation = documentation
+        self.labelnames = tuple(labelnames)
+
+    def inc(self, amount: float = 1, **labels):
+        shard = self._shard()
+        key = _label_key(self.labelnames, labels)
+        shard[key] = shard.get(key, 0) + amount
+
+    def values(self) -> Dict[Tuple[str, ...], float]:
+        totals: Dict[Tuple[str, ...], float] = {}
+        for shard in self._all_shards():
+            for key, value in list(shard.items()):
+                totals[key] = totals.get(key, 0) + value
+        return totals
+
+    def samples(self) -> List[str]:
+        return [
+            f"{self.name}{_format_labels(self.labelnames, key)} {_format_value(value)}"
+            for key, value in sorted(self.values().items())
+        ]
+
+
+class Histogram(_Sharded):
+    """直方图，分片内存各桶的非累计计数，输出时再累加"""
+
+    type = "histogram"
+
+    def __init__(self, name: str, documentation: str, labelnames: Sequence[str] = (),
+                 buckets: Sequence[float] = LATENCY_BUCKETS):
+        super().__init__()
+        self.name = name
+        self.documentation = documentation
+        self.labelnames = tuple(labelnames)
+        self.buckets = tuple(sorted(buckets))
+
+    def observe(self, value: float, **labels):
+        shard = self._shard()
+        key = _label_key(self.labelnames, labels)
+        data = shard.get(key)
+        if data is None:
+            # [各桶计数..., +Inf 桶, sum]
+            data = shard[key] = [0] * (len(self.buckets) + 1) + [0.0]
+        data[bisect.bisect_left(self.buckets, value)] += 1
+        data[-1] += value
+
+    def values(self) -> Dict[Tuple[str, ...], list]:
+        totals: Dict[Tuple[str, ...], list] = {}
+        for shard in self._all_shards():
+            for key, data in list(shard.items()):
+                total = totals.setdefault(key, [0] * (len(self.buckets) + 1) + [0.0])
+                for i, value in enumerate(list(data)):
+                    total[i] += value
+        return totals
+
+    def samples(self) -> List[str]:
+        lines = []
+        for key, data in sorted(self.values().items()):
+            cumulative = 0
+            for bound, count in zip(self.buckets + (float("inf"),), data[:-1]):
+                cumulative += count
+                le = f'le="{_format_value(float(bound))}"'
+                lines.append(f"{self.name}_bucket{_format_labels(self.labelnames, key, le)} {cumulative}")
+            lines.append(f"{self.name}_sum{_format_labels(self.labelnames, key)} {_format_value(data[-1])}")
+            lines.append(f"{self.name}_count{_format_labels(self.labelnames, key)} {cumulative}")
+        return lines
+
+
+class Gauge:
+    """瞬时值，由 /metrics 在采集时设置"""
+
+    type = "gauge"
+
+    def __init__(self, name: str, documentation: str, labelnames: Sequence[str] = ()):
+        self.name = name
+        self.documentation = documentation
+        self.labelnames = tuple(labelnames)
+        self._values: Dict[Tuple[str, ...], float] = {}
+
+    def set(self, value: float, **labels):
+        self._values[_label_key(self.labelnames, labels)] = value
+
+    def samples(self) -> List[str]:
+        return [
+            f"{self.name}{_format_labels(self.labelnames, key)} {_format_value(value)}"
+            for key, value in sorted(dict(self._values).items())
+        ]
+
+
+class Registry:
+    def __init__(self):
+        self._metrics = []
+
+    def register(self, metric):
+        self._metrics.append(metric)
+        return metric
+
+    def render(self) -> str:
+        lines = []
+        for metric in self._metrics:
+            lines.append(f"# HELP {metric.name} {metric.documentation}")
+            lines.append(f"# TYPE {metric.name} {metric.type}")
+            lines.extend(metric.samples())
+        return "\n".join(lines) + "\n"
+
+
+registry = Registry()
+
+# HTTP
+http_request_duration = registry.register(Histogram(
+    "kta_http_request_duration_seconds", "HTTP request latency by router", ("router", "method", "status"),
+))
+http_response_bytes = registry.register(Counter(
+    "kta_http_response_bytes_total", "Response body bytes served (Content-Length) by router", ("router",),
+))
+
+# 预览
+preview_requests = registry.register(Counter(
+    "kta_preview_requests_total", "Preview requests by pyramid result (hit / miss)", ("result",),
+))
+
+# 推理
+inference_stage_duration = registry.register(Histogram(
+    "kta_inference_stage_seconds", "Inference stage duration", ("stage",), buckets=STAGE_BUCKETS,
+))
+tasks_by_status = registry.register(Gauge(
+    "kta_tasks", "Inference tasks by status", ("status",),
+))
+tasks_in_flight = registry.register(Gauge(
+    "kta_tasks_in_flight", "Tasks currently being processed by this process's workers",
+))
+workers_total = registry.register(Gauge(
+    "kta_workers", "Inference worker threads",
+))
+workers_busy = registry.register(Gauge(
+    "kta_workers_busy", "Inference worker threads currently running a batch",
+))
+worker_busy_seconds = registry.register(Counter(
+    "kta_worker_busy_seconds_total", "Seconds worker threads spent running batches (rate / kta_workers = utilization)",
+))
+queue_wait = registry.register(Gauge(
+    "kta_queue_wait_seconds", "Predicted wait before a newly queued task starts",
+))
+admission_rejected = registry.register(Counter(
+    "kta_admission_rejected_total", "Inference requests rejected by admission control", ("code",),
+))
+
+# 磁盘
+storage_bytes = registry.register(Gauge(
+    "kta_storage_bytes", "Bytes recorded in the storage ledger by tier", ("tier",),
+))
+
+
+ROUTERS = ("inference", "history", "files", "metrics")
+
+
+def router_label(path: str) -> str:
+    """按路由模块归类请求路径 (/api/v1、/v1 前缀同样处理)，其它路径归为 other"""
+    parts = [p for p in path.split("/") if p]
+    if parts[:2] == ["api", "v1"]:
+        parts = parts[2:]
+    elif parts[:1] == ["v1"]:
+        parts = parts[1:]
+    return parts[0] if parts and parts[0] in ROUTERS else "other"
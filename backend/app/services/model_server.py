@@ -0,0 +1,161 @@
+"""
+常驻推理服务客户端
+
+负责按需拉起 nnUNet-msgpu1.10/serve.py，并通过 Unix socket 提交病例。
+模型在服务进程里只加载一次，后续任务不再重复导入 MindSpore / 加载 checkpoint。
+"""
+import json
+import socket
+import subprocess
+import threading
+import time
+from pathlib import Path
+from typing import Callable, Optional, Tuple
+
+# 服务开始处理本次提交之前，两条 queued 心跳之间最长的间隔 (秒)，serve.py 每 5 秒发送一次
+QUEUE_HEARTBEAT_TIMEOUT = 30.0
+
+
+class ModelServerClient:
+    """serve.py 的客户端，线程安全"""
+
+    def __init__(self, socket_path: Path, command: list, cwd: Path, env: dict, log_path: Path,
+                 startup_timeout: float = 300):
+        self.socket_path = Path(socket_path)
+        self.command = command
+        self.cwd = cwd
+        self.env = env
+        self.log_path = Path(log_path)
+        self.startup_timeout = startup_timeout
+        self._process: Optional[subprocess.Popen] = None
+        self._start_lock = threading.Lock()
+
+    def _connect(self, timeout: Optional[float]) -> socket.socket:
+        sock = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+        sock.settimeout(timeout)
+        try:
+            sock.connect(str(self.socket_path))
+        except OSError:
+            sock.close()
+            raise
+        return sock
+
+    def _request(self, payload: dict, timeout: Optional[float]) -> dict:
+        with self._connect(timeout) as sock:
+            sock.sendall((json.dumps(payload) + "\n").encode("utf-8"))
+            with sock.makefile("r", encoding="utf-8") as reader:
+                line = reader.readline()
+        if not line:
+            raise ConnectionError("model server closed the connection")
+        return json.loads(line)
+
+    def ping(self) -> Optional[dict]:
+        """服务可用时返回 ping 响应，否则返回 None"""
+        try:
+            return self._request({"cmd": "ping"}, timeout=5)
+        except (OSError, ValueError):
+            return None
+
+    def ensure_running(self):
+        """服务不在线时拉起 serve.py，并等待 socket 可用"""
+        with self._start_lock:
+            if self.ping():
+                return
+
+            if self._process is None or self._process.poll() is not None:
+                self.socket_path.parent.mkdir(parents=True, exist_ok=True)
+                self.log_path.parent.mkdir(parents=True, exist_ok=True)
+                print(f"Starting model server: {' '.join(self.command)}")
+                with open(self.log_path, "ab") as log:
+                    self._process = subprocess.Popen(
+                        self.command,
+                        cwd=str(self.cwd),
+                        env=self.env,
+                        stdout=log,
+                        stderr=subprocess.STDOUT,
+                    )
+
+            deadline = time.time() + self.startup_timeout
+            while time.time() < deadline:
+                if self._process.poll() is not None:
+                    raise RuntimeError(
+                        f"model server exited with code {self._process.returncode}, see {self.log_path}"
+                    )
+                if self.ping():
+                    return
+                time.sleep(0.5)
+            raise TimeoutError(f"model server did not start within {self.startup_timeout}s")
+
+    def predict(self, cases: list, timeout: Optional[float] = None,
+                on_progress: Optional[Callable[[dict], None]] = None,
+                queue_timeout: Optional[float] = None) -> Tuple[bool, str]:
+        """
+        提交病例 [{"input_files": [...], "output_file": ...}]，返回 (success, error_msg)
+
+        服务在最终响应前逐行推送 {"event": "progress", ...}，交给 on_progress 处理。
+        等待其它提交推理完成期间服务定时发送 queued，超过 QUEUE_HEARTBEAT_TIMEOUT 没有收到视为服务无响应，
+        排队总时长不超过 queue_timeout；timeout 从 started (服务开始处理本次提交) 起计时。
+        超时或出错时通知服务取消这些病例，再抛出异常。
+        """
+        self.ensure_running()
+        case_ids = [Path(case["output_file"]).name[:-len(".nii.gz")] for case in cases]
+        queue_deadline = time.time() + queue_timeout if queue_timeout else None
+        started = False
+        deadline = None
+        try:
+            with self._connect(QUEUE_HEARTBEAT_TIMEOUT) as sock:
+                sock.sendall((json.dumps({"cmd": "predict", "cases": cases}) + "\n").encode("utf-8"))
+                with sock.makefile("r", encoding="utf-8") as reader:
+                    while True:
+                        if not started:
+                            remaining = QUEUE_HEARTBEAT_TIMEOUT
+                            if queue_deadline is not None:
+                                remaining = min(remaining, queue_deadline - time.time())
+                        elif deadline is not None:
+                            remaining = deadline - time.time()
+                        else:
+                            remaining = None
+                        if remaining is not None and remaining <= 0:
+                            raise socket.timeout("model server predict timed out")
+                        sock.settimeout(remaining)
+                        line = reader.readline()
+                        if not line:
+                            raise ConnectionError("model server closed the connection")
+                        response = json.loads(line)
+                        if response.get("event") != "progress":
+                            break
+                        if response.get("stage") == "started" and not started:
+                            started = True
+                            if timeout:
+                                deadline = time.time() + timeout
+                        if on_progress is not None:
+                            on_progress(response)
+        except Exception:
+            # 放弃等待后服务仍可能在推理这些病例，通知它停止
+            self.cancel(case_ids)
+            raise
+        if not response.get("ok"):
+            return False, response.get("error") or "model server predict failed"
+        return True, ""
+
+    def cancel(self, case_ids: list) -> bool:
+        """取消病例 (病例 ID 即输出文件名去掉 .nii.gz)，服务不在线时返回 False"""
+        try:
+            return bool(self._request({"cmd": "cancel", "cases": list(case_ids)}, timeout=5).get("ok"))
+        except (OSError, ValueError):
+            return False
+
+    def stop(self):
+        """关闭服务进程"""
+        with self._start_lock:
+            try:
+                self._request({"cmd": "shutdown"}, timeout=5)
+            except (OSError, ValueError):
+                pass
+            if self._process is not None:
+                try:
+                    self._process.wait(timeout=10)
+                except subprocess.TimeoutExpired:
+                    self._process.kill()
+                self._process = None
+
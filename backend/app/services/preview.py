@@ -0,0 +1,232 @@
+"""
+预览 (降采样) 金字塔生成服务
+
+任务完成时为 original / segmentation 一次性生成 2x/4x/8x 金字塔，每一级由上一级降采样得到，
+文件放在 <任务目录>/preview/g<代数>/ 下；重新推理会增加任务代数，旧金字塔随之失效。
+
+降采样是 CPU 密集型操作，放在进程池中执行，避免阻塞事件循环和推理线程。
+同一 (任务, 文件, 代数) 的并发请求合并为一次计算 (single-flight)，
+结果先写临时文件再原子替换，不会出现多个进程同时写同一个缓存文件。
+"""
+import gzip
+import itertools
+import multiprocessing
+import os
+import shutil
+import threading
+import uuid
+from concurrent.futures import Future, ProcessPoolExecutor
+from pathlib import Path
+from typing import Dict, Hashable, List, Optional
+
+import nibabel as nib
+import numpy as np
+
+from app.core.config import get_settings
+from app.services.staging import link_or_copy
+
+# 金字塔层级 (降采样因子)
+PYRAMID_FACTORS = (2, 4, 8)
+PREVIEW_FILES = ("original.nii.gz", "segmentation.nii.gz")
+
+
+def pyramid_dir(task_dir: Path, generation: int) -> Path:
+    return Path(task_dir) / "preview" / f"g{generation}"
+
+
+def pyramid_path(task_dir: Path, generation: int, filename: str, factor: int) -> Path:
+    """金字塔中某一级的文件路径"""
+    return pyramid_dir(task_dir, generation) / f"{factor}x_{filename}"
+
+
+def _pad_to_multiple(data: np.ndarray, factor: int) -> np.ndarray:
+    """尺寸不能整除时按边缘值补齐，输出尺寸为向上取整"""
+    pad = [(0, -n % factor) for n in data.shape]
+    if any(p[1] for p in pad):
+        data = np.pad(data, pad, mode="edge")
+    return data
+
+
+def _block_sum(data: np.ndarray, factor: int, dtype) -> np.ndarray:
+    """factor^3 块求和: 累加 factor^3 个步长切片视图，不产生整块的转置副本"""
+    out = np.zeros(tuple(n // factor for n in data.shape), dtype=dtype)
+    for i, j, k in itertools.product(range(factor), repeat=3):
+        out += data[i::factor, j::factor, k::factor]
+    return out
+
+
+def reduce_intensity(data: np.ndarray, factor: int) -> np.ndarray:
+    """CT 块均值降采样，结果保持 int16"""
+    data = _pad_to_multiple(data, factor)
+    total = _block_sum(data, factor, np.int32 if data.dtype.kind in "iu" else np.float64)
+    info = np.iinfo(np.int16)
+    return np.clip(np.rint(total / factor ** 3), info.min, info.max).astype(np.int16)
+
+
+def reduce_labels(data: np.ndarray, factor: int) -> np.ndarray:
+    """
+    标签块降采样，结果为 uint8
+
+    肿瘤严格优先: 块内有肿瘤 (2) 即为 2，否则有肾脏 (1) 即为 1，否则为 0。
+    标签值就是优先级，取块内最大值即可；逐级降采样时单个肿瘤体素在 8x 下也不会消失。
+    """
+    data = _pad_to_multiple(data.astype(np.uint8, copy=False), factor)
+    result = np.zeros(tuple(n // factor for n in data.shape), dtype=np.uint8)
+    for i, j, k in itertools.product(range(factor), repeat=3):
+        np.maximum(result, data[i::factor, j::factor, k::factor], out=result)
+    return result
+
+
+def reduce_volume(data: np.ndarray, factor: int, is_label: bool) -> np.ndarray:
+    """把体数据缩小 factor 倍 (factor 为整数块大小)"""
+    if data.ndim != 3 or factor == 1:
+        return data
+    if is_label:
+        return reduce_labels(data, factor)
+    return reduce_intensity(data, factor)
+
+
+def encode_preview(data: np.ndarray, source: nib.Nifti1Image, factor: int) -> bytes:
+    """按降采样因子更新 affine / header，返回 gzip 压缩后的 NIfTI 字节"""
+    # 更新 affine 矩阵: 体素尺寸放大 factor 倍，原点移到第一个块的中心
+    offset = (factor - 1) / 2.0
+    scale_matrix = np.array([
+        [factor, 0, 0, offset],
+        [0, factor, 0, offset],
+        [0, 0, factor, offset],
+        [0, 0, 0, 1],
+    ], dtype=np.float64)
+    new_affine = source.affine @ scale_matrix
+
+    # 更新 header
+    new_header = source.header.copy()
+    new_header.set_data_shape(data.shape)
+    new_header.set_data_dtype(data.dtype)
+    zooms = source.header.get_zooms()
+    new_header.set_zooms([z * factor for z in zooms[:3]])
+
+    new_nii = nib.Nifti1Image(data, new_affine, new_header)
+    # 数据已是最终数值，不再使用原文件的 scl_slope / scl_inter
+    new_nii.header.set_slope_inter(1, 0)
+    # nib.save 不支持 BytesIO，直接序列化
+    return gzip.compress(new_nii.to_bytes(), compresslevel=6)
+
+
+def _atomic_write(path: Path, data: bytes):
+    tmp = path.with_name(f".{path.name}.{uuid.uuid4().hex}.tmp")
+    try:
+        tmp.write_bytes(data)
+        os.replace(tmp, path)
+    finally:
+        if tmp.exists():
+            tmp.unlink()
+
+
+def build_preview_pyramid(input_path: str, output_dir: str, filename: str,
+                          factors=PYRAMID_FACTORS) -> List[str]:
+    """在工作进程中生成一个文件的全部金字塔层级，返回生成的文件路径"""
+    nii = nib.load(input_path)
+    is_label = filename.startswith("segmentation")
+    output = Path(output_dir)
+    output.mkdir(parents=True, exist_ok=True)
+
+    # 原生整数类型读取: CT 为 int16 (HU)，分割为 uint8，不再展开成 float64
+    level = np.asanyarray(nii.dataobj)
+    if is_label:
+        level = level.astype(np.uint8, copy=False)
+    elif level.dtype != np.int16:
+        info = np.iinfo(np.int16)
+        level = np.clip(np.rint(level), info.min, info.max).astype(np.int16)
+    current = 1
+    written = []
+    for factor in sorted(factors):
+        # 每一级由上一级降采样，而不是每次都从全分辨率开始
+        level = reduce_volume(level, factor // current, is_label)
+        current = factor
+        path = output / f"{factor}x_{filename}"
+        _atomic_write(path, encode_preview(level, nii, factor))
+        written.append(str(path))
+    return written
+
+
+def link_pyramid(src_task_dir: Path, src_generation: int, dest_task_dir: Path, dest_generation: int) -> bool:
+    """复用其它任务的金字塔 (内容相同的输入和结果)，全部层级存在时硬链接过去"""
+    sources = [
+        pyramid_path(src_task_dir, src_generation, filename, factor)
+        for filename in PREVIEW_FILES for factor in PYRAMID_FACTORS
+    ]
+    if not all(p.exists() for p in sources):
+        return False
+    dest_dir = pyramid_dir(dest_task_dir, dest_generation)
+    for src in sources:
+        link_or_copy(src, dest_dir / src.name)
+    return True
+
+
+class PreviewService:
+    """预览生成进程池 + single-flight"""
+
+    def __init__(self, max_workers: int = 2):
+        self.max_workers = max_workers
+        self._executor: Optional[ProcessPoolExecutor] = None
+        self._lock = threading.Lock()
+        self._inflight: Dict[Hashable, Future] = {}
+
+    def _get_executor(self) -> ProcessPoolExecutor:
+        if self._executor is None:
+            # spawn: 主进程里有推理/队列线程，fork 可能继承被持有的锁
+            self._executor = ProcessPoolExecutor(
+                max_workers=self.max_workers,
+                mp_context=multiprocessing.get_context("spawn"),
+            )
+        return self._executor
+
+    def submit(self, key: Hashable, fn, *args) -> Future:
+        """提交任务；同一 key 已在执行中时返回同一个 Future"""
+        with self._lock:
+            future = self._inflight.get(key)
+            if future is not None:
+                return future
+            future = self._get_executor().submit(fn, *args)
+            self._inflight[key] = future
+
+        def _done(_):
+            with self._lock:
+                if self._inflight.get(key) is future:
+                    del self._inflight[key]
+
+        future.add_done_callback(_done)
+        return future
+
+    def schedule_pyramid(self, task_id: str, task_dir: Path, generation: int) -> List[Future]:
+        """为任务的 original / segmentation 提交金字塔生成 (已在生成中的不重复提交)"""
+        output_dir = pyramid_dir(task_dir, generation)
+        futures = []
+        for filename in PREVIEW_FILES:
+            input_path = Path(task_dir) / filename
+            if not input_path.exists():
+                continue
+            futures.append(self.submit(
+                (task_id, filename, generation),
+                build_preview_pyramid, str(input_path), str(output_dir), filename,
+            ))
+        return futures
+
+    def build_pyramid(self, task_id: str, task_dir: Path, generation: int):
+        """生成金字塔并等待完成 (推理线程在任务收尾阶段调用)"""
+        for future in self.schedule_pyramid(task_id, task_dir, generation):
+            future.result()
+        # 清理旧代数的金字塔
+        for old in (Path(task_dir) / "preview").glob("g*"):
+            if old.name != f"g{generation}":
+                shutil.rmtree(old, ignore_errors=True)
+
+    def shutdown(self):
+        with self._lock:
+            if self._executor is not None:
+                self._executor.shutdown(wait=False, cancel_futures=True)
+                self._executor = None
+
+
+# 单例
+preview_service = PreviewService(max_workers=get_settings().preview_workers)
@@ -0,0 +1,165 @@
+"""
+推理进度解析
+
+nnU-Net (eval.py --progress_json / serve.py) 以逐行 JSON 报告进度:
+
+    {"event": "progress", "stage": "predict", "case": "<task_id>", "fold": 0, "num_folds": 1, "tile": 12, "num_tiles": 96}
+
+num_tiles 为实际推理的区块数，skipped_tiles 为体表掩膜以外被跳过的区块数。
+
+阶段依次为 preprocess -> predict (按 fold、按滑窗区块) -> export -> exported -> postprocess -> done，
+这里把它们映射到任务进度的 20% ~ 80% 区间，并按事件到达时间统计各阶段耗时。
+常驻推理服务在这之前还会发送 queued (受理，等待其它提交期间重复发送) 和 started (开始处理本次提交)。
+"""
+import json
+import threading
+import time
+from typing import Callable, Dict, List, Optional
+
+PROGRESS_START = 20
+PROGRESS_END = 80
+
+# 各阶段在 20% ~ 80% 区间内的位置
+_STAGE_PROGRESS = {
+    "preprocess": 22,
+    "export": 76,
+    "exported": 78,
+    "postprocess": 79,
+}
+_PREDICT_START = 25
+_PREDICT_END = 75
+
+_STAGE_MESSAGES = {
+    "preprocess": "正在预处理...",
+    "export": "正在导出分割结果...",
+    "exported": "正在导出分割结果...",
+    "postprocess": "正在后处理...",
+}
+
+
+def parse_progress_line(line: str) -> Optional[dict]:
+    """解析一行输出，不是进度事件时返回 None"""
+    line = line.strip()
+    if not line.startswith("{"):
+        return None
+    try:
+        event = json.loads(line)
+    except ValueError:
+        return None
+    if not isinstance(event, dict) or event.get("event") != "progress":
+        return None
+    return event
+
+
+def progress_from_event(event: dict) -> Optional[int]:
+    """进度事件对应的任务进度 (百分比)，无法映射时返回 None"""
+    stage = event.get("stage")
+    if stage in _STAGE_PROGRESS:
+        return _STAGE_PROGRESS[stage]
+    if stage != "predict":
+        return None
+    num_tiles = max(1, int(event.get("num_tiles") or 1))
+    num_folds = max(1, int(event.get("num_folds") or 1))
+    fraction = (int(event.get("fold") or 0) + min(int(event.get("tile") or 0), num_tiles) / num_tiles) / num_folds
+    return _PREDICT_START + int((_PREDICT_END - _PREDICT_START) * min(fraction, 1.0))
+
+
+def message_from_event(event: dict) -> str:
+    stage = event.get("stage")
+    if stage == "predict":
+        message = f"正在执行分割推理 (区块 {event.get('tile', 0)}/{event.get('num_tiles', '?')}"
+        if event.get("skipped_tiles"):
+            message += f", 跳过背景区块 {event['skipped_tiles']}"
+        if (event.get("num_folds") or 1) > 1:
+            message += f", fold {int(event.get('fold') or 0) + 1}/{event['num_folds']}"
+        return message + ")"
+    return _STAGE_MESSAGES.get(stage, "正在执行分割推理...")
+
+
+class ProgressTracker:
+    """
+    把一次预测 (可能包含多个病例) 的进度事件分发给对应任务，并按事件时间统计各阶段耗时
+
+    事件中的 case 为输出文件名去掉 .nii.gz，即任务 ID；不带 case 的事件 (postprocess) 作用于全部任务。
+    只在某个任务的进度前进时才调用 update，避免每个区块都写库。
+    """
+
+    def __init__(self, task_ids: List[str], update: Callable[[str, int, str], None],
+                 clock: Callable[[], float] = time.monotonic):
+        self.task_ids = list(task_ids)
+        self.update = update
+        self.clock = clock
+        # {task_id: {stage: 秒}}，阶段名见 app.services.timings.STAGES
+        self.timings: Dict[str, Dict[str, float]] = {task_id: {} for task_id in self.task_ids}
+        # {task_id: 滑窗区块总数 (各 fold 之和)}，用于按区块统计吞吐
+        self.tiles: Dict[str, int] = {}
+        self._progress: Dict[str, int] = {task_id: PROGRESS_START for task_id in self.task_ids}
+        self._marks: Dict[str, Dict[str, float]] = {task_id: {} for task_id in self.task_ids}
+        self._started = clock()
+        self._queued_at: Optional[float] = None  # 推理服务受理本次提交的时刻
+        self._ready_at: Optional[float] = None  # 推理循环开始等待下一个病例的时刻
+        self._postprocess_at: Optional[float] = None
+        self._lock = threading.Lock()
+
+    def __call__(self, event: dict):
+        with self._lock:
+            self._record_timing(event)
+        progress = progress_from_event(event)
+        if progress is None:
+            return
+        case = event.get("case")
+        targets = [case] if case is not None else self.task_ids
+        message = message_from_event(event)
+        for task_id in targets:
+            with self._lock:
+                if task_id not in self._progress or progress <= self._progress[task_id]:
+                    continue
+                self._progress[task_id] = progress
+            self.update(task_id, progress, message)
+
+    def _share(self, stage: str, seconds: float):
+        """整批共享的阶段按病例数均摊"""
+        for task_id in self.task_ids:
+            self.timings[task_id][stage] = seconds / len(self.task_ids)
+
+    def _record_timing(self, event: dict):
+        now = self.clock()
+        stage = event.get("stage")
+        if stage == "queued":
+            if self._queued_at is None:
+                # 连接推理服务之前: 必要时拉起服务、加载模型和 checkpoint
+                self._queued_at = now
+                self._share("model_load", now - self._started)
+            return
+        if self._ready_at is None:
+            self._ready_at = now
+            if self._queued_at is None:
+                # 第一条事件之前: 启动解释器、加载模型和 checkpoint
+                self._share("model_load", now - self._started)
+            else:
+                # 推理服务正在处理其它提交 (predict_lock)
+                self._share("lock_wait", now - self._queued_at)
+        if stage == "started":
+            return
+
+        case = event.get("case")
+        marks = self._marks.get(case)
+        if marks is not None:
+            if stage == "predict" and event.get("num_tiles"):
+                # 按跳过前的区块数记录，与耗时预估中由 NIfTI 头推算的区块数一致
+                grid_tiles = int(event["num_tiles"]) + int(event.get("skipped_tiles") or 0)
+                self.tiles[case] = grid_tiles * max(1, int(event.get("num_folds") or 1))
+            if stage == "predict" and "predict" not in marks:
+                # 预处理与上一例推理重叠，只统计推理循环实际等待的时间
+                marks["predict"] = now
+                self.timings[case]["preprocess"] = max(0.0, now - self._ready_at)
+            elif stage == "export" and "predict" in marks and "export" not in marks:
+                marks["export"] = now
+                self.timings[case]["inference"] = now - marks["predict"]
+                self._ready_at = now
+            elif stage == "exported" and "export" in marks:
+                self.timings[case]["export"] = now - marks["export"]
+        elif stage == "postprocess":
+            self._postprocess_at = now
+        elif stage == "done" and self._postprocess_at is not None:
+            self._share("postprocess", now - self._postprocess_at)
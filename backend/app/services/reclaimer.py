@@ -0,0 +1,141 @@
+"""
+后台文件回收
+
+删除任务时先把任务目录 rename 到回收站 (同一文件系统内是原子操作，立即对外不可见)，
+再由后台线程慢慢 rmtree，接口不再等待大目录删除完成。
+进程中断时回收站里残留的目录会在下次启动时继续清理。
+"""
+import os
+import queue
+import shutil
+import threading
+import uuid
+from collections import OrderedDict
+from dataclasses import dataclass, field
+from datetime import datetime
+from pathlib import Path
+from typing import Iterable, List, Optional
+
+# 最多保留最近多少个回收作业的状态
+MAX_TRACKED_JOBS = 1000
+
+
+@dataclass
+class ReclaimJob:
+    """一次回收作业: 一批待删除的目录"""
+    id: str
+    paths: List[Path]
+    status: str = "pending"  # pending / running / done
+    removed: int = 0
+    failed: int = 0
+    created_at: datetime = field(default_factory=datetime.utcnow)
+    finished_at: Optional[datetime] = None
+
+    def to_dict(self):
+        return {
+            "jobId": self.id,
+            "status": self.status,
+            "total": len(self.paths),
+            "removed": self.removed,
+            "failed": self.failed,
+            "createdAt": self.created_at.isoformat(),
+            "finishedAt": self.finished_at.isoformat() if self.finished_at else None,
+        }
+
+
+class FileReclaimer:
+    """回收站 + 单个后台删除线程"""
+
+    def __init__(self, trash_dir: Path):
+        self.trash_dir = Path(trash_dir)
+        self._queue: "queue.Queue[Optional[ReclaimJob]]" = queue.Queue()
+        self._jobs: "OrderedDict[str, ReclaimJob]" = OrderedDict()
+        self._lock = threading.Lock()
+        self._thread: Optional[threading.Thread] = None
+
+    def submit(self, paths: Iterable[Path]) -> ReclaimJob:
+        """把路径移入回收站并登记回收作业，立即返回"""
+        self.trash_dir.mkdir(parents=True, exist_ok=True)
+        moved = []
+        for path in paths:
+            path = Path(path)
+            if not path.exists():
+                continue
+            target = self.trash_dir / f"{path.name}-{uuid.uuid4().hex[:8]}"
+            try:
+                os.rename(path, target)
+            except OSError:
+                # 跨文件系统等无法 rename 的情况，留在原处由后台直接删除
+                target = path
+            moved.append(target)
+        return self._enqueue(moved)
+
+    def sweep(self) -> Optional[ReclaimJob]:
+        """回收上次进程退出时没删完的目录"""
+        if not self.trash_dir.exists():
+            return None
+        leftovers = list(self.trash_dir.iterdir())
+        if not leftovers:
+            return None
+        print(f"Reclaiming {len(leftovers)} leftover paths in {self.trash_dir}")
+        return self._enqueue(leftovers)
+
+    def get(self, job_id: str) -> Optional[ReclaimJob]:
+        with self._lock:
+            return self._jobs.get(job_id)
+
+    def start(self):
+        with self._lock:
+            if self._thread is not None:
+                return
+            self._thread = threading.Thread(target=self._run, name="file-reclaimer", daemon=True)
+            self._thread.start()
+
+    def stop(self, timeout: float = 5):
+        with self._lock:
+            thread, self._thread = self._thread, None
+        if thread is not None:
+            self._queue.put(None)
+            thread.join(timeout=timeout)
+
+    def wait(self, timeout: Optional[float] = None):
+        """等待已提交的作业全部完成 (测试和关闭时使用)"""
+        with self._queue.all_tasks_done:
+            if self._queue.unfinished_tasks:
+                self._queue.all_tasks_done.wait(timeout)
+
+    def _enqueue(self, paths: List[Path]) -> ReclaimJob:
+        job = ReclaimJob(id=uuid.uuid4().hex, paths=paths)
+        with self._lock:
+            self._jobs[job.id] = job
+            while len(self._jobs) > MAX_TRACKED_JOBS:
+                self._jobs.popitem(last=False)
+        if not paths:
+            job.status = "done"
+            job.finished_at = datetime.utcnow()
+            return job
+        self.start()
+        self._queue.put(job)
+        return job
+
+    def _run(self):
+        while True:
+            job = self._queue.get()
+            try:
+                if job is None:
+                    return
+                job.status = "running"
+                for path in job.paths:
+                    try:
+                        if path.is_dir() and not path.is_symlink():
+                            shutil.rmtree(path)
+                        else:
+                            path.unlink(missing_ok=True)
+                        job.removed += 1
+                    except OSError as e:
+                        job.failed += 1
+                        print(f"Reclaim error for {path}: {e}")
+                job.status = "done"
+                job.finished_at = datetime.utcnow()
+            finally:
+                self._queue.task_done()
@@ -0,0 +1,63 @@
+"""
+零拷贝文件暂存
+
+任务流转中的同一份文件 (上传 -> 内容仓库 -> 任务目录 -> 推理输入) 不再反复复制:
+优先硬链接，其次 reflink (写时复制，btrfs / XFS 等支持)，都不可用时才真正复制。
+
+目标文件可能是其它任务文件的硬链接，因此从不以 "wb" 打开已存在的路径:
+先写到同目录下唯一的临时文件，再原子替换到目标位置。
+"""
+import os
+import shutil
+import uuid
+from pathlib import Path
+
+try:
+    import fcntl
+except ImportError:  # Windows
+    fcntl = None
+
+# linux/fs.h: FICLONE = _IOW(0x94, 9, int)
+FICLONE = 0x40049409
+
+
+def _reflink(src: Path, dest: Path) -> bool:
+    """dest 必须是新路径 (独占创建，不会截断已有文件)"""
+    if fcntl is None:
+        return False
+    with open(src, "rb") as s, open(dest, "xb") as d:
+        try:
+            fcntl.ioctl(d.fileno(), FICLONE, s.fileno())
+            return True
+        except OSError:
+            pass
+    # 只删除本函数刚创建的空文件
+    dest.unlink(missing_ok=True)
+    return False
+
+
+def link_or_copy(src: Path, dest: Path) -> str:
+    """
+    把 src 暂存到 dest (dest 已存在时覆盖)
+
+    Returns:
+        使用的方式: "link" / "reflink" / "copy"
+    """
+    src, dest = Path(src), Path(dest)
+    dest.parent.mkdir(parents=True, exist_ok=True)
+    tmp = dest.with_name(f".{dest.name}.{uuid.uuid4().hex}.tmp")
+    try:
+        try:
+            os.link(src, tmp)
+            method = "link"
+        except OSError:
+            if _reflink(src, tmp):
+                method = "reflink"
+            else:
+                shutil.copy2(src, tmp)
+                method = "copy"
+        os.replace(tmp, dest)
+    finally:
+        # dest 与 tmp 是同一文件的硬链接时 rename 不做任何事，tmp 需要手动删除
+        tmp.unlink(missing_ok=True)
+    return method
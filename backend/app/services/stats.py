@@ -0,0 +1,153 @@
+"""
+分割结果统计
+
+按标签的原生整数类型读取分割图，对前景做一次连通域标记，再用一次 bincount 同时得到
+各连通域的肾脏 / 肿瘤体素数；左右肾体积和每个病灶的体积、包围盒只在前景连通域的包围盒内计算。
+标签约定: 0 背景, 1 肾脏, 2 肿瘤。
+"""
+import itertools
+from pathlib import Path
+from typing import Optional
+
+import nibabel as nib
+import numpy as np
+from scipy import ndimage
+
+KIDNEY_LABEL = 1
+TUMOR_LABEL = 2
+
+# 3D 26 邻域连通
+_STRUCTURE = np.ones((3, 3, 3), dtype=bool)
+
+
+def _label_array(nii: nib.Nifti1Image) -> np.ndarray:
+    """读取标签数组，保持 uint8，不展开为 float64"""
+    data = np.asanyarray(nii.dataobj)
+    if data.dtype.kind == "f":
+        data = np.rint(data)
+    return data.astype(np.uint8, copy=False)
+
+
+def compute_segmentation_stats(seg_path: Path, max_lesions: Optional[int] = 50) -> dict:
+    """
+    计算分割统计
+
+    Returns:
+        {
+            "kidney_volume", "tumor_volume": 肾脏 / 肿瘤体积 (mm³),
+            "kidney_left_volume", "kidney_right_volume": 左 / 右肾体积 (mm³，不含肿瘤),
+            "tumor_count": 肿瘤病灶数,
+            "lesions": [{"volume", "voxels", "bbox", "side"}]  按体积降序，bbox 为体素下标 [start, stop)
+        }
+    """
+    nii = nib.load(str(seg_path))
+    data = _label_array(nii)
+    voxel_volume = float(np.prod(nii.header.get_zooms()[:3]))  # mm³
+
+    stats = {
+        "kidney_volume": 0.0,
+        "tumor_volume": 0.0,
+        "kidney_left_volume": 0.0,
+        "kidney_right_volume": 0.0,
+        "tumor_count": 0,
+        "lesions": [],
+    }
+    if data.ndim != 3:
+        counts = np.bincount(data.ravel(), minlength=TUMOR_LABEL + 1)
+        stats["kidney_volume"] = float(counts[KIDNEY_LABEL] * voxel_volume)
+        stats["tumor_volume"] = float(counts[TUMOR_LABEL] * voxel_volume)
+        return stats
+
+    # 前景 (肾脏 + 肿瘤) 只做一次连通域标记；components * 3 + 标签 的一次 bincount
+    # 同时得到每个连通域的背景 / 肾脏 / 肿瘤体素数 (背景都落在 0 号连通域)
+    components, n_components = ndimage.label(data > 0, structure=_STRUCTURE)
+    combined = components * 3
+    combined += data
+    per_component = np.bincount(combined.ravel(), minlength=3 * (n_components + 1)).reshape(-1, 3)
+    del combined
+    stats["kidney_volume"] = float(per_component[:, KIDNEY_LABEL].sum() * voxel_volume)
+    stats["tumor_volume"] = float(per_component[:, TUMOR_LABEL].sum() * voxel_volume)
+    if n_components == 0:
+        return stats
+
+    # 之后只在各连通域的包围盒内计算
+    affine = nii.affine
+    boxes = ndimage.find_objects(components)
+    masks = [components[box] == index for index, box in enumerate(boxes, start=1)]
+    centers = [_world_x(affine, _offset(ndimage.center_of_mass(mask), box)) for mask, box in zip(masks, boxes)]
+    midline = _midline(affine, data.shape, centers, per_component[1:].sum(axis=1))
+
+    lesions = []
+    for index, (box, mask) in enumerate(zip(boxes, masks), start=1):
+        side = _right_of(affine, box, midline)
+        if side is None:
+            # 连通域跨过中线 (如马蹄肾)，按体素分左右
+            kidney = mask & (data[box] == KIDNEY_LABEL)
+            right = np.count_nonzero(kidney & (_world_x_grid(affine, box) > midline))
+        else:
+            right = per_component[index, KIDNEY_LABEL] if side else 0
+        stats["kidney_right_volume"] += float(right * voxel_volume)
+        stats["kidney_left_volume"] += float((per_component[index, KIDNEY_LABEL] - right) * voxel_volume)
+        if per_component[index, TUMOR_LABEL]:
+            lesions.extend(_lesions(mask & (data[box] == TUMOR_LABEL), box, affine, midline, voxel_volume))
+
+    stats["tumor_count"] = len(lesions)
+    lesions.sort(key=lambda lesion: lesion["volume"], reverse=True)
+    stats["lesions"] = lesions[:max_lesions] if max_lesions else lesions
+    return stats
+
+
+def _midline(affine: np.ndarray, shape: tuple, centers: list, sizes: np.ndarray) -> float:
+    """
+    患者中线的世界坐标 x: 取最大的两个前景连通域 (两侧肾脏) 质心的中点，与扫描范围是否居中、是否裁剪无关；
+    只有一个连通域时 (单肾、马蹄肾) 没有别的参照，退回影像中心
+    """
+    if len(centers) >= 2:
+        first, second = np.argsort(sizes, kind="stable")[::-1][:2]
+        return (centers[first] + centers[second]) / 2.0
+    return _world_x(affine, (np.array(shape) - 1) / 2.0)
+
+
+def _right_of(affine: np.ndarray, box: tuple, midline: float) -> Optional[bool]:
+    """包围盒整体在中线右侧返回 True，整体在左侧返回 False，跨过中线返回 None"""
+    corners = [_world_x(affine, corner) for corner in itertools.product(*[(s.start, s.stop - 1) for s in box])]
+    if min(corners) > midline:
+        return True
+    if max(corners) <= midline:
+        return False
+    return None
+
+
+def _world_x_grid(affine: np.ndarray, box: tuple) -> np.ndarray:
+    """包围盒内每个体素的世界坐标 x (广播相加，不展开坐标网格)"""
+    grid = np.ogrid[tuple(box)]
+    return sum(affine[0, axis] * grid[axis] for axis in range(3)) + affine[0, 3]
+
+
+def _lesions(tumor: np.ndarray, box: tuple, affine: np.ndarray, midline: float, voxel_volume: float) -> list:
+    """一个前景连通域包围盒内的肿瘤病灶，bbox 换算回整幅图像的体素下标，按病灶质心分左右"""
+    tumors, n_tumors = ndimage.label(tumor, structure=_STRUCTURE)
+    tumor_voxels = np.bincount(tumors.ravel(), minlength=n_tumors + 1)
+    centroids = ndimage.center_of_mass(tumor, tumors, range(1, n_tumors + 1))
+    lesions = []
+    for index, bbox in enumerate(ndimage.find_objects(tumors), start=1):
+        lesions.append({
+            "volume": float(tumor_voxels[index] * voxel_volume),
+            "voxels": int(tumor_voxels[index]),
+            "bbox": [[int(b.start + s.start), int(b.stop + s.start)] for b, s in zip(bbox, box)],
+            "side": _side(_world_x(affine, _offset(centroids[index - 1], box)), midline),
+        })
+    return lesions
+
+
+def _offset(ijk, box: tuple) -> tuple:
+    return tuple(i + s.start for i, s in zip(ijk, box))
+
+
+def _world_x(affine: np.ndarray, ijk) -> float:
+    return float(affine[0, :3] @ np.asarray(ijk, dtype=np.float64) + affine[0, 3])
+
+
+def _side(x: float, midline: float) -> str:
+    # NIfTI 世界坐标为 RAS+，x 增大指向患者右侧
+    return "right" if x > midline else "left"
@@ -0,0 +1,323 @@
+"""
+磁盘容量管理
+
+台账 (storage_entries) 按存储层记录每个文件/目录的大小和最近访问时间，写入结果时登记、删除时注销，
+后台线程定期对照各层预算按 LRU 回收，不需要遍历整个结果目录。
+
+- original: 上传的原始影像，按内容摘要只存一份 (blobs/)，回收时连同各任务目录中的硬链接一起删除
+- segmentation: 分割结果，回收后任务仍保留统计信息并标记为"分割已回收"，查看时只显示原始影像，重新推理可再次生成
+- preview: 预览金字塔，回收后查看时会在后台重新生成
+- scratch: 推理时的 input/ output/ 目录，正常结束时清理，失败或进程中断残留的由后台删除
+
+排队中和处理中的任务永远不会被回收。
+
+复用缓存结果时分割和预览以硬链接共享，同一份数据只在源任务名下计字节数，复用方登记为 0 字节；
+回收源任务时若数据仍被复用方链接，字节数转给复用方，不计为已释放。
+"""
+import shutil
+import threading
+import time
+from datetime import datetime
+from pathlib import Path
+from typing import Dict, Optional, Sequence
+
+from sqlalchemy import delete, func, select, update
+
+from app.core.database import get_sync_session
+from app.models.task import InferenceTask, StorageEntry, TaskStatus
+from app.services.blob_store import BlobStore
+from app.services.metrics import storage_bytes
+
+TIERS = ("original", "segmentation", "preview", "scratch")
+# 有预算的层，按回收代价从低到高排列
+BUDGET_TIERS = ("preview", "segmentation", "original")
+IN_FLIGHT = (TaskStatus.QUEUED, TaskStatus.PROCESSING)
+EVICT_PAGE_SIZE = 100
+SEGMENTATION_EVICTED_MESSAGE = "分割结果已按存储预算回收，重新推理可再次生成"
+
+
+def path_size(path: Path) -> int:
+    """文件大小，目录则累加其中的文件 (只遍历该目录)"""
+    path = Path(path)
+    if path.is_file():
+        return path.stat().st_size
+    if path.is_dir():
+        return sum(p.stat().st_size for p in path.rglob("*") if p.is_file())
+    return 0
+
+
+def _inodes(path: Path) -> set:
+    """文件 (或目录内各文件) 的 (设备, inode)，用来判断两个路径是否共享数据"""
+    path = Path(path)
+    files = [path] if path.is_file() else [p for p in path.rglob("*") if p.is_file()] if path.is_dir() else []
+    inodes = set()
+    for file in files:
+        stat = file.stat()
+        inodes.add((stat.st_dev, stat.st_ino))
+    return inodes
+
+
+def _remove(path: Path):
+    path = Path(path)
+    if path.is_dir() and not path.is_symlink():
+        shutil.rmtree(path, ignore_errors=True)
+    else:
+        path.unlink(missing_ok=True)
+
+
+class StorageManager:
+    """磁盘占用台账 + 后台按预算回收"""
+
+    def __init__(self, settings):
+        self.settings = settings
+        self._touched: Dict[str, set] = {tier: set() for tier in TIERS}
+        self._lock = threading.Lock()
+        self._stop = threading.Event()
+        self._thread: Optional[threading.Thread] = None
+
+    def budget(self, tier: str) -> int:
+        return int(getattr(self.settings, f"storage_budget_{tier}", 0) or 0)
+
+    # ---- 台账 ----
+
+    def register(self, tier: str, path: Path, task_id: Optional[str] = None, size: Optional[int] = None):
+        """登记 (或刷新) 一个文件/目录，同一路径只有一条记录"""
+        path = Path(path)
+        size = path_size(path) if size is None else size
+        now = datetime.utcnow()
+        with get_sync_session() as session:
+            entry = session.scalar(select(StorageEntry).where(StorageEntry.path == str(path)))
+            if entry is None:
+                session.add(StorageEntry(tier=tier, path=str(path), task_id=task_id, size_bytes=size,
+                                         created_at=now, last_access_at=now))
+            else:
+                entry.size_bytes = size
+                entry.last_access_at = now
+
+    def forget(self, task_ids: Sequence[str], tiers: Sequence[str] = TIERS, session=None):
+        """注销任务名下的记录 (可在调用方的会话中执行)"""
+        if not task_ids:
+            return
+        stmt = delete(StorageEntry).where(StorageEntry.task_id.in_(list(task_ids)), StorageEntry.tier.in_(tiers))
+        if session is not None:
+            session.execute(stmt)
+            return
+        with get_sync_session() as own_session:
+            own_session.execute(stmt)
+
+    def touch(self, task_id: str, tier: str):
+        """记录一次访问，只写内存，由后台线程批量落库"""
+        with self._lock:
+            self._touched[tier].add(task_id)
+
+    def flush_touches(self):
+        with self._lock:
+            touched, self._touched = self._touched, {tier: set() for tier in TIERS}
+        now = datetime.utcnow()
+        with get_sync_session() as session:
+            for tier, task_ids in touched.items():
+                if not task_ids:
+                    continue
+                condition = StorageEntry.task_id.in_(task_ids)
+                if tier == "original":
+                    # 按摘要共享的原始文件没有 task_id，按 blob 路径更新
+                    digests = session.scalars(
+                        select(InferenceTask.input_digest)
+                        .where(InferenceTask.id.in_(task_ids), InferenceTask.input_digest.isnot(None))
+                    ).all()
+                    condition = condition | StorageEntry.path.in_([str(self._blob_path(d)) for d in digests])
+                session.execute(
+                    update(StorageEntry).where(StorageEntry.tier == tier, condition).values(last_access_at=now)
+                )
+
+    def usage(self) -> Dict[str, int]:
+        """各层已登记的字节数"""
+        with get_sync_session() as session:
+            rows = session.execute(
+                select(StorageEntry.tier, func.coalesce(func.sum(StorageEntry.size_bytes), 0))
+                .group_by(StorageEntry.tier)
+            ).all()
+        usage = {tier: 0 for tier in TIERS}
+        usage.update({tier: int(total) for tier, total in rows})
+        return usage
+
+    def backfill(self) -> int:
+        """台账为空时 (升级前的旧数据) 按任务记录登记一次，只 stat 已知路径"""
+        with get_sync_session() as session:
+            if session.scalar(select(func.count(StorageEntry.id))):
+                return 0
+            tasks = session.execute(
+                select(InferenceTask.id, InferenceTask.original_path, InferenceTask.input_digest,
+                       InferenceTask.segmentation_path, InferenceTask.generation)
+            ).all()
+        registered = 0
+        seen_blobs = set()
+        for task_id, original_path, digest, segmentation_path, generation in tasks:
+            candidates = []
+            if digest:
+                if digest not in seen_blobs:
+                    seen_blobs.add(digest)
+                    candidates.append(("original", self._blob_path(digest), None))
+            elif original_path:
+                candidates.append(("original", Path(original_path), task_id))
+            if segmentation_path:
+                candidates.append(("segmentation", Path(segmentation_path), task_id))
+            candidates.append(("preview", self.settings.result_dir / task_id / "preview", task_id))
+            for tier, path, owner in candidates:
+                if path.exists():
+                    self.register(tier, path, owner)
+                    registered += 1
+        if registered:
+            print(f"Storage ledger backfilled with {registered} entries")
+        return registered
+
+    # ---- 回收 ----
+
+    def reclaim_scratch(self) -> int:
+        """删除不在处理中的任务残留的 input/ output/ 目录，以及 temp 下过期的批量推理目录"""
+        removed = 0
+        with get_sync_session() as session:
+            entries = session.execute(
+                select(StorageEntry.id, StorageEntry.path)
+                .where(StorageEntry.tier == "scratch", StorageEntry.task_id.notin_(self._in_flight_ids()))
+            ).all()
+            for entry_id, path in entries:
+                _remove(Path(path))
+                removed += 1
+            if entries:
+                session.execute(delete(StorageEntry).where(StorageEntry.id.in_([e[0] for e in entries])))
+
+        deadline = time.time() - self.settings.storage_scratch_max_age
+        temp_dir = Path(self.settings.temp_dir)
+        if temp_dir.exists():
+            for batch_dir in temp_dir.glob("batch_*"):
+                if batch_dir.is_dir() and batch_dir.stat().st_mtime < deadline:
+                    shutil.rmtree(batch_dir, ignore_errors=True)
+                    removed += 1
+        return removed
+
+    def enforce_budgets(self) -> Dict[str, int]:
+        """各层超出预算时按最近访问时间从旧到新回收，返回各层回收的字节数"""
+        usage = self.usage()
+        freed = {}
+        for tier in BUDGET_TIERS:
+            budget = self.budget(tier)
+            if budget <= 0 or usage[tier] <= budget:
+                continue
+            freed[tier] = self._evict(tier, usage[tier] - budget)
+            print(f"Storage tier {tier} over budget, freed {freed[tier]} bytes")
+        return freed
+
+    def _evict(self, tier: str, target: int) -> int:
+        freed = 0
+        skipped = set()
+        while freed < target:
+            with get_sync_session() as session:
+                in_flight = set(session.scalars(self._in_flight_ids()))
+                # 0 字节的记录 (共享数据的复用方) 回收不释放空间
+                stmt = (
+                    select(StorageEntry)
+                    .where(StorageEntry.tier == tier, StorageEntry.id.notin_(skipped), StorageEntry.size_bytes > 0)
+                    .order_by(StorageEntry.last_access_at, StorageEntry.id)
+                    .limit(EVICT_PAGE_SIZE)
+                )
+                if tier != "original":
+                    stmt = stmt.where(StorageEntry.task_id.notin_(self._in_flight_ids()))
+                entries = session.scalars(stmt).all()
+                if not entries:
+                    break
+                for entry in entries:
+                    released = self._evict_entry(session, entry, in_flight)
+                    if released is None:
+                        skipped.add(entry.id)
+                        continue
+                    freed += released
+                    session.delete(entry)
+                    if freed >= target:
+                        break
+        return freed
+
+    def _evict_entry(self, session, entry: StorageEntry, in_flight) -> Optional[int]:
+        """删除一条记录对应的文件，返回实际释放的字节数；任务仍需要该文件时返回 None"""
+        path = Path(entry.path)
+        if entry.tier == "original":
+            if entry.task_id is None:
+                # 共享的原始文件: 引用它的任务都不在处理中才能删除
+                digest = path.name[:-len(".nii.gz")]
+                owners = session.execute(
+                    select(InferenceTask.id, InferenceTask.status).where(InferenceTask.input_digest == digest)
+                ).all()
+                if any(status in IN_FLIGHT for _, status in owners):
+                    return None
+                for task_id, _ in owners:
+                    _remove(self.settings.result_dir / task_id / "original.nii.gz")
+            elif entry.task_id in in_flight:
+                return None
+        released = 0 if self._hand_over(session, entry) else entry.size_bytes or 0
+        _remove(path)
+        if entry.tier == "segmentation" and entry.task_id:
+            session.execute(
+                update(InferenceTask)
+                .where(InferenceTask.id == entry.task_id, InferenceTask.segmentation_path == entry.path)
+                .values(segmentation_path=None, message=SEGMENTATION_EVICTED_MESSAGE)
+            )
+        return released
+
+    def _hand_over(self, session, entry: StorageEntry) -> bool:
+        """数据仍被复用同一结果的任务以硬链接共享时，把字节数转给它的记录，返回 True (删除不释放空间)"""
+        if entry.tier not in ("segmentation", "preview") or not entry.task_id or not entry.size_bytes:
+            return False
+        cache_key = session.scalar(select(InferenceTask.cache_key).where(InferenceTask.id == entry.task_id))
+        if not cache_key:
+            return False
+        heirs = session.scalars(
+            select(StorageEntry)
+            .join(InferenceTask, InferenceTask.id == StorageEntry.task_id)
+            .where(StorageEntry.tier == entry.tier, StorageEntry.id != entry.id, StorageEntry.size_bytes == 0,
+                   InferenceTask.cache_key == cache_key)
+            .order_by(StorageEntry.id)
+        ).all()
+        inodes = _inodes(Path(entry.path))
+        for heir in heirs:
+            if inodes & _inodes(Path(heir.path)):
+                heir.size_bytes = entry.size_bytes
+                return True
+        return False
+
+    def _in_flight_ids(self):
+        return select(InferenceTask.id).where(InferenceTask.status.in_(IN_FLIGHT))
+
+    def _blob_path(self, digest: str) -> Path:
+        return BlobStore(Path(self.settings.upload_dir) / "blobs").path_for(digest)
+
+    # ---- 后台线程 ----
+
+    def run_once(self):
+        self.flush_touches()
+        self.backfill()
+        self.reclaim_scratch()
+        self.enforce_budgets()
+        for tier, total in self.usage().items():
+            storage_bytes.set(total, tier=tier)
+
+    def start(self):
+        if self._thread is not None:
+            return
+        self._stop.clear()
+        self._thread = threading.Thread(target=self._loop, name="storage-manager", daemon=True)
+        self._thread.start()
+
+    def stop(self):
+        self._stop.set()
+        if self._thread is not None:
+            self._thread.join(timeout=5)
+            self._thread = None
+
+    def _loop(self):
+        while True:
+            try:
+                self.run_once()
+            except Exception as e:
+                print(f"Storage manager error: {e}")
+            if self._stop.wait(self.settings.storage_check_interval):
+                return
@@ -0,0 +1,224 @@
+"""
+基于 inference_tasks 表的持久化任务队列
+
+任务入队时写入 queued_at，工作线程用条件 UPDATE 领取 (租约)，处理期间定期写心跳。
+进程重启后，心跳超时的 PROCESSING 任务会被重新入队，不会丢失。
+工作线程一次最多领取 inference_batch_size 个任务，交给 handler 在同一次预测中完成。
+"""
+import os
+import socket
+import threading
+import time
+import uuid
+from datetime import datetime, timedelta
+from typing import Callable, List, Optional
+
+from sqlalchemy import func, update
+
+from app.core.database import get_sync_session
+from app.models.task import InferenceTask, TaskStatus
+from app.services.metrics import worker_busy_seconds
+
+
+class TaskQueue:
+    """持久化任务队列 + 工作线程池"""
+
+    def __init__(self, handler: Callable[[List[str]], None], settings):
+        self.handler = handler
+        self.settings = settings
+        self.worker_id = f"{socket.gethostname()}-{os.getpid()}-{uuid.uuid4().hex[:8]}"
+        self._wakeup = threading.Event()
+        self._stop = threading.Event()
+        self._threads: list = []
+        self._last_reap = datetime.min
+        # 监控: 正在处理的任务数 / 忙碌的工作线程数
+        self._state_lock = threading.Lock()
+        self.in_flight = 0
+        self.busy_workers = 0
+
+    def start(self):
+        """恢复孤儿任务并启动工作线程"""
+        self.recover_orphans()
+        self._stop.clear()
+        for i in range(max(1, self.settings.inference_workers)):
+            thread = threading.Thread(target=self._worker_loop, name=f"inference-worker-{i}", daemon=True)
+            thread.start()
+            self._threads.append(thread)
+        print(f"Task queue started: {len(self._threads)} workers ({self.worker_id})")
+
+    def stop(self, timeout: float = 5):
+        self._stop.set()
+        self._wakeup.set()
+        for thread in self._threads:
+            thread.join(timeout=timeout)
+        self._threads = []
+
+    def notify(self):
+        """有新任务入队时唤醒空闲的工作线程"""
+        self._wakeup.set()
+
+    def enqueue(self, task_id: str) -> bool:
+        """把任务放入队列，任务不存在或正在处理时返回 False"""
+        return not self.enqueue_many([task_id])
+
+    def enqueue_many(self, task_ids: List[str]) -> List[str]:
+        """
+        一次性把多个任务放入队列，只唤醒一次，便于工作线程整批领取
+
+        正在处理的任务 (已被工作线程领取) 不会被重新入队，否则会被第二个工作线程再次领取。
+        Returns:
+            未入队的任务 ID (不存在或正在处理)
+        """
+        if not task_ids:
+            return []
+        now = datetime.utcnow()
+        skipped = []
+        with get_sync_session() as session:
+            # 逐个条件更新: 与 claim 的条件 UPDATE 互斥，并能准确报告哪些任务没有入队
+            for task_id in task_ids:
+                result = session.execute(
+                    update(InferenceTask)
+                    .where(InferenceTask.id == task_id, InferenceTask.status != TaskStatus.PROCESSING)
+                    .values(
+                        status=TaskStatus.QUEUED,
+                        queued_at=now,
+                        worker_id=None,
+                        heartbeat_at=None,
+                    )
+                )
+                if result.rowcount != 1:
+                    skipped.append(task_id)
+        if len(skipped) < len(task_ids):
+            self.notify()
+        return skipped
+
+    def claim(self) -> Optional[str]:
+        """领取最早入队的任务，返回任务 ID；队列为空时返回 None"""
+        while True:
+            with get_sync_session() as session:
+                task_id = (
+                    session.query(InferenceTask.id)
+                    .filter(InferenceTask.status == TaskStatus.QUEUED, InferenceTask.queued_at.isnot(None))
+                    .order_by(InferenceTask.queued_at)
+                    .limit(1)
+                    .scalar()
+                )
+                if task_id is None:
+                    return None
+
+                now = datetime.utcnow()
+                # 条件更新保证同一任务只被一个工作线程/进程领取
+                result = session.execute(
+                    update(InferenceTask)
+                    .where(InferenceTask.id == task_id, InferenceTask.status == TaskStatus.QUEUED)
+                    .values(
+                        status=TaskStatus.PROCESSING,
+                        worker_id=self.worker_id,
+                        heartbeat_at=now,
+                        attempts=func.coalesce(InferenceTask.attempts, 0) + 1,
+                    )
+                )
+                if result.rowcount == 1:
+                    return task_id
+            # 被其它工作线程抢先，继续尝试下一个
+
+    def claim_batch(self, limit: int) -> List[str]:
+        """按入队顺序领取最多 limit 个任务"""
+        task_ids = []
+        while len(task_ids) < max(1, limit):
+            task_id = self.claim()
+            if task_id is None:
+                break
+            task_ids.append(task_id)
+        return task_ids
+
+    def heartbeat(self, task_ids: List[str]):
+        """续租"""
+        with get_sync_session() as session:
+            session.execute(
+                update(InferenceTask)
+                .where(
+                    InferenceTask.id.in_(task_ids),
+                    InferenceTask.worker_id == self.worker_id,
+                    InferenceTask.status == TaskStatus.PROCESSING,
+                )
+                .values(heartbeat_at=datetime.utcnow())
+            )
+
+    def recover_orphans(self) -> int:
+        """心跳超时的 PROCESSING 任务重新入队，超过最大尝试次数的标记失败"""
+        deadline = datetime.utcnow() - timedelta(seconds=self.settings.task_lease_seconds)
+        recovered = 0
+        with get_sync_session() as session:
+            orphans = (
+                session.query(InferenceTask)
+                .filter(
+                    InferenceTask.status == TaskStatus.PROCESSING,
+                    (InferenceTask.heartbeat_at.is_(None)) | (InferenceTask.heartbeat_at < deadline),
+                )
+                .all()
+            )
+            for task in orphans:
+                if (task.attempts or 0) >= self.settings.task_max_attempts:
+                    task.status = TaskStatus.FAILED
+                    task.message = "推理失败: 工作进程多次中断"
+                else:
+                    task.status = TaskStatus.QUEUED
+                    task.progress = 0
+                    task.message = "服务重启，重新排队中..."
+                    task.queued_at = task.queued_at or datetime.utcnow()
+                task.worker_id = None
+                task.heartbeat_at = None
+                recovered += 1
+        if recovered:
+            print(f"Recovered {recovered} orphaned tasks")
+            self.notify()
+        self._last_reap = datetime.utcnow()
+        return recovered
+
+    def _worker_loop(self):
+        while not self._stop.is_set():
+            try:
+                if (datetime.utcnow() - self._last_reap).total_seconds() > self.settings.task_lease_seconds:
+                    self.recover_orphans()
+                task_ids = self.claim_batch(self.settings.inference_batch_size)
+            except Exception as e:
+                print(f"Task queue error: {e}")
+                task_ids = []
+
+            if not task_ids:
+                self._wakeup.wait(self.settings.queue_poll_interval)
+                self._wakeup.clear()
+                continue
+
+            with self._state_lock:
+                self.in_flight += len(task_ids)
+                self.busy_workers += 1
+            start = time.monotonic()
+            try:
+                self._run_with_heartbeat(task_ids)
+            finally:
+                worker_busy_seconds.inc(time.monotonic() - start)
+                with self._state_lock:
+                    self.in_flight -= len(task_ids)
+                    self.busy_workers -= 1
+
+    def _run_with_heartbeat(self, task_ids: List[str]):
+        done = threading.Event()
+
+        def beat():
+            while not done.wait(self.settings.task_heartbeat_interval):
+                try:
+                    self.heartbeat(task_ids)
+                except Exception as e:
+                    print(f"Heartbeat error for {task_ids}: {e}")
+
+        beater = threading.Thread(target=beat, daemon=True)
+        beater.start()
+        try:
+            self.handler(task_ids)
+        except Exception as e:
+            print(f"Tasks {task_ids} handler error: {e}")
+        finally:
+            done.set()
+            beater.join()
@@ -0,0 +1,150 @@
+"""
+处理中任务的运行时状态: 进度缓冲和正在执行的批次
+
+滑窗推理每前进 1% 就会更新一次进度，逐条写库既占用写锁又拖慢推理线程。
+同一状态内的进度/消息变化只写内存并标记为脏，由后台线程按 progress_flush_interval 批量落库；
+状态变化 (排队 -> 处理中 -> 完成/失败) 仍然立即写库。读取任务状态时用内存中的最新进度覆盖数据库中的值。
+"""
+import subprocess
+import threading
+from typing import Dict, List, Optional, Tuple
+
+from sqlalchemy import bindparam, update
+
+from app.core.database import get_sync_session
+from app.models.task import InferenceTask, TaskStatus
+
+# (status, progress, message)
+TaskState = Tuple[TaskStatus, int, Optional[str]]
+
+
+class ProgressBuffer:
+    """处理中任务的最新进度 + 定期批量落库"""
+
+    def __init__(self, flush_interval: float = 1.0):
+        self.flush_interval = flush_interval
+        self._states: Dict[str, TaskState] = {}
+        self._dirty: set = set()
+        self._lock = threading.Lock()
+        self._stop = threading.Event()
+        self._thread: Optional[threading.Thread] = None
+
+    def buffer(self, task_id: str, status: TaskStatus, progress: int, message: Optional[str]) -> bool:
+        """处理中任务的进度更新写入内存并返回 True；状态变化返回 False，由调用方立即写库"""
+        with self._lock:
+            current = self._states.get(task_id)
+            if current is None or status != TaskStatus.PROCESSING or current[0] != TaskStatus.PROCESSING:
+                return False
+            self._states[task_id] = (status, progress, message)
+            self._dirty.add(task_id)
+            return True
+
+    def track(self, task_id: str, status: TaskStatus, progress: int, message: Optional[str]):
+        """记录已写库的状态: 处理中的任务开始缓冲，其它状态不再缓冲"""
+        with self._lock:
+            self._dirty.discard(task_id)
+            if status == TaskStatus.PROCESSING:
+                self._states[task_id] = (status, progress, message)
+            else:
+                self._states.pop(task_id, None)
+
+    def discard(self, task_id: str):
+        with self._lock:
+            self._dirty.discard(task_id)
+            self._states.pop(task_id, None)
+
+    def get(self, task_id: str) -> Optional[TaskState]:
+        with self._lock:
+            return self._states.get(task_id)
+
+    def overlay(self, task: Optional[InferenceTask]) -> Optional[InferenceTask]:
+        """数据库中仍为处理中的任务，用内存中的最新进度覆盖 (task 需已脱离 Session)"""
+        if task is not None and task.status == TaskStatus.PROCESSING:
+            state = self.get(task.id)
+            if state is not None:
+                task.progress, task.message = state[1], state[2]
+        return task
+
+    def flush(self) -> int:
+        """把脏进度一次性写库，只更新仍处于处理中的任务，返回写入条数"""
+        with self._lock:
+            rows = [
+                {"b_id": task_id, "b_progress": self._states[task_id][1], "b_message": self._states[task_id][2]}
+                for task_id in self._dirty
+                if task_id in self._states
+            ]
+            self._dirty.clear()
+        if not rows:
+            return 0
+        table = InferenceTask.__table__
+        with get_sync_session() as session:
+            session.execute(
+                update(table)
+                .where(table.c.id == bindparam("b_id"), table.c.status == TaskStatus.PROCESSING.name)
+                .values(progress=bindparam("b_progress"), message=bindparam("b_message")),
+                rows,
+            )
+        return len(rows)
+
+    def start(self):
+        if self._thread is not None:
+            return
+        self._stop.clear()
+        self._thread = threading.Thread(target=self._flush_loop, name="progress-flusher", daemon=True)
+        self._thread.start()
+
+    def stop(self):
+        self._stop.set()
+        if self._thread is not None:
+            self._thread.join(timeout=5)
+            self._thread = None
+        self.flush()
+
+    def _flush_loop(self):
+        while not self._stop.wait(self.flush_interval):
+            try:
+                self.flush()
+            except Exception as e:
+                print(f"Progress flush error: {e}")
+
+
+class RunningBatch:
+    """工作线程正在执行的一批任务，记录被取消的任务和 eval.py 子进程，供取消时使用"""
+
+    def __init__(self, task_ids: List[str]):
+        self.task_ids = list(task_ids)
+        self.cancelled: set = set()
+        # 运行期间被删除的任务，批次结束后再回收其目录 (由 InferenceService 在 _running_lock 内维护)
+        self.deleted: set = set()
+        self.process: Optional[subprocess.Popen] = None
+        self._lock = threading.Lock()
+
+    def keep(self, task_ids: List[str]):
+        """准备输入后只保留实际参与推理的任务"""
+        with self._lock:
+            self.task_ids = list(task_ids)
+
+    def attach_process(self, process: subprocess.Popen):
+        with self._lock:
+            self.process = process
+            all_cancelled = self._all_cancelled()
+        # 子进程启动前整批已被取消
+        if all_cancelled:
+            process.kill()
+
+    def cancel(self, task_id: str) -> bool:
+        """标记任务已取消，整批都被取消时杀掉子进程；返回是否整批取消"""
+        with self._lock:
+            self.cancelled.add(task_id)
+            all_cancelled = self._all_cancelled()
+            process = self.process
+        if all_cancelled and process is not None and process.poll() is None:
+            process.kill()
+        return all_cancelled
+
+    def is_cancelled(self, task_id: str) -> bool:
+        with self._lock:
+            return task_id in self.cancelled
+
+    def _all_cancelled(self) -> bool:
+        return all(task_id in self.cancelled for task_id in self.task_ids)
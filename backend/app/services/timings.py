@@ -0,0 +1,96 @@
+"""
+任务分阶段耗时
+
+每次推理把各阶段耗时写入 task_stage_timings，/metrics/latency 用 SQL 窗口函数按阶段计算分位数。
+同一批次共享的阶段 (模型加载、等待推理服务、后处理) 按病例数均摊。
+"""
+from datetime import datetime
+from typing import Dict, List, Optional, Sequence
+
+from sqlalchemy import case, func, select
+
+from app.core.database import get_sync_session
+from app.models.task import TaskStageTiming
+from app.services.metrics import inference_stage_duration
+
+# 阶段按流水线顺序排列
+STAGES = (
+    "upload",       # 上传写盘 + 入库
+    "queue_wait",   # 入队到被工作线程领取
+    "model_load",   # 启动 eval.py 到第一条进度事件 / 拉起并连接推理服务到服务受理
+    "lock_wait",    # 推理服务受理后等待其它提交推理完成
+    "preprocess",   # 等待预处理 (裁剪/重采样/归一化) 完成
+    "inference",    # 滑窗推理
+    "export",       # softmax 重采样并导出分割
+    "postprocess",  # 连通域后处理
+    "stats",        # 体积/病灶统计
+    "preview",      # 预览金字塔
+)
+
+PERCENTILES = (50, 95, 99)
+
+
+def record_stage_timings(task_id: str, timings: Dict[str, float]):
+    """写入一个任务的阶段耗时 (秒)"""
+    if not timings:
+        return
+    for stage, duration in timings.items():
+        if duration is not None:
+            inference_stage_duration.observe(duration, stage=stage)
+    now = datetime.utcnow()
+    with get_sync_session() as session:
+        session.add_all([
+            TaskStageTiming(task_id=task_id, stage=stage, duration=float(duration), recorded_at=now)
+            for stage, duration in timings.items()
+            if duration is not None
+        ])
+
+
+def delete_stage_timings(session, task_ids: Sequence[str]):
+    """随任务一起删除耗时记录 (在调用方的会话中执行)"""
+    session.query(TaskStageTiming).filter(TaskStageTiming.task_id.in_(list(task_ids))).delete(
+        synchronize_session=False
+    )
+
+
+def latency_percentiles(since: datetime, until: Optional[datetime] = None,
+                        percentiles: Sequence[int] = PERCENTILES) -> List[dict]:
+    """
+    统计时间窗口内各阶段的样本数、均值、最大值和分位数 (nearest-rank)
+
+    分位数在数据库中计算: 按阶段排序编号，取编号 >= p% * 样本数的最小耗时。
+    """
+    conditions = [TaskStageTiming.recorded_at >= since]
+    if until is not None:
+        conditions.append(TaskStageTiming.recorded_at < until)
+
+    ranked = (
+        select(
+            TaskStageTiming.stage.label("stage"),
+            TaskStageTiming.duration.label("duration"),
+            func.row_number().over(
+                partition_by=TaskStageTiming.stage, order_by=TaskStageTiming.duration
+            ).label("rn"),
+            func.count().over(partition_by=TaskStageTiming.stage).label("n"),
+        )
+        .where(*conditions)
+        .subquery()
+    )
+    query = select(
+        ranked.c.stage,
+        func.count().label("count"),
+        func.avg(ranked.c.duration).label("mean"),
+        func.max(ranked.c.duration).label("max"),
+        *[
+            func.min(case((ranked.c.rn >= ranked.c.n * (p / 100.0), ranked.c.duration))).label(f"p{p}")
+            for p in percentiles
+        ],
+    ).group_by(ranked.c.stage)
+
+    with get_sync_session() as session:
+        rows = session.execute(query).mappings().all()
+
+    order = {stage: i for i, stage in enumerate(STAGES)}
+    results = [dict(row) for row in rows]
+    results.sort(key=lambda r: (order.get(r["stage"], len(order)), r["stage"]))
+    return results
@@ -0,0 +1,37 @@
+import sys
+from pathlib import Path
+
+# 确保后端根目录在 sys.path（放在依赖导入前）
+ROOT_DIR = Path(__file__).resolve().parents[1]
+if str(ROOT_DIR) not in sys.path:
+    sys.path.insert(0, str(ROOT_DIR))
+
+import pytest
+from sqlalchemy import create_engine
+from sqlalchemy.ext.asyncio import AsyncSession, create_async_engine
+from sqlalchemy.orm import sessionmaker
+from sqlalchemy.pool import NullPool
+
+from app.core import database
+from app.models.task import Base
+
+
+@pytest.fixture
+def sync_db(tmp_path, monkeypatch):
+    """隔离的 SQLite 数据库，替换同步/异步 Session 工厂 (两者指向同一个文件)"""
+    db_path = (tmp_path / 'test.db').as_posix()
+    engine = create_engine(f"sqlite:///{db_path}")
+    # 每个 TestClient 有自己的事件循环，异步连接不跨循环复用
+    async_engine = create_async_engine(f"sqlite+aiosqlite:///{db_path}", poolclass=NullPool)
+    database.configure_sqlite(engine)
+    database.configure_sqlite(async_engine.sync_engine)
+    Base.metadata.create_all(bind=engine)
+    monkeypatch.setattr(database, "sync_engine", engine)
+    monkeypatch.setattr(database, "SyncSessionLocal", sessionmaker(bind=engine))
+    monkeypatch.setattr(database, "async_engine", async_engine)
+    monkeypatch.setattr(
+        database, "AsyncSessionLocal",
+        sessionmaker(bind=async_engine, class_=AsyncSession, expire_on_commit=False),
+    )
+    yield engine
+    engine.dispose()
@@ -0,0 +1,119 @@
+import sys
+import threading
+import time
+from pathlib import Path
+
+ROOT_DIR = Path(__file__).resolve().parents[1]
+if str(ROOT_DIR) not in sys.path:
+    sys.path.insert(0, str(ROOT_DIR))
+
+from fastapi import FastAPI
+from fastapi.testclient import TestClient
+
+from app.api import inference as inference_api
+from app.core.config import Settings
+from app.core.database import get_sync_session
+from app.models.task import InferenceTask, TaskStatus
+from app.services.inference import InferenceService
+from app.services.task_state import RunningBatch
+
+# 替代 eval.py: 输出一条进度后长时间不结束，模拟正在占用 GPU 的推理
+SLOW_EVAL = """
+import json, time
+print(json.dumps({"event": "progress", "stage": "predict", "tile": 1, "num_tiles": 100}), flush=True)
+time.sleep(60)
+"""
+
+
+def add_task(task_id, status):
+    with get_sync_session() as session:
+        session.add(InferenceTask(id=task_id, filename=f"{task_id}.nii.gz", original_path="x", status=status))
+
+
+def get_status(task_id):
+    with get_sync_session() as session:
+        return session.query(InferenceTask).filter_by(id=task_id).first().status
+
+
+def test_cancel_queued_task_is_never_claimed(sync_db):
+    service = InferenceService()
+    add_task("queued", TaskStatus.QUEUED)
+    add_task("done", TaskStatus.COMPLETED)
+    service.queue.enqueue("queued")
+
+    assert service.cancel_task("queued") == TaskStatus.CANCELLED
+    assert service.queue.claim() is None
+    assert get_status("queued") == TaskStatus.CANCELLED
+
+    # 已结束的任务保持原状态
+    assert service.cancel_task("done") == TaskStatus.COMPLETED
+    assert service.cancel_task("missing") is None
+
+
+def test_cancel_kills_running_eval_script_and_frees_worker(sync_db, tmp_path, monkeypatch):
+    nnunet_root = tmp_path / "nnUNet-msgpu1.10"
+    nnunet_root.mkdir()
+    (nnunet_root / "eval.py").write_text(SLOW_EVAL)
+    settings = Settings(
+        base_dir=tmp_path,
+        nnunet_root=nnunet_root,
+        model_path=tmp_path / "models",
+        upload_dir=tmp_path / "uploads",
+        result_dir=tmp_path / "results",
+        temp_dir=tmp_path / "temp",
+        model_server_enabled=False,
+    )
+    settings.ensure_dirs()
+    service = InferenceService()
+    monkeypatch.setattr(service, "settings", settings)
+
+    upload = tmp_path / "case.nii.gz"
+    upload.write_bytes(b"ct")
+    task_id = service.create_task("case.nii.gz", upload)
+    service.queue.enqueue(task_id)
+    assert service.queue.claim() == task_id
+
+    worker = threading.Thread(target=service._run_inference_batch, args=([task_id],))
+    worker.start()
+    deadline = time.time() + 10
+    while time.time() < deadline:
+        batch = service._running.get(task_id)
+        if batch is not None and batch.process is not None:
+            break
+        time.sleep(0.05)
+
+    start = time.time()
+    assert service.cancel_task(task_id) == TaskStatus.CANCELLED
+    worker.join(10)
+    assert not worker.is_alive()
+    assert time.time() - start < 10
+
+    assert get_status(task_id) == TaskStatus.CANCELLED
+    task_dir = settings.result_dir / task_id
+    assert not (task_dir / "segmentation.nii.gz").exists()
+    assert not (task_dir / "input").exists()
+    assert (task_dir / "original.nii.gz").exists()
+    assert task_id not in service._running
+
+
+
+def test_restart_rejected_until_old_batch_finishes(sync_db, monkeypatch):
+    service = InferenceService()
+    add_task("old", TaskStatus.CANCELLED)
+    monkeypatch.setattr(service.settings, "result_cache_enabled", False)
+    monkeypatch.setattr(service.queue, "enqueue_many", lambda task_ids: [])
+    monkeypatch.setattr(inference_api, "inference_service", service)
+    app = FastAPI()
+    app.include_router(inference_api.router, prefix="/api/v1")
+    client = TestClient(app)
+
+    # 已取消但旧批次仍在运行: 旧批次结束时会清理任务目录，不能重新启动
+    service._running["old"] = RunningBatch(["old"])
+    assert client.post("/api/v1/inference/old/retry").status_code == 409
+    assert client.post("/api/v1/inference/old/start").status_code == 409
+    assert client.post("/api/v1/inference/batch", json={"taskIds": ["old"]}).status_code == 409
+    assert get_status("old") == TaskStatus.CANCELLED
+
+    del service._running["old"]
+    assert client.post("/api/v1/inference/old/retry").status_code == 200
+    assert get_status("old") == TaskStatus.QUEUED
@@ -0,0 +1,113 @@
+from datetime import datetime, timedelta
+from types import SimpleNamespace
+
+import nibabel as nib
+import numpy as np
+from fastapi import FastAPI
+from fastapi.testclient import TestClient
+
+from app.api import inference as inference_api
+from app.core.database import get_sync_session
+from app.models.task import InferenceTask, TaskStageTiming, TaskStatus
+from app.services.eta import ModelPlan, RuntimeEstimator, sliding_window_tiles
+from app.services.inference import InferenceService
+
+
+def eta_settings(**overrides):
+    values = dict(
+        model_path="missing",
+        step_size=0.5,
+        inference_workers=2,
+        eta_default_tile_seconds=1.0,
+        eta_default_overhead=30.0,
+        eta_smoothing=0.5,
+        eta_history_size=50,
+        admission_max_wait=0.0,
+    )
+    values.update(overrides)
+    return SimpleNamespace(**values)
+
+
+def add_task(task_id, status, num_tiles=None, progress=0, queued=True):
+    with get_sync_session() as session:
+        session.add(InferenceTask(
+            id=task_id, filename=f"{task_id}.nii.gz", original_path="x", status=status, progress=progress,
+            num_tiles=num_tiles, queued_at=datetime.utcnow() if queued else None,
+        ))
+
+
+def test_tiles_follow_resampled_shape(tmp_path):
+    plan = ModelPlan(patch_size=(64, 128, 128), target_spacing=(2.0, 1.0, 1.0))
+    # 轴顺序 (z, y, x): z 重采样到 100 -> 3 步，y/x 重采样到 256 -> 3 步
+    assert sliding_window_tiles((200, 512, 512), (1.0, 0.5, 0.5), plan, 0.5) == 27
+    # 小于 patch 的轴补齐后只有 1 步
+    assert sliding_window_tiles((20, 100, 100), (1.0, 1.0, 1.0), plan, 0.5) == 1
+
+    # 从 NIfTI 头读取形状和间距 (x, y, z) -> (z, y, x)
+    image = tmp_path / "case.nii.gz"
+    nii = nib.Nifti1Image(np.zeros((256, 256, 100), dtype=np.int16), np.diag([1.0, 1.0, 2.0, 1.0]))
+    nib.save(nii, image)
+    estimator = RuntimeEstimator(eta_settings())
+    estimator._plan = plan
+    assert estimator.count_tiles(image) == 3 * 3 * 3
+    assert estimator.count_tiles(tmp_path / "missing.nii.gz") is None
+
+
+def test_throughput_from_history_and_new_samples(sync_db):
+    add_task("a", TaskStatus.COMPLETED, num_tiles=100, queued=False)
+    add_task("b", TaskStatus.COMPLETED, num_tiles=300, queued=False)
+    now = datetime.utcnow()
+    with get_sync_session() as session:
+        for task_id, stage, duration in [("a", "inference", 50.0), ("b", "inference", 150.0),
+                                         ("a", "preprocess", 8.0), ("b", "preprocess", 12.0),
+                                         ("a", "stats", 2.0), ("b", "stats", 4.0), ("a", "upload", 99.0)]:
+            session.add(TaskStageTiming(task_id=task_id, stage=stage, duration=duration,
+                                        recorded_at=now - timedelta(minutes=1)))
+
+    estimator = RuntimeEstimator(eta_settings())
+    estimator.load_history()
+    assert estimator.tile_seconds == 0.5
+    assert estimator.overhead == 10.0 + 3.0
+    assert estimator.estimate(200) == 13.0 + 100.0
+    # 区块数未知时按历史平均区块数
+    assert estimator.estimate(None) == 13.0 + 200 * 0.5
+
+    estimator.observe(100, {"inference": 150.0, "preprocess": 13.0, "queue_wait": 500.0})
+    assert estimator.tile_seconds == 1.0
+    assert estimator.overhead == 13.0
+
+
+def test_admission_rejects_with_retry_after(sync_db, tmp_path, monkeypatch):
+    service = InferenceService()
+    service.estimator = RuntimeEstimator(eta_settings(admission_max_wait=100.0))
+    monkeypatch.setattr(service.settings, "result_cache_enabled", False)
+    monkeypatch.setattr(service.settings, "inference_workers", 2)
+    # 积压: 处理到一半的 100 区块任务 (剩余 65 秒) + 排队中的 60 区块任务 (90 秒)，两个工作线程
+    add_task("running", TaskStatus.PROCESSING, num_tiles=100, progress=50)
+    add_task("queued", TaskStatus.QUEUED, num_tiles=60)
+    add_task("uploaded", TaskStatus.QUEUED, num_tiles=20, queued=False)
+    add_task("big", TaskStatus.QUEUED, num_tiles=200, queued=False)
+
+    # 仅上传未入队的任务不计入积压
+    assert service.estimator.backlog() == (65.0 + 90.0) / 2
+    assert service.admit(["uploaded"]) == {"uploaded": round(77.5 + 50.0)}
+
+    monkeypatch.setattr(inference_api, "inference_service", service)
+    app = FastAPI()
+    app.include_router(inference_api.router, prefix="/api/v1")
+    client = TestClient(app)
+
+    # 批量提交: 第二个任务要等到 77.5 + 115 秒，超出上限 -> 429
+    response = client.post("/api/v1/inference/batch", json={"taskIds": ["big", "uploaded"]})
+    assert response.status_code == 429
+    assert response.headers["Retry-After"] == "93"
+    with get_sync_session() as session:
+        assert session.query(InferenceTask).filter_by(id="big").one().queued_at is None
+
+    # 积压本身超限 -> 503，上传并启动的请求在接收文件前即被拒绝
+    add_task("more", TaskStatus.QUEUED, num_tiles=40)  # 积压 77.5 + 35 秒
+    response = client.post("/api/v1/inference/uploaded/start")
+    assert response.status_code == 503
+    assert response.headers["Retry-After"] == "13"
+    response = client.post("/api/v1/inference/start", files={"file": ("case.nii.gz", b"x")})
+    assert response.status_code == 503
@@ -0,0 +1,76 @@
+import json
+import threading
+
+from fastapi import FastAPI
+from fastapi.testclient import TestClient
+
+from app.api import inference as inference_api
+from app.core.database import get_sync_session
+from app.models.task import InferenceTask, TaskStatus
+from app.services.events import task_events
+from app.services.inference import inference_service
+
+
+def build_client():
+    app = FastAPI()
+    app.include_router(inference_api.router, prefix="/api/v1")
+    return TestClient(app)
+
+
+def add_task(task_id, status):
+    with get_sync_session() as session:
+        session.add(InferenceTask(id=task_id, filename="case.nii.gz", original_path="x", status=status))
+
+
+def read_events(response):
+    events = []
+    for line in response.iter_lines():
+        if line.startswith("data: "):
+            events.append(json.loads(line[len("data: "):]))
+    return events
+
+
+def test_events_stream_pushes_updates_until_terminal(sync_db, monkeypatch):
+    add_task("t1", TaskStatus.QUEUED)
+
+    # 快照读取之后再推送，否则状态变化可能先于快照
+    snapshot_read = threading.Event()
+    get_task_async = inference_service.get_task_async
+
+    async def get_task_and_signal(task_id):
+        task = await get_task_async(task_id)
+        snapshot_read.set()
+        return task
+
+    monkeypatch.setattr(inference_service, "get_task_async", get_task_and_signal)
+
+    def publisher():
+        snapshot_read.wait(5)
+        inference_service._update_task_status("t1", TaskStatus.PROCESSING, progress=20, message="正在执行分割推理...")
+        inference_service._update_task_status("t1", TaskStatus.FAILED, progress=0, message="推理失败: boom")
+
+    thread = threading.Thread(target=publisher)
+    thread.start()
+    with build_client().stream("GET", "/api/v1/inference/t1/events") as response:
+        assert response.headers["content-type"].startswith("text/event-stream")
+        events = read_events(response)
+    thread.join()
+
+    assert [e["status"] for e in events] == ["queued", "processing", "failed"]
+    assert events[1]["progress"] == 20
+    assert task_events.subscriber_count("t1") == 0
+
+
+def test_events_stream_closes_for_finished_task(sync_db):
+    add_task("done", TaskStatus.COMPLETED)
+
+    with build_client().stream("GET", "/api/v1/inference/done/events") as response:
+        events = read_events(response)
+
+    assert [e["status"] for e in events] == ["completed"]
+
+
+def test_events_stream_unknown_task(sync_db):
+    response = build_client().get("/api/v1/inference/missing/events")
+    assert response.status_code == 404
+    assert task_events.subscriber_count() == 0
@@ -0,0 +1,249 @@
+import threading
+import time
+from datetime import datetime, timedelta
+
+from fastapi import FastAPI
+from fastapi.testclient import TestClient
+
+from app.api import history as history_api
+from app.core.database import get_sync_session
+from app.models.task import InferenceTask, TaskStageTiming, TaskStatus
+from app.services.history_query import CountCache, TaskFilters
+from app.services.inference import InferenceService
+from app.services.reclaimer import FileReclaimer
+from app.services.timings import record_stage_timings
+
+BASE_TIME = datetime(2026, 1, 1)
+
+
+def add_tasks(specs):
+    with get_sync_session() as session:
+        for task_id, minutes, status, filename, tumor_volume in specs:
+            session.add(InferenceTask(
+                id=task_id,
+                filename=filename,
+                original_path="x",
+                status=status,
+                tumor_volume=tumor_volume,
+                created_at=BASE_TIME + timedelta(minutes=minutes),
+            ))
+
+
+def build_client(service, monkeypatch):
+    monkeypatch.setattr(history_api, "inference_service", service)
+    app = FastAPI()
+    app.include_router(history_api.router, prefix="/api/v1")
+    return TestClient(app)
+
+
+def test_cursor_pagination_walks_all_records_in_order(sync_db, monkeypatch):
+    # t2/t3 创建时间相同，靠 id 保证顺序稳定
+    add_tasks([
+        ("t1", 1, TaskStatus.COMPLETED, "case_a.nii.gz", 10.0),
+        ("t2", 2, TaskStatus.COMPLETED, "case_b.nii.gz", 20.0),
+        ("t3", 2, TaskStatus.FAILED, "scan_c.nii.gz", None),
+        ("t4", 3, TaskStatus.COMPLETED, "case_d.nii.gz", 40.0),
+        ("t5", 4, TaskStatus.QUEUED, "case_e.nii.gz", None),
+    ])
+    client = build_client(InferenceService(), monkeypatch)
+
+    seen, cursor = [], None
+    while True:
+        params = {"pageSize": 2}
+        if cursor:
+            params["cursor"] = cursor
+        body = client.get("/api/v1/history", params=params).json()
+        assert body["total"] == 5
+        seen.extend(r["id"] for r in body["records"])
+        cursor = body["nextCursor"]
+        if cursor is None:
+            break
+    assert seen == ["t5", "t4", "t3", "t2", "t1"]
+
+    # 页码分页仍然可用
+    body = client.get("/api/v1/history", params={"page": 2, "pageSize": 2}).json()
+    assert [r["id"] for r in body["records"]] == ["t3", "t2"]
+
+    assert client.get("/api/v1/history", params={"cursor": "not-a-cursor"}).status_code == 400
+
+
+def test_deep_offset_pages_require_a_cursor(sync_db, monkeypatch):
+    add_tasks([(f"t{i}", i, TaskStatus.COMPLETED, f"case_{i}.nii.gz", None) for i in range(6)])
+    client = build_client(InferenceService(), monkeypatch)
+    monkeypatch.setattr(history_api.settings, "history_max_offset", 4)
+
+    assert client.get("/api/v1/history", params={"page": 3, "pageSize": 2}).status_code == 200
+    assert client.get("/api/v1/history", params={"page": 4, "pageSize": 2}).status_code == 400
+    # 游标翻页不受限制
+    cursor = client.get("/api/v1/history", params={"page": 2, "pageSize": 2}).json()["nextCursor"]
+    body = client.get("/api/v1/history", params={"page": 4, "pageSize": 2, "cursor": cursor}).json()
+    assert [r["id"] for r in body["records"]] == ["t1", "t0"]
+
+
+def test_history_filters(sync_db, monkeypatch):
+    add_tasks([
+        ("t1", 1, TaskStatus.COMPLETED, "case_a.nii.gz", 10.0),
+        ("t2", 2, TaskStatus.COMPLETED, "case_b.nii.gz", 20.0),
+        ("t3", 3, TaskStatus.FAILED, "scan_c.nii.gz", None),
+        ("t4", 4, TaskStatus.COMPLETED, "case_d.nii.gz", 40.0),
+    ])
+    client = build_client(InferenceService(), monkeypatch)
+
+    def ids(**params):
+        body = client.get("/api/v1/history", params=params).json()
+        assert body["total"] == len(body["records"])
+        return [r["id"] for r in body["records"]]
+
+    assert ids(status="failed") == ["t3"]
+    assert ids(filename="case_") == ["t4", "t2", "t1"]
+    assert ids(minTumorVolume=15, maxTumorVolume=40) == ["t4", "t2"]
+    assert ids(createdFrom=(BASE_TIME + timedelta(minutes=2)).isoformat(),
+               createdTo=(BASE_TIME + timedelta(minutes=4)).isoformat()) == ["t3", "t2"]
+    assert ids(createdFrom="2026-01-01T00:03:00+00:00") == ["t4", "t3"]
+
+
+def test_history_marks_evicted_segmentations(sync_db, monkeypatch):
+    add_tasks([
+        ("kept", 1, TaskStatus.COMPLETED, "case_a.nii.gz", 10.0),
+        ("evicted", 2, TaskStatus.COMPLETED, "case_b.nii.gz", 20.0),
+        ("failed", 3, TaskStatus.FAILED, "case_c.nii.gz", None),
+    ])
+    with get_sync_session() as session:
+        session.query(InferenceTask).filter_by(id="kept").one().segmentation_path = "results/kept/segmentation.nii.gz"
+    client = build_client(InferenceService(), monkeypatch)
+
+    records = {r["id"]: r for r in client.get("/api/v1/history").json()["records"]}
+
+    assert records["kept"]["segmentationUrl"] and not records["kept"]["segmentationEvicted"]
+    # 已完成但分割已被回收: 明确标记，前端只显示原始影像并提供重新推理
+    assert records["evicted"]["segmentationUrl"] is None and records["evicted"]["segmentationEvicted"]
+    assert not records["failed"]["segmentationEvicted"]
+    assert client.get("/api/v1/history/evicted").json()["segmentationEvicted"]
+
+
+def test_count_cache_expires_and_invalidates():
+    now = [0.0]
+    cache = CountCache(ttl=10, clock=lambda: now[0])
+    filters = TaskFilters(status=TaskStatus.COMPLETED)
+    cache.set(filters, 3)
+    assert cache.get(filters) == 3
+    assert cache.get(TaskFilters()) is None
+    now[0] = 11
+    assert cache.get(filters) is None
+    cache.set(filters, 4)
+    cache.invalidate()
+    assert cache.get(filters) is None
+
+
+def test_count_cache_is_bounded():
+    now = [0.0]
+    cache = CountCache(ttl=10, max_entries=2, clock=lambda: now[0])
+    cache.set(TaskFilters(filename_prefix="a"), 1)
+    cache.set(TaskFilters(filename_prefix="b"), 2)
+    assert cache.get(TaskFilters(filename_prefix="a")) == 1
+    # 超过上限时淘汰最久未使用的 b
+    cache.set(TaskFilters(filename_prefix="c"), 3)
+    assert cache.get(TaskFilters(filename_prefix="b")) is None
+    assert cache.get(TaskFilters(filename_prefix="a")) == 1
+    assert len(cache._values) == 2
+
+    # 写入时清掉已过期的条目
+    now[0] = 11
+    cache.set(TaskFilters(filename_prefix="d"), 4)
+    assert list(cache._values) == [TaskFilters(filename_prefix="d")]
+
+
+def test_total_is_served_from_cache_until_tasks_change(sync_db, tmp_path):
+    service = InferenceService()
+    service.settings = service.settings.model_copy(update={"result_dir": tmp_path / "results"})
+    add_tasks([("t1", 1, TaskStatus.COMPLETED, "case_a.nii.gz", 10.0)])
+    assert service.get_task_list()[1] == 1
+
+    # 绕过服务直接写库: 缓存的总数不变
+    add_tasks([("t2", 2, TaskStatus.COMPLETED, "case_b.nii.gz", 20.0)])
+    assert service.get_task_list()[1] == 1
+
+    # 通过服务删除任务会使缓存失效
+    service.delete_task("t2")
+    add_tasks([("t3", 3, TaskStatus.COMPLETED, "case_c.nii.gz", 30.0)])
+    assert service.get_task_list()[1] == 2
+
+
+def test_batch_delete_removes_rows_at_once_and_reclaims_dirs(sync_db, monkeypatch, tmp_path):
+    service = InferenceService()
+    service.settings = service.settings.model_copy(update={"result_dir": tmp_path / "results"})
+    service.reclaimer = FileReclaimer(tmp_path / "results" / ".trash")
+    add_tasks([(f"t{i}", i, TaskStatus.COMPLETED, f"case_{i}.nii.gz", 1.0) for i in range(3)])
+    for i in range(3):
+        (tmp_path / "results" / f"t{i}" / "preview" / "g0").mkdir(parents=True)
+        (tmp_path / "results" / f"t{i}" / "segmentation.nii.gz").write_bytes(b"seg")
+    record_stage_timings("t0", {"inference": 1.0})
+    client = build_client(service, monkeypatch)
+
+    body = client.post("/api/v1/history/batch-delete", json={"ids": ["t0", "t1", "missing", "t0"]}).json()
+    assert body["deleted"] == 2
+    # 记录立即删除，目录立即移出结果目录
+    with get_sync_session() as session:
+        assert [t.id for t in session.query(InferenceTask).all()] == ["t2"]
+        assert session.query(TaskStageTiming).count() == 0
+    assert not (tmp_path / "results" / "t0").exists()
+    assert (tmp_path / "results" / "t2").exists()
+
+    service.reclaimer.wait(5)
+    job = client.get(f"/api/v1/history/reclaim-jobs/{body['jobId']}").json()
+    assert job["status"] == "done"
+    assert (job["total"], job["removed"], job["failed"]) == (2, 2, 0)
+    assert list((tmp_path / "results" / ".trash").iterdir()) == []
+    assert client.get("/api/v1/history/reclaim-jobs/unknown").status_code == 404
+    service.reclaimer.stop()
+
+
+def test_delete_running_task_reclaims_dir_after_batch(sync_db, monkeypatch, tmp_path):
+    service = InferenceService()
+    service.settings = service.settings.model_copy(update={"result_dir": tmp_path / "results"})
+    service.reclaimer = FileReclaimer(tmp_path / "results" / ".trash")
+    add_tasks([("running", 1, TaskStatus.PROCESSING, "case.nii.gz", None)])
+    task_dir = tmp_path / "results" / "running"
+    task_dir.mkdir(parents=True)
+    release = threading.Event()
+    batches = []
+
+    def run_batch(batch):
+        batches.append(batch)
+        release.wait(10)
+        # 取消生效前批次仍在写任务目录
+        (task_dir / "output").mkdir()
+
+    monkeypatch.setattr(service, "_run_batch", run_batch)
+    worker = threading.Thread(target=service._run_inference_batch, args=(["running"],))
+    worker.start()
+    deadline = time.time() + 5
+    while not batches and time.time() < deadline:
+        time.sleep(0.01)
+
+    deleted, job = service.delete_tasks(["running"])
+    assert deleted == ["running"] and job.paths == []
+    assert batches[0].is_cancelled("running")
+    # 批次结束前目录留在原处
+    assert task_dir.exists()
+
+    release.set()
+    worker.join(10)
+    service.reclaimer.wait(5)
+    assert not task_dir.exists()
+    assert list((tmp_path / "results" / ".trash").iterdir()) == []
+    service.reclaimer.stop()
+
+
+def test_reclaimer_sweeps_leftover_trash(tmp_path):
+    trash = tmp_path / ".trash"
+    (trash / "t1-deadbeef" / "preview").mkdir(parents=True)
+    (trash / "t2-cafebabe").mkdir()
+    reclaimer = FileReclaimer(trash)
+
+    job = reclaimer.sweep()
+    reclaimer.wait(5)
+    assert job.status == "done" and job.removed == 2
+    assert list(trash.iterdir()) == []
+    assert reclaimer.sweep() is None
+    reclaimer.stop()
@@ -1,3 +1,4 @@
+import json
 import os
 import sys
 from pathlib import Path
@@ -12,6 +13,29 @@ import pytest
 from app.core.config import Settings
 from app.services.inference import InferenceService
 
+# 替代 eval.py: 记录命令行与环境，逐个病例输出进度事件和 Segmentation_{case}.nii.gz
+FAKE_EVAL = """
+import json, os, sys
+from pathlib import Path
+args = sys.argv[1:]
+input_dir = Path(args[args.index("-i") + 1])
+output_dir = Path(args[args.index("-o") + 1])
+inputs = sorted(p.name for p in input_dir.iterdir())
+Path(__file__).with_name("calls.json").write_text(json.dumps({"cmd": sys.argv, "env": dict(os.environ), "inputs": inputs}))
+print("----- Start prediction -----")
+for name in inputs:
+    case = name[: -len("_0000.nii.gz")]
+    for tile in (1, 2):
+        print(json.dumps({"event": "progress", "stage": "predict", "case": case, "tile": tile, "num_tiles": 2}), flush=True)
+    (output_dir / ("Segmentation_" + case + ".nii.gz")).write_bytes(b"seg-" + (input_dir / name).read_bytes())
+"""
+
+
+def write_fake_eval(nnunet_root: Path) -> Path:
+    nnunet_root.mkdir(parents=True, exist_ok=True)
+    (nnunet_root / "eval.py").write_text(FAKE_EVAL)
+    return nnunet_root / "calls.json"
+
 
 def build_settings(tmp_path: Path, model_dir: Path) -> Settings:
     """构造隔离的 Settings，指向临时目录，避免写入真实路径。"""
@@ -28,6 +52,7 @@ def build_settings(tmp_path: Path, model_dir: Path) -> Settings:
         result_dir=tmp_path / "results",
         temp_dir=tmp_path / "temp",
         default_checkpoint="auto",
+        model_server_socket=tmp_path / "model_server.sock",
     )
     settings.resolve_all_paths()
     settings.apply_model_path_overrides()
@@ -62,6 +87,8 @@ def test_call_nnunet_predict_prefers_model_dir_and_checkpoint(tmp_path, monkeypa
     (fold_dir / "model_final_checkpoint.ckpt").touch()
 
     settings = build_settings(tmp_path, abs_model_dir)
+    # 走 eval.py 子进程路径
+    settings.model_server_enabled = False
 
     # 用隔离的 settings 覆盖 service 的单例
     service = InferenceService()
@@ -73,23 +100,50 @@ def test_call_nnunet_predict_prefers_model_dir_and_checkpoint(tmp_path, monkeypa
     input_dir.mkdir()
     output_dir.mkdir()
 
-    calls = {}
-
-    def fake_run(cmd, cwd, env, capture_output, text, timeout):
-        calls["cmd"] = cmd
-        calls["env"] = env
-        class R:
-            returncode = 0
-            stdout = "ok"
-            stderr = ""
-
-        return R()
-
-    monkeypatch.setattr("app.services.inference.subprocess.run", fake_run)
+    calls_file = write_fake_eval(settings.nnunet_root)
 
-    ok = service._call_nnunet_predict(input_dir, output_dir, task_id="demo")
+    ok, _ = service._call_nnunet_predict(input_dir, output_dir, task_id="demo")
 
+    calls = json.loads(calls_file.read_text())
     assert ok is True
     assert "model_final_checkpoint" in " ".join(calls["cmd"])
     # 结果目录取自模型路径的上级（models，已解析为绝对路径）
     assert calls["env"]["RESULTS_FOLDER"] == str(abs_model_dir.parents[3])
+
+
+def test_eval_script_batch_routes_outputs_back_to_cases(tmp_path, monkeypatch):
+    model_dir = tmp_path / "models" / "nnUNet" / "3d_fullres" / "Task001_kits" / "nnUNetTrainerV2__nnUNetPlansv2.1"
+    (model_dir / "fold_0").mkdir(parents=True)
+    (model_dir / "fold_0" / "model_best.ckpt").touch()
+    settings = build_settings(tmp_path, model_dir)
+    settings.model_server_enabled = False
+
+    service = InferenceService()
+    monkeypatch.setattr(service, "settings", settings)
+
+    cases = []
+    for task_id in ("a", "b"):
+        task_dir = tmp_path / "results" / task_id
+        (task_dir / "input").mkdir(parents=True)
+        input_file = task_dir / "input" / f"{task_id}_0000.nii.gz"
+        input_file.write_bytes(task_id.encode())
+        cases.append({
+            "task_id": task_id,
+            "input_files": [str(input_file)],
+            "output_file": str(task_dir / "output" / f"{task_id}.nii.gz"),
+        })
+
+    calls_file = write_fake_eval(settings.nnunet_root)
+    events = []
+
+    ok, _ = service._predict_cases(cases, on_progress=events.append)
+
+    assert ok is True
+    # 两个病例只运行一次 eval.py
+    assert json.loads(calls_file.read_text())["inputs"] == ["a_0000.nii.gz", "b_0000.nii.gz"]
+    # 进度事件逐行解析，不混入普通输出
+    assert [(e["case"], e["tile"]) for e in events] == [("a", 1), ("a", 2), ("b", 1), ("b", 2)]
+    assert Path(cases[0]["output_file"]).read_bytes() == b"seg-a"
+    assert Path(cases[1]["output_file"]).read_bytes() == b"seg-b"
+    # 批次临时目录已清理
+    assert list(settings.temp_dir.glob("batch_*")) == []
@@ -0,0 +1,77 @@
+import threading
+
+from fastapi import FastAPI
+from fastapi.testclient import TestClient
+
+from app.api import metrics as metrics_api
+from app.core.database import get_sync_session
+from app.models.task import InferenceTask, TaskStatus
+from app.services.metrics import Counter, Histogram, http_request_duration, router_label
+
+
+def test_counter_sums_per_thread_shards():
+    counter = Counter("test_total", "test", ("kind",))
+
+    def work():
+        for _ in range(1000):
+            counter.inc(kind="a")
+        counter.inc(5, kind="b")
+
+    threads = [threading.Thread(target=work) for _ in range(4)]
+    for t in threads:
+        t.start()
+    for t in threads:
+        t.join()
+
+    assert counter.values() == {("a",): 4000, ("b",): 20}
+    assert 'test_total{kind="a"} 4000' in counter.samples()
+
+
+def test_histogram_renders_cumulative_buckets():
+    histogram = Histogram("test_seconds", "test", buckets=(0.1, 1.0))
+    for value in (0.05, 0.5, 0.5, 3.0):
+        histogram.observe(value)
+
+    assert histogram.samples() == [
+        'test_seconds_bucket{le="0.1"} 1',
+        'test_seconds_bucket{le="1.0"} 3',
+        'test_seconds_bucket{le="+Inf"} 4',
+        "test_seconds_sum 4.05",
+        "test_seconds_count 4",
+    ]
+
+
+def test_router_label():
+    assert router_label("/api/v1/inference/abc/status") == "inference"
+    assert router_label("/v1/history") == "history"
+    assert router_label("/files/abc/original.nii.gz") == "files"
+    assert router_label("/health") == "other"
+
+
+def test_metrics_endpoint_reports_tasks_by_status(sync_db):
+    with get_sync_session() as session:
+        session.add(InferenceTask(id="q", filename="a.nii.gz", original_path="x", status=TaskStatus.QUEUED))
+        session.add(InferenceTask(id="c", filename="b.nii.gz", original_path="x", status=TaskStatus.COMPLETED))
+    app = FastAPI()
+    app.include_router(metrics_api.router)
+
+    response = TestClient(app).get("/metrics")
+
+    assert response.status_code == 200
+    assert response.headers["content-type"].startswith("text/plain")
+    lines = response.text.splitlines()
+    assert 'kta_tasks{status="queued"} 1' in lines
+    assert 'kta_tasks{status="processing"} 0' in lines
+    assert "# TYPE kta_http_request_duration_seconds histogram" in lines
+
+
+def test_request_middleware_records_latency_by_router(sync_db):
+    from app.main import app
+
+    def count():
+        data = http_request_duration.values().get(("history", "GET", "200"))
+        return sum(data[:-1]) if data else 0
+
+    before = count()
+    assert TestClient(app).get("/api/v1/history").status_code == 200
+    assert count() == before + 1
@@ -0,0 +1,271 @@
+import json
+import socket
+import sys
+import threading
+import time
+from pathlib import Path
+
+ROOT_DIR = Path(__file__).resolve().parents[1]
+if str(ROOT_DIR) not in sys.path:
+    sys.path.insert(0, str(ROOT_DIR))
+
+import nibabel as nib
+import numpy as np
+import pytest
+
+from app.core.config import Settings
+from app.services.inference import InferenceService
+
+NNUNET_ROOT = ROOT_DIR.parent / "nnUNet-msgpu1.10"
+
+
+@pytest.fixture
+def stand_in_service(tmp_path, monkeypatch):
+    """使用 CPU 替身模型的推理服务，socket 放在临时目录"""
+    settings = Settings(
+        base_dir=tmp_path,
+        nnunet_root=NNUNET_ROOT,
+        model_path=tmp_path / "models",
+        upload_dir=tmp_path / "uploads",
+        result_dir=tmp_path / "results",
+        temp_dir=tmp_path / "temp",
+        model_server_socket=tmp_path / "ms.sock",
+        model_server_stand_in=True,
+        model_server_startup_timeout=30,
+    )
+    settings.ensure_dirs()
+    service = InferenceService()
+    monkeypatch.setattr(service, "settings", settings)
+    yield service
+    service.shutdown()
+
+
+def write_ct(path: Path):
+    data = np.full((8, 8, 8), -1000, dtype=np.int16)
+    data[2:4, 2:4, 2:4] = 200
+    data[5:7, 5:7, 5:7] = 400
+    nib.save(nib.Nifti1Image(data, np.eye(4)), str(path))
+
+
+def test_model_server_predicts_and_stays_warm(tmp_path, stand_in_service):
+    input_dir = tmp_path / "input"
+    output_dir = tmp_path / "output"
+    input_dir.mkdir()
+    output_dir.mkdir()
+    write_ct(input_dir / "demo_0000.nii.gz")
+
+    ok, err = stand_in_service._call_nnunet_predict(input_dir, output_dir, task_id="demo")
+    assert ok, err
+
+    seg = np.asanyarray(nib.load(str(output_dir / "demo.nii.gz")).dataobj)
+    assert seg.dtype == np.uint8
+    assert set(np.unique(seg)) == {0, 1, 2}
+
+    # 第二个病例复用同一个服务进程
+    client = stand_in_service._get_model_server()
+    pid = client.ping()["pid"]
+    ok, err = stand_in_service._call_nnunet_predict(input_dir, output_dir, task_id="demo")
+    assert ok, err
+    assert client.ping()["pid"] == pid
+
+
+def test_model_server_reports_errors(tmp_path, stand_in_service):
+    (tmp_path / "input").mkdir()
+    ok, err = stand_in_service._call_nnunet_predict(tmp_path / "input", tmp_path / "output", task_id="missing")
+    assert not ok
+    assert err
+
+
+def test_model_server_streams_progress(tmp_path, stand_in_service):
+    input_dir = tmp_path / "input"
+    input_dir.mkdir()
+    write_ct(input_dir / "demo_0000.nii.gz")
+    case = {
+        "task_id": "demo",
+        "input_files": [str(input_dir / "demo_0000.nii.gz")],
+        "output_file": str(tmp_path / "output" / "demo.nii.gz"),
+    }
+    (tmp_path / "output").mkdir()
+
+    events = []
+    ok, err = stand_in_service._predict_cases([case], on_progress=events.append)
+    assert ok, err
+    assert [e["stage"] for e in events] == ["queued", "started", "predict", "predict", "export", "exported", "done"]
+    assert events[3]["case"] == "demo" and events[3]["tile"] == events[3]["num_tiles"] == 1
+
+
+def test_model_server_cancel_stops_running_case(tmp_path, stand_in_service):
+    input_dir = tmp_path / "input"
+    output_dir = tmp_path / "output"
+    input_dir.mkdir()
+    output_dir.mkdir()
+    cases = []
+    for case_id in ("slow", "next"):
+        write_ct(input_dir / f"{case_id}_0000.nii.gz")
+        cases.append({
+            "task_id": case_id,
+            "input_files": [str(input_dir / f"{case_id}_0000.nii.gz")],
+            "output_file": str(output_dir / f"{case_id}.nii.gz"),
+        })
+    client = stand_in_service._get_model_server()
+    client.command += ["--stand_in_delay", "30"]
+
+    started = threading.Event()
+    events = []
+
+    def on_progress(event):
+        events.append(event)
+        if event["stage"] == "predict":
+            started.set()
+
+    result = {}
+    thread = threading.Thread(target=lambda: result.update(ok=stand_in_service._predict_cases(cases, on_progress)))
+    thread.start()
+    assert started.wait(30)
+    start = time.time()
+    assert client.cancel(["slow", "next"])
+    thread.join(30)
+
+    assert time.time() - start < 5
+    assert result["ok"] == (True, "")
+    assert [e["case"] for e in events if e["stage"] == "cancelled"] == ["slow", "next"]
+    assert not (output_dir / "slow.nii.gz").exists()
+
+
+def test_cancel_then_retry_same_task(sync_db, tmp_path, stand_in_service):
+    from app.core.database import get_sync_session
+    from app.models.task import InferenceTask, TaskStatus
+
+    upload = tmp_path / "case.nii.gz"
+    write_ct(upload)
+    task_id = stand_in_service.create_task("case.nii.gz", upload)
+    client = stand_in_service._get_model_server()
+    client.command += ["--stand_in_delay", "2"]
+
+    def run():
+        stand_in_service.queue.enqueue(task_id)
+        assert stand_in_service.queue.claim() == task_id
+        stand_in_service._run_inference_batch([task_id])
+
+    def status():
+        with get_sync_session() as session:
+            return session.query(InferenceTask).filter_by(id=task_id).one().status
+
+    worker = threading.Thread(target=run)
+    worker.start()
+    deadline = time.time() + 30
+    while time.time() < deadline and (stand_in_service.get_task(task_id).progress or 0) <= 20:
+        time.sleep(0.05)
+    assert stand_in_service.cancel_task(task_id) == TaskStatus.CANCELLED
+    worker.join(30)
+    assert status() == TaskStatus.CANCELLED
+
+    # 推理结束后才到达的取消请求不属于任何推理，直接丢弃
+    assert client._request({"cmd": "cancel", "cases": [task_id]}, timeout=5)["cancelled"] == []
+
+    stand_in_service.prepare_task_for_run(task_id, "重新排队中...")
+    run()
+    assert status() == TaskStatus.COMPLETED
+
+
+def test_model_server_timeout_excludes_queue_and_cancels(tmp_path, stand_in_service):
+    input_dir = tmp_path / "input"
+    output_dir = tmp_path / "output"
+    input_dir.mkdir()
+    output_dir.mkdir()
+    cases = {}
+    for case_id in ("first", "queued", "late"):
+        write_ct(input_dir / f"{case_id}_0000.nii.gz")
+        cases[case_id] = [{
+            "input_files": [str(input_dir / f"{case_id}_0000.nii.gz")],
+            "output_file": str(output_dir / f"{case_id}.nii.gz"),
+        }]
+    client = stand_in_service._get_model_server()
+    client.command += ["--stand_in_delay", "2"]
+    client.ensure_running()
+
+    # queued 排在 first 之后约 2 秒，自身推理约 2 秒: 排队时间不计入 3 秒的超时
+    started = threading.Event()
+    result = {}
+    first = threading.Thread(target=lambda: result.update(
+        first=client.predict(cases["first"], on_progress=lambda event: event["stage"] == "predict" and started.set())))
+    first.start()
+    assert started.wait(30)
+    result["queued"] = client.predict(cases["queued"], timeout=3)
+    first.join(30)
+    assert result == {"first": (True, ""), "queued": (True, "")}
+
+    # 超时后取消病例，服务不再写出结果
+    with pytest.raises(socket.timeout):
+        client.predict(cases["late"], timeout=0.5)
+    time.sleep(2.5)
+    assert not (output_dir / "late.nii.gz").exists()
+
+
+def test_model_server_queue_wait_is_bounded(tmp_path, stand_in_service):
+    input_dir = tmp_path / "input"
+    output_dir = tmp_path / "output"
+    input_dir.mkdir()
+    output_dir.mkdir()
+    cases = {}
+    for case_id in ("first", "queued"):
+        write_ct(input_dir / f"{case_id}_0000.nii.gz")
+        cases[case_id] = [{
+            "input_files": [str(input_dir / f"{case_id}_0000.nii.gz")],
+            "output_file": str(output_dir / f"{case_id}.nii.gz"),
+        }]
+    client = stand_in_service._get_model_server()
+    client.command += ["--stand_in_delay", "2"]
+    client.ensure_running()
+
+    started = threading.Event()
+    first = threading.Thread(target=lambda: client.predict(
+        cases["first"], on_progress=lambda event: event["stage"] == "predict" and started.set()))
+    first.start()
+    assert started.wait(30)
+
+    # 排队超过 queue_timeout: 放弃等待并取消，排在后面的病例开始时即跳过
+    events = []
+    with pytest.raises(socket.timeout):
+        client.predict(cases["queued"], timeout=30, on_progress=events.append, queue_timeout=0.5)
+    first.join(30)
+    assert [e["stage"] for e in events] == ["queued"]
+    assert not (output_dir / "queued.nii.gz").exists()
+
+
+def test_model_server_without_heartbeat_times_out(tmp_path, monkeypatch):
+    """服务受理前卡住 (既不推理也不发送 queued) 时不会无限等待"""
+    import socketserver
+
+    from app.services import model_server
+
+    requests = []
+
+    class Handler(socketserver.StreamRequestHandler):
+        def handle(self):
+            for line in self.rfile:
+                request = json.loads(line)
+                requests.append(request)
+                if request["cmd"] == "predict":
+                    time.sleep(5)
+                    return
+                self.wfile.write(b'{"ok": true}\n')
+
+    class Server(socketserver.ThreadingMixIn, socketserver.UnixStreamServer):
+        daemon_threads = True
+
+    socket_path = tmp_path / "hung.sock"
+    server = Server(str(socket_path), Handler)
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    monkeypatch.setattr(model_server, "QUEUE_HEARTBEAT_TIMEOUT", 0.5)
+    client = model_server.ModelServerClient(socket_path, command=[], cwd=tmp_path, env={},
+                                            log_path=tmp_path / "ms.log")
+    try:
+        start = time.time()
+        with pytest.raises(socket.timeout):
+            client.predict([{"input_files": [], "output_file": str(tmp_path / "hung.nii.gz")}], timeout=None)
+        assert time.time() - start < 3
+        assert {"cmd": "cancel", "cases": ["hung"]} in requests
+    finally:
+        server.shutdown()
+        server.server_close()
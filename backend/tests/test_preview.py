@@ -0,0 +1,114 @@
+import nibabel as nib
+import numpy as np
+import pytest
+
+from app.services.preview import (
+    PreviewService,
+    build_preview_pyramid,
+    pyramid_path,
+    reduce_intensity,
+    reduce_labels,
+)
+
+
+@pytest.fixture
+def preview_pool():
+    service = PreviewService(max_workers=2)
+    yield service
+    service.shutdown()
+
+
+def write_volume(path, shape=(32, 32, 16)):
+    data = np.random.default_rng(0).integers(-1000, 1000, size=shape).astype(np.int16)
+    nib.save(nib.Nifti1Image(data, np.diag([0.8, 0.8, 2.5, 1])), str(path))
+
+
+def write_case(task_dir):
+    task_dir.mkdir(parents=True, exist_ok=True)
+    write_volume(task_dir / "original.nii.gz")
+    seg = np.zeros((32, 32, 16), dtype=np.uint8)
+    seg[8:24, 8:24, 4:12] = 1
+    nib.save(nib.Nifti1Image(seg, np.diag([0.8, 0.8, 2.5, 1])), str(task_dir / "segmentation.nii.gz"))
+
+
+def test_build_preview_pyramid_levels(tmp_path):
+    src = tmp_path / "original.nii.gz"
+    write_volume(src)
+
+    written = build_preview_pyramid(str(src), str(tmp_path / "pyramid"), "original.nii.gz")
+
+    assert len(written) == 3
+    for factor, shape in [(2, (16, 16, 8)), (4, (8, 8, 4)), (8, (4, 4, 2))]:
+        level = nib.load(str(tmp_path / "pyramid" / f"{factor}x_original.nii.gz"))
+        assert level.shape == shape
+        assert np.allclose(level.header.get_zooms(), (0.8 * factor, 0.8 * factor, 2.5 * factor))
+        assert np.allclose(np.diag(level.affine)[:3], (0.8 * factor, 0.8 * factor, 2.5 * factor))
+        assert level.get_data_dtype() == np.int16
+    assert not list((tmp_path / "pyramid").glob("*.tmp"))
+
+
+def test_reduce_intensity_block_mean():
+    data = np.arange(4 * 4 * 2, dtype=np.int16).reshape(4, 4, 2) * 10
+    reduced = reduce_intensity(data, 2)
+
+    assert reduced.dtype == np.int16
+    assert reduced.shape == (2, 2, 1)
+    assert reduced[0, 0, 0] == int(np.rint(data[:2, :2, :2].mean()))
+
+
+def test_reduce_labels_keeps_thin_tumor_and_pads_edges():
+    seg = np.zeros((17, 16, 16), dtype=np.uint8)
+    seg[:8, :8, :8] = 1
+    seg[3, 3, 3] = 2  # 单体素肿瘤
+    seg[16, 0, 0] = 1  # 不能整除的边缘
+
+    reduced = reduce_labels(seg, 8)
+
+    assert reduced.dtype == np.uint8
+    assert reduced.shape == (3, 2, 2)
+    # 肿瘤严格优先于肾脏，即使只占块内一个体素
+    assert reduced[0, 0, 0] == 2
+    assert reduced[0, 1, 0] == 0
+    assert reduced[2, 0, 0] == 1
+    assert reduced[1, 1, 1] == 0
+
+
+def test_reduce_labels_pyramid_keeps_single_tumor_voxel():
+    seg = np.zeros((32, 32, 32), dtype=np.uint8)
+    seg[4:28, 4:28, 4:28] = 1
+    seg[13, 17, 9] = 2  # 嵌在肾脏里的单体素肿瘤
+
+    level = seg
+    for factor in (2, 4, 8):
+        # 与 build_preview_pyramid 一样由上一级继续降采样
+        level = reduce_labels(level, 2)
+        reduced = reduce_labels(seg, factor)
+        assert reduced[13 // factor, 17 // factor, 9 // factor] == 2
+        assert level[13 // factor, 17 // factor, 9 // factor] == 2
+        assert np.count_nonzero(reduced == 2) == 1
+        assert np.count_nonzero(level == 2) == 1
+
+
+def test_schedule_pyramid_is_single_flight(preview_pool, tmp_path):
+    task_dir = tmp_path / "task"
+    write_case(task_dir)
+
+    first = preview_pool.schedule_pyramid("task", task_dir, 1)
+    second = preview_pool.schedule_pyramid("task", task_dir, 1)
+    assert len(first) == 2
+    assert all(a is b for a, b in zip(first, second))
+
+    for future in first:
+        future.result()
+    assert not preview_pool._inflight
+    assert pyramid_path(task_dir, 1, "segmentation.nii.gz", 8).exists()
+
+
+def test_build_pyramid_drops_old_generations(preview_pool, tmp_path):
+    task_dir = tmp_path / "task"
+    write_case(task_dir)
+    preview_pool.build_pyramid("task", task_dir, 1)
+    preview_pool.build_pyramid("task", task_dir, 2)
+
+    assert pyramid_path(task_dir, 2, "original.nii.gz", 4).exists()
+    assert not (task_dir / "preview" / "g1").exists()
@@ -0,0 +1,41 @@
+from app.services.progress import ProgressTracker, message_from_event, parse_progress_line, progress_from_event
+
+
+def test_parse_progress_line_ignores_plain_output():
+    assert parse_progress_line("predicting /tmp/a.nii.gz\n") is None
+    assert parse_progress_line("{not json}") is None
+    assert parse_progress_line('{"ok": true}') is None
+    assert parse_progress_line('{"event": "progress", "stage": "export", "case": "a"}\n')["case"] == "a"
+
+
+def test_predict_progress_spans_folds_and_tiles():
+    first = progress_from_event({"stage": "predict", "fold": 0, "num_folds": 2, "tile": 0, "num_tiles": 10})
+    middle = progress_from_event({"stage": "predict", "fold": 1, "num_folds": 2, "tile": 0, "num_tiles": 10})
+    last = progress_from_event({"stage": "predict", "fold": 1, "num_folds": 2, "tile": 10, "num_tiles": 10})
+    assert progress_from_event({"stage": "preprocess"}) < first < middle < last < progress_from_event({"stage": "export"})
+    assert progress_from_event({"stage": "unknown"}) is None
+
+
+def test_tracker_routes_events_to_tasks_and_only_moves_forward():
+    updates = []
+    tracker = ProgressTracker(["a", "b"], lambda task_id, progress, message: updates.append((task_id, progress)))
+
+    tracker({"stage": "predict", "case": "a", "tile": 5, "num_tiles": 10})
+    tracker({"stage": "predict", "case": "a", "tile": 5, "num_tiles": 10})  # 进度未变化，不重复写入
+    tracker({"stage": "preprocess", "case": "a"})  # 不回退
+    tracker({"stage": "predict", "case": "other", "tile": 1, "num_tiles": 1})  # 不属于本批
+    tracker({"stage": "postprocess"})  # 不带 case，作用于全部任务
+
+    assert updates == [("a", 50), ("a", 79), ("b", 79)]
+    # 区块总数只记录本批病例
+    assert tracker.tiles == {"a": 10}
+
+
+def test_skipped_tiles_in_message_and_tile_count():
+    event = {"stage": "predict", "case": "a", "tile": 3, "num_tiles": 6, "skipped_tiles": 4}
+    assert message_from_event(event) == "正在执行分割推理 (区块 3/6, 跳过背景区块 4)"
+    tracker = ProgressTracker(["a"], lambda task_id, progress, message: None)
+    tracker(event)
+    # 进度按实际推理的区块，区块总数按跳过前的网格 (与耗时预估一致)
+    assert progress_from_event(event) == progress_from_event({"stage": "predict", "tile": 1, "num_tiles": 2})
+    assert tracker.tiles == {"a": 10}
@@ -0,0 +1,103 @@
+import hashlib
+from datetime import datetime
+
+import pytest
+
+from app.core.config import get_settings
+from app.core.database import get_sync_session
+from app.models.task import InferenceTask, TaskStatus
+from app.services.inference import InferenceService
+
+
+@pytest.fixture
+def service(tmp_path, sync_db, monkeypatch):
+    settings = get_settings().model_copy(update={
+        "upload_dir": tmp_path / "uploads",
+        "result_dir": tmp_path / "results",
+        "model_path": tmp_path / "model",
+        "model_server_enabled": False,
+    })
+    service = InferenceService()
+    monkeypatch.setattr(service, "settings", settings)
+    enqueued = []
+    monkeypatch.setattr(service.queue, "enqueue_many", lambda task_ids: enqueued.extend(task_ids) or [])
+    service.enqueued = enqueued
+    return service
+
+
+def upload(service, tmp_path, content=b"fake nifti bytes"):
+    src = tmp_path / "upload.nii.gz"
+    src.write_bytes(content)
+    return service.create_task("case.nii.gz", src, hashlib.sha256(content).hexdigest())
+
+
+def complete(task_id, kidney=100.0, tumor=20.0):
+    with get_sync_session() as session:
+        task = session.query(InferenceTask).filter_by(id=task_id).first()
+        seg = task.original_path.replace("original", "segmentation")
+        with open(seg, "wb") as f:
+            f.write(b"segmentation")
+        task.status = TaskStatus.COMPLETED
+        task.segmentation_path = seg
+        task.kidney_volume = kidney
+        task.tumor_volume = tumor
+        task.completed_at = datetime.utcnow()
+
+
+def test_repeat_upload_reuses_blob_and_result(service, tmp_path):
+    first = upload(service, tmp_path)
+    assert service.start_inference(first) == TaskStatus.QUEUED
+    assert service.enqueued == [first]
+    complete(first)
+
+    second = upload(service, tmp_path)
+    assert service.start_inference(second) == TaskStatus.COMPLETED
+    assert service.enqueued == [first]
+
+    first_task, second_task = service.get_task(first), service.get_task(second)
+    assert first_task.input_digest == second_task.input_digest
+    assert second_task.cache_key == first_task.cache_key
+    # 原始文件按摘要只存一份
+    assert (tmp_path / "results" / first / "original.nii.gz").stat().st_ino == \
+        (tmp_path / "results" / second / "original.nii.gz").stat().st_ino
+    assert second_task.status == TaskStatus.COMPLETED
+    assert (second_task.kidney_volume, second_task.tumor_volume) == (100.0, 20.0)
+    assert (tmp_path / "results" / second / "segmentation.nii.gz").read_bytes() == b"segmentation"
+
+
+def test_cache_miss_on_different_input_or_config(service, tmp_path):
+    first = upload(service, tmp_path)
+    service.start_inference(first)
+    complete(first)
+
+    other = upload(service, tmp_path, content=b"another study")
+    assert service.start_inference(other) == TaskStatus.QUEUED
+
+    service.settings.step_size = 0.25
+    same_input = upload(service, tmp_path)
+    assert service.start_inference(same_input) == TaskStatus.QUEUED
+
+
+def test_tta_axes_change_cache_key_and_command(service):
+    assert service._tta_args() == ["--disable_tta"]
+    plain = service._result_cache_key("digest")
+    service.settings.tta_mirror_axes = [2]
+    # 未启用测试时增强时镜像轴不影响结果
+    assert service._result_cache_key("digest") == plain
+
+    service.settings.enable_tta = True
+    assert service._tta_args() == ["--tta_axes", "2"]
+    subset = service._result_cache_key("digest")
+    service.settings.tta_mirror_axes = []
+    assert service._tta_args() == []
+    assert len({plain, subset, service._result_cache_key("digest")}) == 3
+
+
+def test_retry_bypasses_cache(service, tmp_path):
+    first = upload(service, tmp_path)
+    service.start_inference(first)
+    complete(first)
+
+    second = upload(service, tmp_path)
+    assert service.start_inference(second, use_cache=False) == TaskStatus.QUEUED
+    assert service.enqueued == [first, second]
@@ -0,0 +1,73 @@
+import os
+
+from app.services import staging
+from app.services.staging import link_or_copy
+
+
+def test_link_or_copy_hardlinks_on_same_filesystem(tmp_path):
+    src = tmp_path / "original.nii.gz"
+    src.write_bytes(b"ct volume")
+    dest = tmp_path / "input" / "case_0000.nii.gz"
+
+    assert link_or_copy(src, dest) == "link"
+    assert dest.stat().st_ino == src.stat().st_ino
+
+    # 已存在时覆盖
+    other = tmp_path / "other.nii.gz"
+    other.write_bytes(b"other")
+    link_or_copy(other, dest)
+    assert dest.read_bytes() == b"other"
+
+
+def test_link_or_copy_falls_back_to_copy(tmp_path, monkeypatch):
+    def no_link(src, dst):
+        raise OSError("cross-device link")
+
+    monkeypatch.setattr(staging.os, "link", no_link)
+    monkeypatch.setattr(staging, "_reflink", lambda src, dest: False)
+    src = tmp_path / "original.nii.gz"
+    src.write_bytes(b"ct volume")
+    dest = tmp_path / "copy.nii.gz"
+
+    assert link_or_copy(src, dest) == "copy"
+    assert dest.read_bytes() == b"ct volume"
+    assert os.stat(dest).st_ino != os.stat(src).st_ino
+
+
+def test_link_or_copy_does_not_write_through_existing_link(tmp_path, monkeypatch):
+    def no_link(src, dst):
+        raise OSError("cross-device link")
+
+    shared = tmp_path / "shared.nii.gz"
+    shared.write_bytes(b"other task")
+    dest = tmp_path / "dest.nii.gz"
+    os.link(shared, dest)
+    src = tmp_path / "original.nii.gz"
+    src.write_bytes(b"ct volume")
+    monkeypatch.setattr(staging.os, "link", no_link)
+    monkeypatch.setattr(staging, "_reflink", lambda src, dest: False)
+
+    link_or_copy(src, dest)
+    assert dest.read_bytes() == b"ct volume"
+    # 另一个任务的原图不受影响
+    assert shared.read_bytes() == b"other task"
+
+
+def test_blob_store_concurrent_put_of_same_digest(tmp_path):
+    from concurrent.futures import ThreadPoolExecutor
+
+    from app.services.blob_store import BlobStore
+
+    store = BlobStore(tmp_path / "blobs")
+    sources = []
+    for i in range(8):
+        src = tmp_path / f"upload_{i}.nii.gz"
+        src.write_bytes(b"same content")
+        sources.append(src)
+
+    with ThreadPoolExecutor(max_workers=8) as pool:
+        paths = list(pool.map(lambda src: store.put(src, "abc123"), sources))
+
+    assert len(set(paths)) == 1
+    assert paths[0].read_bytes() == b"same content"
+    assert not list(paths[0].parent.glob("*.tmp"))
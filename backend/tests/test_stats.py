@@ -0,0 +1,95 @@
+import nibabel as nib
+import numpy as np
+import pytest
+
+from app.services.stats import compute_segmentation_stats
+
+
+def write_seg(path, seg, affine):
+    img = nib.Nifti1Image(seg, affine)
+    img.set_data_dtype(np.uint8)
+    nib.save(img, str(path))
+
+
+def test_stats_split_kidneys_and_lesions(tmp_path):
+    seg = np.zeros((40, 20, 10), dtype=np.uint8)
+    seg[2:10, 5:15, 2:8] = 1     # 体素 x 小的一侧
+    seg[28:38, 5:15, 2:8] = 1    # 体素 x 大的一侧
+    seg[4:6, 6:8, 3:5] = 2       # 小侧病灶 8 体素
+    seg[30:34, 6:10, 3:6] = 2    # 大侧病灶 48 体素
+    seg[31, 12, 6] = 2           # 与大病灶不连通的单体素病灶
+    path = tmp_path / "segmentation.nii.gz"
+    # RAS+ 仿射: 体素 x 越大越靠患者右侧
+    write_seg(path, seg, np.diag([0.5, 1.0, 2.0, 1.0]))
+
+    stats = compute_segmentation_stats(path)
+    voxel = 0.5 * 1.0 * 2.0
+
+    assert stats["kidney_volume"] == pytest.approx(np.count_nonzero(seg == 1) * voxel)
+    assert stats["tumor_volume"] == pytest.approx(57 * voxel)
+    assert stats["kidney_left_volume"] == pytest.approx(np.count_nonzero(seg[:20] == 1) * voxel)
+    assert stats["kidney_right_volume"] == pytest.approx(np.count_nonzero(seg[20:] == 1) * voxel)
+
+    assert stats["tumor_count"] == 3
+    largest = stats["lesions"][0]
+    assert largest["voxels"] == 48
+    assert largest["bbox"] == [[30, 34], [6, 10], [3, 6]]
+    assert largest["side"] == "right"
+    assert [lesion["voxels"] for lesion in stats["lesions"]] == [48, 8, 1]
+    assert stats["lesions"][1]["side"] == "left"
+
+
+def test_stats_flipped_affine_swaps_sides(tmp_path):
+    seg = np.zeros((20, 10, 10), dtype=np.uint8)
+    seg[1:5, 2:8, 2:8] = 1
+    path = tmp_path / "segmentation.nii.gz"
+    write_seg(path, seg, np.diag([-1.0, 1.0, 1.0, 1.0]))
+
+    stats = compute_segmentation_stats(path)
+
+    assert stats["kidney_right_volume"] == pytest.approx(4 * 6 * 6)
+    assert stats["kidney_left_volume"] == 0.0
+    assert stats["tumor_count"] == 0
+    assert stats["lesions"] == []
+
+
+def test_stats_empty_segmentation(tmp_path):
+    path = tmp_path / "segmentation.nii.gz"
+    write_seg(path, np.zeros((8, 8, 8), dtype=np.uint8), np.eye(4))
+
+    stats = compute_segmentation_stats(path)
+
+    assert stats["kidney_volume"] == 0.0
+    assert stats["tumor_count"] == 0
+
+
+def test_stats_off_centre_scan_uses_kidneys_as_reference(tmp_path):
+    # 扫描范围偏向一侧: 两侧肾脏都在影像中心的同一边
+    seg = np.zeros((60, 20, 10), dtype=np.uint8)
+    seg[2:10, 5:15, 2:8] = 1
+    seg[20:28, 5:15, 2:8] = 1
+    seg[22:24, 6:8, 3:5] = 2
+    path = tmp_path / "segmentation.nii.gz"
+    write_seg(path, seg, np.eye(4))
+
+    stats = compute_segmentation_stats(path)
+
+    assert stats["kidney_left_volume"] == pytest.approx(np.count_nonzero(seg[:15] == 1))
+    assert stats["kidney_right_volume"] == pytest.approx(np.count_nonzero(seg[15:] == 1))
+    assert stats["lesions"][0]["side"] == "right"
+
+
+def test_stats_horseshoe_kidney_is_split_at_midline(tmp_path):
+    # 单个跨过中线的连通域 (马蹄肾) 按体素分到两侧
+    seg = np.zeros((40, 20, 10), dtype=np.uint8)
+    seg[5:35, 5:15, 2:8] = 1
+    seg[6:8, 6:8, 3:5] = 2
+    path = tmp_path / "segmentation.nii.gz"
+    write_seg(path, seg, np.eye(4))
+
+    stats = compute_segmentation_stats(path)
+
+    assert stats["kidney_left_volume"] == pytest.approx(np.count_nonzero(seg[:20] == 1))
+    assert stats["kidney_right_volume"] == pytest.approx(np.count_nonzero(seg[20:] == 1))
+    assert stats["tumor_count"] == 1
+    assert stats["lesions"][0]["side"] == "left"
@@ -0,0 +1,145 @@
+import os
+from datetime import datetime, timedelta
+from pathlib import Path
+from types import SimpleNamespace
+
+from app.core.database import get_sync_session
+from app.models.task import InferenceTask, StorageEntry, TaskStatus
+from app.services.storage import SEGMENTATION_EVICTED_MESSAGE, StorageManager
+
+
+def storage_settings(tmp_path, **overrides):
+    values = dict(
+        upload_dir=tmp_path / "uploads",
+        result_dir=tmp_path / "results",
+        temp_dir=tmp_path / "temp",
+        storage_budget_original=0,
+        storage_budget_segmentation=0,
+        storage_budget_preview=0,
+        storage_check_interval=600,
+        storage_scratch_max_age=3600,
+    )
+    values.update(overrides)
+    return SimpleNamespace(**values)
+
+
+def add_task(task_id, status, **fields):
+    with get_sync_session() as session:
+        session.add(InferenceTask(id=task_id, filename=f"{task_id}.nii.gz", original_path="x", status=status, **fields))
+
+
+def write(path: Path, size: int) -> Path:
+    path.parent.mkdir(parents=True, exist_ok=True)
+    path.write_bytes(b"\0" * size)
+    return path
+
+
+def set_last_access(path, minutes_ago):
+    with get_sync_session() as session:
+        entry = session.query(StorageEntry).filter_by(path=str(path)).one()
+        entry.last_access_at = datetime.utcnow() - timedelta(minutes=minutes_ago)
+
+
+def test_segmentation_budget_evicts_least_recently_used(sync_db, tmp_path):
+    manager = StorageManager(storage_settings(tmp_path, storage_budget_segmentation=250))
+    paths = {}
+    for task_id, status, minutes_ago in [("old", TaskStatus.COMPLETED, 30), ("busy", TaskStatus.PROCESSING, 20),
+                                         ("mid", TaskStatus.COMPLETED, 10), ("new", TaskStatus.COMPLETED, 1)]:
+        paths[task_id] = write(tmp_path / "results" / task_id / "segmentation.nii.gz", 100)
+        add_task(task_id, status, segmentation_path=str(paths[task_id]))
+        manager.register("segmentation", paths[task_id], task_id)
+        set_last_access(paths[task_id], minutes_ago)
+
+    # 访问过的 mid 变为最近使用
+    manager.touch("mid", "segmentation")
+    manager.flush_touches()
+
+    freed = manager.enforce_budgets()
+    assert freed == {"segmentation": 200}
+    # 处理中的任务即使最久未访问也不回收
+    assert {k for k, p in paths.items() if p.exists()} == {"busy", "mid"}
+    assert manager.usage()["segmentation"] == 200
+    with get_sync_session() as session:
+        old = session.query(InferenceTask).filter_by(id="old").one()
+        assert old.segmentation_path is None
+        assert old.status == TaskStatus.COMPLETED and old.message == SEGMENTATION_EVICTED_MESSAGE
+        assert session.query(InferenceTask).filter_by(id="mid").one().segmentation_path == str(paths["mid"])
+
+
+def test_reused_segmentation_is_charged_once(sync_db, tmp_path):
+    manager = StorageManager(storage_settings(tmp_path, storage_budget_segmentation=150))
+    source = write(tmp_path / "results" / "source" / "segmentation.nii.gz", 100)
+    reused = tmp_path / "results" / "reused" / "segmentation.nii.gz"
+    reused.parent.mkdir(parents=True)
+    os.link(source, reused)
+    for task_id, path in (("source", source), ("reused", reused)):
+        add_task(task_id, TaskStatus.COMPLETED, segmentation_path=str(path), cache_key="k")
+    other = write(tmp_path / "results" / "other" / "segmentation.nii.gz", 100)
+    add_task("other", TaskStatus.COMPLETED, segmentation_path=str(other))
+    manager.register("segmentation", source, "source")
+    manager.register("segmentation", reused, "reused", size=0)  # 复用方以硬链接共享，不重复计数
+    manager.register("segmentation", other, "other")
+    set_last_access(source, 30)
+    set_last_access(other, 10)
+    assert manager.usage()["segmentation"] == 200
+
+    # 回收 source 不释放空间 (reused 仍链接着同一份数据)，字节数转给 reused，继续回收 other
+    assert manager.enforce_budgets() == {"segmentation": 100}
+    assert not source.exists() and not other.exists()
+    assert reused.read_bytes() == b"\0" * 100
+    assert manager.usage()["segmentation"] == 100
+    with get_sync_session() as session:
+        assert session.query(StorageEntry).filter_by(path=str(reused)).one().size_bytes == 100
+
+
+def test_shared_original_is_kept_while_any_owner_is_in_flight(sync_db, tmp_path):
+    manager = StorageManager(storage_settings(tmp_path, storage_budget_original=1))
+    blobs = {}
+    for digest, owners in [("a" * 64, [("a1", TaskStatus.COMPLETED), ("a2", TaskStatus.QUEUED)]),
+                           ("b" * 64, [("b1", TaskStatus.COMPLETED), ("b2", TaskStatus.FAILED)])]:
+        blobs[digest] = write(manager._blob_path(digest), 50)
+        manager.register("original", blobs[digest])
+        for task_id, status in owners:
+            link = tmp_path / "results" / task_id / "original.nii.gz"
+            link.parent.mkdir(parents=True)
+            os.link(blobs[digest], link)
+            add_task(task_id, status, input_digest=digest)
+
+    assert manager.enforce_budgets() == {"original": 50}
+    assert blobs["a" * 64].exists()
+    assert not blobs["b" * 64].exists()
+    assert not (tmp_path / "results" / "b1" / "original.nii.gz").exists()
+    assert not (tmp_path / "results" / "b2" / "original.nii.gz").exists()
+    assert (tmp_path / "results" / "a1" / "original.nii.gz").exists()
+
+
+def test_reclaim_scratch_skips_running_tasks(sync_db, tmp_path):
+    manager = StorageManager(storage_settings(tmp_path))
+    for task_id, status in [("failed", TaskStatus.FAILED), ("running", TaskStatus.PROCESSING)]:
+        add_task(task_id, status)
+        for sub_dir in ("input", "output"):
+            path = tmp_path / "results" / task_id / sub_dir
+            write(path / "case.nii.gz", 10)
+            manager.register("scratch", path, task_id, size=0)
+    stale = write(tmp_path / "temp" / "batch_old" / "x", 1).parent
+    fresh = write(tmp_path / "temp" / "batch_new" / "x", 1).parent
+    old_time = datetime.now().timestamp() - 7200
+    os.utime(stale, (old_time, old_time))
+
+    assert manager.reclaim_scratch() == 3
+    assert not (tmp_path / "results" / "failed" / "input").exists()
+    assert (tmp_path / "results" / "running" / "output").exists()
+    assert not stale.exists() and fresh.exists()
+
+
+def test_backfill_registers_existing_tasks_once(sync_db, tmp_path):
+    manager = StorageManager(storage_settings(tmp_path))
+    seg = write(tmp_path / "results" / "t1" / "segmentation.nii.gz", 30)
+    write(tmp_path / "results" / "t1" / "preview" / "g0" / "original_x2.nii.gz", 20)
+    write(manager._blob_path("c" * 64), 40)
+    add_task("t1", TaskStatus.COMPLETED, segmentation_path=str(seg), input_digest="c" * 64)
+    add_task("t2", TaskStatus.COMPLETED, input_digest="c" * 64)
+
+    assert manager.backfill() == 3
+    assert manager.backfill() == 0
+    assert manager.usage() == {"original": 40, "segmentation": 30, "preview": 20, "scratch": 0}
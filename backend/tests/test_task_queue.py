@@ -0,0 +1,144 @@
+import threading
+from datetime import datetime, timedelta
+from types import SimpleNamespace
+
+from app.core.database import get_sync_session
+from app.models.task import InferenceTask, TaskStatus
+from app.services.task_queue import TaskQueue
+
+
+def queue_settings(**overrides):
+    values = dict(
+        inference_workers=2,
+        inference_batch_size=1,
+        queue_poll_interval=0.05,
+        task_heartbeat_interval=0.05,
+        task_lease_seconds=60,
+        task_max_attempts=3,
+    )
+    values.update(overrides)
+    return SimpleNamespace(**values)
+
+
+def add_task(task_id, **fields):
+    with get_sync_session() as session:
+        session.add(InferenceTask(id=task_id, filename=f"{task_id}.nii.gz", original_path="x", **fields))
+
+
+def get_task(task_id):
+    with get_sync_session() as session:
+        task = session.query(InferenceTask).filter_by(id=task_id).first()
+        session.expunge(task)
+        return task
+
+
+def test_claim_in_queue_order_and_skip_unqueued(sync_db):
+    queue = TaskQueue(lambda task_ids: None, queue_settings())
+    add_task("uploaded-only", status=TaskStatus.QUEUED)
+    add_task("second", status=TaskStatus.QUEUED)
+    add_task("first", status=TaskStatus.QUEUED)
+    queue.enqueue("first")
+    queue.enqueue("second")
+
+    assert queue.claim() == "first"
+    assert queue.claim() == "second"
+    # 只上传未启动的任务不会被领取
+    assert queue.claim() is None
+
+    task = get_task("first")
+    assert task.status == TaskStatus.PROCESSING
+    assert task.worker_id == queue.worker_id
+    assert task.attempts == 1
+
+
+def test_recover_orphans_requeues_stale_processing(sync_db):
+    queue = TaskQueue(lambda task_ids: None, queue_settings(task_lease_seconds=30))
+    stale = datetime.utcnow() - timedelta(minutes=5)
+    add_task("orphan", status=TaskStatus.PROCESSING, queued_at=stale, heartbeat_at=stale, attempts=1)
+    add_task("alive", status=TaskStatus.PROCESSING, queued_at=stale, heartbeat_at=datetime.utcnow(), attempts=1)
+    add_task("exhausted", status=TaskStatus.PROCESSING, queued_at=stale, heartbeat_at=stale, attempts=3)
+
+    assert queue.recover_orphans() == 2
+
+    assert get_task("orphan").status == TaskStatus.QUEUED
+    assert get_task("alive").status == TaskStatus.PROCESSING
+    assert get_task("exhausted").status == TaskStatus.FAILED
+    assert queue.claim() == "orphan"
+
+
+def test_claim_batch_takes_oldest_up_to_limit(sync_db):
+    queue = TaskQueue(lambda task_ids: None, queue_settings())
+    for i in range(5):
+        add_task(f"b{i}", status=TaskStatus.QUEUED)
+    assert queue.enqueue_many([f"b{i}" for i in range(5)]) == []
+
+    first = queue.claim_batch(3)
+    assert len(first) == 3
+    assert sorted(queue.claim_batch(3)) == sorted(set(f"b{i}" for i in range(5)) - set(first))
+    assert queue.claim_batch(3) == []
+
+
+def test_enqueue_skips_processing_tasks(sync_db):
+    queue = TaskQueue(lambda task_ids: None, queue_settings())
+    add_task("idle", status=TaskStatus.CANCELLED)
+    add_task("running", status=TaskStatus.QUEUED)
+    queue.enqueue("running")
+    assert queue.claim() == "running"
+
+    # 已被领取的任务不能重新入队，否则会被第二个工作线程再次领取
+    assert queue.enqueue_many(["idle", "running", "missing"]) == ["running", "missing"]
+    assert not queue.enqueue("running")
+
+    running = get_task("running")
+    assert running.status == TaskStatus.PROCESSING and running.worker_id == queue.worker_id
+    assert get_task("idle").status == TaskStatus.QUEUED
+    assert queue.claim() == "idle"
+    assert queue.claim() is None
+
+
+def test_worker_hands_queued_tasks_over_as_one_batch(sync_db):
+    batches = []
+    done = threading.Event()
+
+    def handler(task_ids):
+        batches.append(list(task_ids))
+        done.set()
+
+    queue = TaskQueue(handler, queue_settings(inference_workers=1, inference_batch_size=4))
+    for i in range(4):
+        add_task(f"n{i}", status=TaskStatus.QUEUED)
+    queue.enqueue_many([f"n{i}" for i in range(4)])
+    queue.start()
+    try:
+        assert done.wait(5)
+    finally:
+        queue.stop()
+
+    assert len(batches) == 1 and sorted(batches[0]) == ["n0", "n1", "n2", "n3"]
+
+
+def test_workers_process_enqueued_tasks(sync_db):
+    handled = []
+    done = threading.Event()
+
+    def handler(task_ids):
+        handled.extend(task_ids)
+        with get_sync_session() as session:
+            for task_id in task_ids:
+                session.query(InferenceTask).filter_by(id=task_id).update({"status": TaskStatus.COMPLETED})
+        if len(handled) == 3:
+            done.set()
+
+    queue = TaskQueue(handler, queue_settings())
+    for i in range(3):
+        add_task(f"t{i}", status=TaskStatus.QUEUED)
+    queue.start()
+    try:
+        for i in range(3):
+            queue.enqueue(f"t{i}")
+        assert done.wait(5)
+    finally:
+        queue.stop()
+
+    assert sorted(handled) == ["t0", "t1", "t2"]
+    assert all(get_task(f"t{i}").status == TaskStatus.COMPLETED for i in range(3))
@@ -0,0 +1,81 @@
+import asyncio
+
+from fastapi import FastAPI
+from fastapi.testclient import TestClient
+from sqlalchemy import text
+
+from app.api import history as history_api
+from app.core.database import get_sync_session
+from app.models.task import InferenceTask, TaskStatus
+from app.services.inference import InferenceService
+
+
+def add_task(task_id, status):
+    with get_sync_session() as session:
+        session.add(InferenceTask(id=task_id, filename=f"{task_id}.nii.gz", original_path="x", status=status))
+
+
+def stored(task_id):
+    with get_sync_session() as session:
+        task = session.query(InferenceTask).filter_by(id=task_id).first()
+        return task.status, task.progress, task.message
+
+
+def test_processing_progress_is_buffered_until_flush(sync_db):
+    service = InferenceService()
+    add_task("t1", TaskStatus.QUEUED)
+
+    # 进入处理中: 立即写库
+    service._update_task_status("t1", TaskStatus.PROCESSING, progress=10, message="正在准备推理...")
+    assert stored("t1") == (TaskStatus.PROCESSING, 10, "正在准备推理...")
+
+    # 处理中的进度变化只写内存，读取时覆盖
+    service._update_task_status("t1", TaskStatus.PROCESSING, progress=40, message="正在执行分割推理...")
+    service._update_task_status("t1", TaskStatus.PROCESSING, progress=55, message="正在执行分割推理...")
+    assert stored("t1")[1] == 10
+    assert service.get_task("t1").progress == 55
+    assert asyncio.run(service.get_task_async("t1")).progress == 55
+
+    assert service.progress_buffer.flush() == 1
+    assert stored("t1")[1] == 55
+    assert service.progress_buffer.flush() == 0
+
+    # 终态立即写库并移出缓冲
+    service._update_task_status("t1", TaskStatus.COMPLETED, progress=100, message="分割完成")
+    assert stored("t1") == (TaskStatus.COMPLETED, 100, "分割完成")
+    assert service.progress_buffer.get("t1") is None
+
+
+def test_flush_skips_tasks_no_longer_processing(sync_db):
+    service = InferenceService()
+    add_task("t1", TaskStatus.QUEUED)
+    service._update_task_status("t1", TaskStatus.PROCESSING, progress=10, message="a")
+    service._update_task_status("t1", TaskStatus.PROCESSING, progress=60, message="b")
+
+    # 其它进程已把任务标记失败，迟到的进度不能覆盖
+    with get_sync_session() as session:
+        session.query(InferenceTask).filter_by(id="t1").update({"status": TaskStatus.FAILED, "progress": 0})
+    service.progress_buffer.flush()
+    assert stored("t1")[:2] == (TaskStatus.FAILED, 0)
+    assert service.get_task("t1").progress == 0
+
+
+def test_sqlite_uses_wal(sync_db):
+    with sync_db.connect() as conn:
+        assert conn.execute(text("PRAGMA journal_mode")).scalar() == "wal"
+
+
+def test_history_list_reads_through_async_engine(sync_db, monkeypatch):
+    service = InferenceService()
+    monkeypatch.setattr(history_api, "inference_service", service)
+    add_task("t1", TaskStatus.QUEUED)
+    add_task("t2", TaskStatus.QUEUED)
+    service._update_task_status("t2", TaskStatus.PROCESSING, progress=10)
+
+    app = FastAPI()
+    app.include_router(history_api.router, prefix="/api/v1")
+    response = TestClient(app).get("/api/v1/history")
+    assert response.status_code == 200
+    body = response.json()
+    assert body["total"] == 2
+    assert {r["id"]: r["status"] for r in body["records"]} == {"t1": "queued", "t2": "processing"}
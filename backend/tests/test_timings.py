@@ -0,0 +1,90 @@
+from datetime import datetime, timedelta
+
+from fastapi import FastAPI
+from fastapi.testclient import TestClient
+
+from app.api import metrics as metrics_api
+from app.core.database import get_sync_session
+from app.models.task import InferenceTask, TaskStageTiming
+from app.services.progress import ProgressTracker
+from app.services.timings import latency_percentiles, record_stage_timings
+
+
+def add_task(task_id):
+    with get_sync_session() as session:
+        session.add(InferenceTask(id=task_id, filename="case.nii.gz", original_path="x"))
+
+
+def test_latency_percentiles_per_stage_within_window(sync_db):
+    add_task("t")
+    for seconds in range(1, 101):
+        record_stage_timings("t", {"inference": float(seconds), "stats": 0.5})
+    # 窗口之外的样本不参与统计
+    with get_sync_session() as session:
+        session.add(TaskStageTiming(task_id="t", stage="inference", duration=1000.0,
+                                    recorded_at=datetime.utcnow() - timedelta(days=2)))
+
+    rows = latency_percentiles(datetime.utcnow() - timedelta(hours=1))
+
+    assert [r["stage"] for r in rows] == ["inference", "stats"]
+    inference = rows[0]
+    assert inference["count"] == 100
+    assert (inference["p50"], inference["p95"], inference["p99"], inference["max"]) == (50.0, 95.0, 99.0, 100.0)
+    assert inference["mean"] == 50.5
+    assert rows[1]["p99"] == 0.5
+
+
+def test_latency_endpoint(sync_db):
+    add_task("t")
+    record_stage_timings("t", {"queue_wait": 2.0, "upload": 1.0})
+    app = FastAPI()
+    app.include_router(metrics_api.router)
+
+    body = TestClient(app).get("/metrics/latency", params={"hours": 1}).json()
+
+    # 按流水线顺序返回
+    assert [s["stage"] for s in body["stages"]] == ["upload", "queue_wait"]
+    assert body["stages"][1]["p50"] == 2.0
+
+
+def test_tracker_splits_batch_timings_per_case():
+    now = [0.0]
+    tracker = ProgressTracker(["a", "b"], lambda *args: None, clock=lambda: now[0])
+
+    def at(t, **event):
+        now[0] = t
+        tracker(event)
+
+    at(4.0, stage="preprocess", case="a")  # 模型加载 4s，两例均摊
+    at(5.0, stage="predict", case="a", tile=0, num_tiles=2)  # 等待 a 预处理 1s
+    at(9.0, stage="export", case="a")
+    at(10.0, stage="exported", case="a")
+    at(12.0, stage="predict", case="b", tile=0, num_tiles=2)  # b 的预处理让推理循环多等了 3s
+    at(15.0, stage="export", case="b")
+    at(16.0, stage="exported", case="b")
+    at(16.0, stage="postprocess")
+    at(18.0, stage="done")
+
+    assert tracker.timings["a"] == {
+        "model_load": 2.0, "preprocess": 1.0, "inference": 4.0, "export": 1.0, "postprocess": 1.0,
+    }
+    assert tracker.timings["b"] == {
+        "model_load": 2.0, "preprocess": 3.0, "inference": 3.0, "export": 1.0, "postprocess": 1.0,
+    }
+
+
+def test_tracker_separates_lock_wait_from_model_load():
+    now = [0.0]
+    tracker = ProgressTracker(["a", "b"], lambda *args: None, clock=lambda: now[0])
+
+    def at(t, **event):
+        now[0] = t
+        tracker(event)
+
+    at(2.0, stage="queued")  # 拉起并连接推理服务 2s
+    at(7.0, stage="queued")  # 心跳
+    at(10.0, stage="started")  # 等待其它提交 8s
+    at(11.0, stage="predict", case="a", tile=0, num_tiles=2)
+
+    assert tracker.timings["a"] == {"model_load": 1.0, "lock_wait": 4.0, "preprocess": 1.0}
+    assert tracker.timings["b"] == {"model_load": 1.0, "lock_wait": 4.0}
@@ -1,15 +1,17 @@
 import { http } from './index'
-import type { HistoryListResponse, HistoryRecord } from './types'
+import type { HistoryListResponse, HistoryQuery, HistoryRecord } from './types'
 
 /**
  * 获取历史记录列表
+ * query.cursor 为上一页返回的 nextCursor，传入时忽略 page
  */
 export function getHistoryList(
   page: number = 1,
-  pageSize: number = 20
+  pageSize: number = 20,
+  query: HistoryQuery = {}
 ): Promise<HistoryListResponse> {
   return http.get('/history', {
-    params: { page, pageSize },
+    params: { page, pageSize, ...query },
   })
 }
 
@@ -4,7 +4,7 @@ import type {
   InferenceStatusResponse,
   InferenceResultResponse,
 } from './types'
-import { UPLOAD_TIMEOUT_MS } from '@/utils/constants'
+import { API_BASE_URL, UPLOAD_TIMEOUT_MS } from '@/utils/constants'
 
 /**
  * 上传文件（不立即开始推理）
@@ -63,6 +63,23 @@ export function getInferenceStatus(taskId: string): Promise<InferenceStatusRespo
   return http.get(`/inference/${taskId}/status`)
 }
 
+/**
+ * 订阅推理状态推送 (Server-Sent Events)
+ * 返回 EventSource，调用方负责 close()
+ */
+export function subscribeInferenceEvents(
+  taskId: string,
+  onStatus: (status: InferenceStatusResponse) => void,
+  onError: (event: Event) => void
+): EventSource {
+  const source = new EventSource(`${API_BASE_URL}/inference/${taskId}/events`)
+  source.addEventListener('status', (event) => {
+    onStatus(JSON.parse((event as MessageEvent).data))
+  })
+  source.onerror = onError
+  return source
+}
+
 /**
  * 获取推理结果
  */
@@ -71,7 +88,14 @@ export function getInferenceResult(taskId: string): Promise<InferenceResultRespo
 }
 
 /**
- * 取消推理任务
+ * 取消排队中/处理中的推理任务 (保留上传文件，可重试)
+ */
+export function cancelInferenceTask(taskId: string): Promise<InferenceStatusResponse> {
+  return http.post(`/inference/${taskId}/cancel`)
+}
+
+/**
+ * 删除推理任务 (处理中的推理会先中止)
  */
 export function cancelInference(taskId: string): Promise<void> {
   return http.delete(`/inference/${taskId}`)
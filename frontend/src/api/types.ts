@@ -14,16 +14,27 @@ export interface InferenceStartResponse {
   estimatedTime: number
 }
 
+export interface LesionInfo {
+  volume: number           // mm³
+  voxels: number
+  bbox: number[][]         // 体素下标 [[start, stop], ...]
+  side?: 'left' | 'right'
+}
+
 export interface StatsInfo {
   kidneyVolume?: number    // mm³
   tumorVolume?: number     // mm³
   processingTime?: number  // seconds
+  kidneyLeftVolume?: number   // mm³，不含肿瘤
+  kidneyRightVolume?: number  // mm³，不含肿瘤
+  tumorCount?: number
+  lesions?: LesionInfo[]
 }
 
 // 推理状态响应
 export interface InferenceStatusResponse {
   taskId: string
-  status: 'queued' | 'processing' | 'completed' | 'failed'
+  status: 'queued' | 'processing' | 'completed' | 'failed' | 'cancelled'
   progress: number
   message?: string
 }
@@ -32,7 +43,10 @@ export interface InferenceStatusResponse {
 export interface InferenceResultResponse {
   taskId: string
   originalUrl: string
-  segmentationUrl: string
+  /** 分割结果已回收时为空 */
+  segmentationUrl: string | null
+  /** 分割结果已按存储预算回收，只能查看原始影像，重新推理可再次生成 */
+  segmentationEvicted?: boolean
   stats: StatsInfo
 }
 
@@ -41,10 +55,11 @@ export interface HistoryRecord {
   id: string
   filename: string
   uploadTime: string
-  status: 'queued' | 'processing' | 'completed' | 'failed'
+  status: 'queued' | 'processing' | 'completed' | 'failed' | 'cancelled'
   stats?: StatsInfo
   originalUrl: string
-  segmentationUrl: string
+  segmentationUrl: string | null
+  segmentationEvicted?: boolean
   thumbnailUrl?: string
 }
 
@@ -52,4 +67,17 @@ export interface HistoryRecord {
 export interface HistoryListResponse {
   total: number
   records: HistoryRecord[]
+  /** 下一页游标，没有更多记录时为空 */
+  nextCursor?: string | null
+}
+
+// 历史记录查询参数
+export interface HistoryQuery {
+  cursor?: string
+  status?: 'queued' | 'processing' | 'completed' | 'failed' | 'cancelled'
+  createdFrom?: string
+  createdTo?: string
+  filename?: string
+  minTumorVolume?: number
+  maxTumorVolume?: number
 }
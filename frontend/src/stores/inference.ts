@@ -9,8 +9,9 @@ import {
   getInferenceStatus,
   getInferenceResult,
   cancelInference as apiCancelInference,
+  subscribeInferenceEvents,
 } from '@/api/inference'
-import type { InferenceResultResponse } from '@/api/types'
+import type { InferenceResultResponse, InferenceStatusResponse } from '@/api/types'
 
 export const useInferenceStore = defineStore('inference', () => {
   // 状态
@@ -55,7 +56,8 @@ export const useInferenceStore = defineStore('inference', () => {
     }
   })
 
-  // 轮询定时器
+  // 状态推送连接 / 轮询定时器 (SSE 不可用时回退)
+  let eventSource: EventSource | null = null
   let pollTimer: ReturnType<typeof setInterval> | null = null
   let elapsedTimer: ReturnType<typeof setInterval> | null = null
 
@@ -120,10 +122,11 @@ export const useInferenceStore = defineStore('inference', () => {
       status.value = INFERENCE_STATUS.QUEUED
       error.value = null
       result.value = null
-      startPolling()
       startElapsedTimer(false)
       statusMessage.value = '排队中...'
       await apiStartInferenceTask(taskId.value)
+      // 任务重置后再订阅，避免收到上一轮的结束状态
+      startPolling()
     } catch (e: any) {
       status.value = INFERENCE_STATUS.FAILED
       error.value = e.message || '启动推理失败'
@@ -147,9 +150,9 @@ export const useInferenceStore = defineStore('inference', () => {
       result.value = null
       error.value = null
       statusMessage.value = '重新排队中...'
-      startPolling()
       startElapsedTimer()
       await apiRetryInferenceTask(taskId.value)
+      startPolling()
     } catch (e: any) {
       status.value = INFERENCE_STATUS.FAILED
       error.value = e.message || '重试推理失败'
@@ -160,34 +163,69 @@ export const useInferenceStore = defineStore('inference', () => {
     }
   }
 
-  // 轮询状态
+  // 处理一次状态更新 (推送和轮询共用)
+  async function applyStatus(statusResponse: InferenceStatusResponse) {
+    progress.value = statusResponse.progress
+    statusMessage.value = statusResponse.message || fallbackMessages[statusResponse.status as InferenceStatus]
+
+    if (statusResponse.status === 'processing') {
+      status.value = INFERENCE_STATUS.PROCESSING
+    } else if (statusResponse.status === 'completed') {
+      stopPolling()
+      stopElapsedTimer()
+      status.value = INFERENCE_STATUS.COMPLETED
+      statusMessage.value = statusResponse.message || '分割完成'
+      // 获取结果
+      result.value = await getInferenceResult(statusResponse.taskId)
+    } else if (statusResponse.status === 'failed' || statusResponse.status === 'cancelled') {
+      // 已取消的任务同样结束等待，可以重试
+      stopPolling()
+      stopElapsedTimer()
+      status.value = INFERENCE_STATUS.FAILED
+      error.value = statusResponse.message || (statusResponse.status === 'cancelled' ? '已取消' : '推理失败')
+      statusMessage.value = error.value
+    }
+  }
+
+  // 订阅状态推送，连接失败时回退到轮询
   function startPolling() {
+    stopPolling()
+    if (!taskId.value) return
+
+    if (typeof EventSource === 'undefined') {
+      startIntervalPolling()
+      return
+    }
+
+    const currentTaskId = taskId.value
+    eventSource = subscribeInferenceEvents(
+      currentTaskId,
+      (statusResponse) => {
+        if (taskId.value !== currentTaskId) return
+        applyStatus(statusResponse).catch((e) => console.error('Status update error:', e))
+      },
+      () => {
+        // 服务端在任务结束后主动关闭连接也会触发 error，此时已无需轮询
+        if (!eventSource || !processingStatuses.includes(status.value)) {
+          stopPolling()
+          return
+        }
+        console.warn('SSE unavailable, falling back to polling')
+        eventSource.close()
+        eventSource = null
+        startIntervalPolling()
+      }
+    )
+  }
+
+  function startIntervalPolling() {
     if (pollTimer) clearInterval(pollTimer)
 
     pollTimer = setInterval(async () => {
       if (!taskId.value) return
 
       try {
-        const statusResponse = await getInferenceStatus(taskId.value)
-        progress.value = statusResponse.progress
-        statusMessage.value = statusResponse.message || fallbackMessages[statusResponse.status as InferenceStatus]
-
-        if (statusResponse.status === 'processing') {
-          status.value = INFERENCE_STATUS.PROCESSING
-        } else if (statusResponse.status === 'completed') {
-          stopPolling()
-          stopElapsedTimer()
-          status.value = INFERENCE_STATUS.COMPLETED
-          statusMessage.value = statusResponse.message || '分割完成'
-          // 获取结果
-          result.value = await getInferenceResult(taskId.value)
-        } else if (statusResponse.status === 'failed') {
-          stopPolling()
-          stopElapsedTimer()
-          status.value = INFERENCE_STATUS.FAILED
-          error.value = statusResponse.message || '推理失败'
-          statusMessage.value = error.value
-        }
+        await applyStatus(await getInferenceStatus(taskId.value))
       } catch (e: any) {
         console.error('Poll error:', e)
       }
@@ -195,6 +233,10 @@ export const useInferenceStore = defineStore('inference', () => {
   }
 
   function stopPolling() {
+    if (eventSource) {
+      eventSource.close()
+      eventSource = null
+    }
     if (pollTimer) {
       clearInterval(pollTimer)
       pollTimer = null
@@ -84,12 +84,12 @@ export const useViewerStore = defineStore('viewer', () => {
     return buffer.buffer
   }
 
-  // 渐进式加载：先预览后高清
-  async function loadCase(originalUrl: string, segmentationUrl: string) {
+  // 渐进式加载：先预览后高清；segmentationUrl 为空 (分割已回收) 时只加载原始影像
+  async function loadCase(originalUrl: string, segmentationUrl: string | null) {
     if (!nv.value) throw new Error('NiiVue not initialized')
     isLoading.value = true
     loadError.value = null
-    downloadProgress.value = { original: 0, segmentation: 0 }
+    downloadProgress.value = { original: 0, segmentation: segmentationUrl ? 0 : 100 }
     isPreviewMode.value = false
     isLoadingFullRes.value = false
 
@@ -100,23 +100,25 @@ export const useViewerStore = defineStore('viewer', () => {
     try {
       // 构建预览 URL（添加 preview=true 参数）
       const previewOriginalUrl = `${originalUrl}${originalUrl.includes('?') ? '&' : '?'}preview=true&factor=4`
-      const previewSegUrl = `${segmentationUrl}${segmentationUrl.includes('?') ? '&' : '?'}preview=true&factor=4`
+      const previewSegUrl = segmentationUrl
+        ? `${segmentationUrl}${segmentationUrl.includes('?') ? '&' : '?'}preview=true&factor=4`
+        : null
 
       // 第一阶段：快速加载预览版本
       console.log('加载预览版本...')
       const [previewOrigBuffer, previewSegBuffer] = await Promise.all([
         fetchNiftiWithProgress(previewOriginalUrl, 'original'),
-        fetchNiftiWithProgress(previewSegUrl, 'segmentation'),
+        previewSegUrl ? fetchNiftiWithProgress(previewSegUrl, 'segmentation') : Promise.resolve(null),
       ])
 
       const previewOrigUrlObj = URL.createObjectURL(new Blob([previewOrigBuffer]))
-      const previewSegUrlObj = URL.createObjectURL(new Blob([previewSegBuffer]))
-      objectUrls.value = [previewOrigUrlObj, previewSegUrlObj]
-
-      const previewVolumes: any[] = [
-        { url: previewOrigUrlObj },
-        { url: previewSegUrlObj, colormap: 'actc', opacity: overlayOpacity.value },
-      ]
+      objectUrls.value = [previewOrigUrlObj]
+      const previewVolumes: any[] = [{ url: previewOrigUrlObj }]
+      if (previewSegBuffer) {
+        const previewSegUrlObj = URL.createObjectURL(new Blob([previewSegBuffer]))
+        objectUrls.value.push(previewSegUrlObj)
+        previewVolumes.push({ url: previewSegUrlObj, colormap: 'actc', opacity: overlayOpacity.value })
+      }
 
       await nv.value.loadVolumes(previewVolumes)
       isPreviewMode.value = true
@@ -144,21 +146,19 @@ export const useViewerStore = defineStore('viewer', () => {
 
       const [fullOrigBuffer, fullSegBuffer] = await Promise.all([
         fetchNiftiWithProgress(originalUrl, 'original'),
-        fetchNiftiWithProgress(segmentationUrl, 'segmentation'),
+        segmentationUrl ? fetchNiftiWithProgress(segmentationUrl, 'segmentation') : Promise.resolve(null),
       ])
 
-      // 创建新的 Blob URLs
-      const fullOrigUrlObj = URL.createObjectURL(new Blob([fullOrigBuffer]))
-      const fullSegUrlObj = URL.createObjectURL(new Blob([fullSegBuffer]))
-
-      // 清理预览版本的 URLs
+      // 清理预览版本的 URLs，创建新的 Blob URLs
       objectUrls.value.forEach((u) => URL.revokeObjectURL(u))
-      objectUrls.value = [fullOrigUrlObj, fullSegUrlObj]
-
-      const fullVolumes: any[] = [
-        { url: fullOrigUrlObj },
-        { url: fullSegUrlObj, colormap: 'actc', opacity: overlayOpacity.value },
-      ]
+      const fullOrigUrlObj = URL.createObjectURL(new Blob([fullOrigBuffer]))
+      objectUrls.value = [fullOrigUrlObj]
+      const fullVolumes: any[] = [{ url: fullOrigUrlObj }]
+      if (fullSegBuffer) {
+        const fullSegUrlObj = URL.createObjectURL(new Blob([fullSegBuffer]))
+        objectUrls.value.push(fullSegUrlObj)
+        fullVolumes.push({ url: fullSegUrlObj, colormap: 'actc', opacity: overlayOpacity.value })
+      }
 
       // 替换为高分辨率版本
       await nv.value.loadVolumes(fullVolumes)
@@ -18,6 +18,8 @@ from skimage.transform import resize #########
 
 import argparse
 import os
+import shutil
+import tempfile
 
 from batchgenerators.utilities.file_and_folder_operations import join, isdir
 
@@ -25,9 +27,10 @@ from mindspore import context
 from mindspore.communication import init
 from mindspore.context import ParallelMode
 
-from src.nnunet.inference.predict import predict_from_folder
+from src.nnunet.inference.predict import predict_from_folder, stage_input_files
 from src.nnunet.paths import default_plans_identifier, network_training_output_dir, default_cascade_trainer, \
     default_trainer
+from src.nnunet.utilities.progress import json_lines_writer, set_progress_callback
 from src.nnunet.utilities.task_name_id_conversion import convert_id_to_task_name
 
 def do_eval(parser):
@@ -54,8 +57,19 @@ def do_eval(parser):
         print(f"Single GPU inference on device: {device_id}")
     args = parser.parse_args()
 
-    check(args) ##### 修改
+    if args.progress_json:
+        set_progress_callback(json_lines_writer())
 
+    staging_dir = check(args) ##### 修改
+    try:
+        run_eval(args)
+    finally:
+        if staging_dir is not None:
+            shutil.rmtree(staging_dir, ignore_errors=True)
+
+
+def run_eval(args):
+    """prediction with the (staged) input folder"""
     input_folder = args.input_folder
     output_folder = args.output_folder
     part_id = args.part_id
@@ -122,6 +136,9 @@ def do_eval(parser):
                         overwrite_existing=overwrite_existing, mode=mode, overwrite_all_in_gpu=all_in_gpu,
                         mixed_precision=not args.disable_mixed_precision,
                         step_size=step_size, checkpoint_name=args.chk,
+                        tile_batch_size=args.tile_batch_size, tta_mirror_axes=args.tta_axes,
+                        device_aggregation_mb=args.device_aggregation_mb,
+                        skip_background_tiles=not args.disable_tile_skipping,
                         )
     # 重命名输出 'Segmentation_*'
     if args.final_submit:
@@ -173,27 +190,45 @@ def main():
     parser.add_argument("--final_submit", type=bool, required=False,
                         default=True,
                         help="whether final_submit segmentation")
+    parser.add_argument("--staging_dir", required=False, default=None,
+                        help="folder where the _0000 input aliases are created. Default: a private temporary "
+                             "folder per invocation that is removed afterwards, so parallel runs never collide")
+    parser.add_argument("--progress_json", required=False, default=False, action="store_true",
+                        help="print progress events (preprocess / tiles / export) as JSON lines on stdout")
+    parser.add_argument("--tile_batch_size", type=int, required=False, default=0,
+                        help="sliding window tiles per forward pass. Default 0: pick from the patch size")
+    parser.add_argument("--tta_axes", type=int, nargs='+', required=False, default=None,
+                        help="only mirror along these axes (0 1 2) for test time augmentation. Default: all axes the "
+                             "model was trained with. Each axis doubles the network evaluations per tile")
+    parser.add_argument("--device_aggregation_mb", type=int, required=False, default=None,
+                        help="device memory (MB) for aggregating the sliding window predictions on the device. Larger "
+                             "volumes are aggregated on the host. 0: always on the host. Default: 2048")
+    parser.add_argument("--disable_tile_skipping", required=False, default=False, action="store_true",
+                        help="predict every sliding window tile. By default tiles outside a low resolution body mask "
+                             "(air, table) are skipped and their voxels are set to background")
     do_eval(parser)
 
 
 def check(args):
+    """
+    alias the inputs as CASE_0000.nii.gz (symlinks, nothing is copied) in a staging folder owned by this
+    invocation instead of the shared ./temp_input_folder. Returns the folder to remove afterwards, or None
+    when --staging_dir was given by the caller.
+    """
     import glob
-    import shutil
-    temp_input_folder ='./temp_input_folder'
-    if os.path.exists(temp_input_folder):
-        temp_files = glob.glob(os.path.join(temp_input_folder, '*.nii.gz'))
-        for temp in temp_files:
+    if args.staging_dir:
+        temp_input_folder = args.staging_dir
+        for temp in glob.glob(os.path.join(temp_input_folder, '*.nii.gz')):
             os.remove(temp)
-    os.makedirs(temp_input_folder, exist_ok=True)
+        owned = None
+    else:
+        temp_input_folder = tempfile.mkdtemp(prefix='temp_input_')
+        owned = temp_input_folder
     input_files = glob.glob(os.path.join(args.input_folder, '*.nii.gz'))
-    for i in input_files:
-        basename = os.path.basename(i)
-        if not i.endswith('_0000.nii.gz'):
-            shutil.copy(i, os.path.join(temp_input_folder, basename.replace('.nii.gz', '_0000.nii.gz')))
-        else:
-            shutil.copy(i, os.path.join(temp_input_folder, basename))
+    stage_input_files(input_files, temp_input_folder)
 
     args.input_folder = temp_input_folder
+    return owned
 
 def rename_output_filers(args):
     files = os.listdir(args.output_folder)
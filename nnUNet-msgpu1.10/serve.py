@@ -0,0 +1,300 @@
+"""
+常驻推理服务
+
+eval.py 每个任务都要重新启动解释器、导入 MindSpore、restore_model 并 load_checkpoint。
+这里把 trainer、编译后的网络以及各 fold 的参数常驻在一个进程里，通过 Unix socket
+接收病例，协议为逐行 JSON:
+
+    -> {"cmd": "predict", "cases": [{"input_files": [".../case_0000.nii.gz"], "output_file": ".../case.nii.gz"}]}
+    <- {"event": "progress", "stage": "queued"}  (受理后立即发送，等待 predict_lock 期间每隔几秒重复一次)
+    <- {"event": "progress", "stage": "started"}  (拿到 predict_lock，开始处理本次提交)
+    <- {"event": "progress", "stage": "predict", "case": "case", "tile": 3, "num_tiles": 96, ...}  (零或多行)
+    <- {"ok": true, "elapsed": 12.3}
+
+客户端据 queued 心跳判断服务仍然存活，并从 started 起计算推理超时。
+
+其它命令: ping / shutdown / cancel。cancel 在另一个连接上发送:
+
+    -> {"cmd": "cancel", "cases": ["case"]}
+
+被取消的病例在滑窗的下一个 tile 处停止，不再导出结果，同一批的其它病例继续推理。
+只接受正在推理或排队等待推理的病例，其它病例的取消请求直接丢弃 (响应中的 cancelled 为实际接受的病例)，
+避免迟到的取消请求影响之后以同一 ID 重新提交的病例。
+--stand_in 使用 CPU 替身模型，无需 GPU 和 MindSpore，便于测试。
+"""
+import argparse
+import collections
+import json
+import os
+import socketserver
+import threading
+import time
+
+from src.nnunet.utilities.progress import PROGRESS_EVENT, PredictionCancelled, check_cancelled, report_progress, \
+    request_cancel, reset_cancel, set_progress_callback, set_progress_context
+
+
+# 等待 predict_lock 时重复发送 queued 的间隔 (秒)
+QUEUE_HEARTBEAT_INTERVAL = 5.0
+
+
+def case_id_of(case):
+    return os.path.basename(case["output_file"])[:-len(".nii.gz")]
+
+
+class StandInPredictor:
+    """CPU 替身模型: 按 HU 阈值生成标签，只用于联调和测试，结果没有临床意义"""
+
+    name = "stand_in"
+
+    def __init__(self, delay: float = 0.0):
+        self.delay = delay
+
+    def predict(self, cases):
+        import nibabel as nib
+        import numpy as np
+
+        for index, case in enumerate(cases):
+            case_id = case_id_of(case)
+            set_progress_context(case=case_id, index=index, num_cases=len(cases), fold=0, num_folds=1)
+            report_progress("predict", tile=0, num_tiles=1)
+            nii = nib.load(case["input_files"][0])
+            data = np.asanyarray(nii.dataobj)
+            seg = np.zeros(data.shape, dtype=np.uint8)
+            seg[(data > 100) & (data <= 300)] = 1  # 肾脏
+            seg[data > 300] = 2  # 肿瘤
+            try:
+                # 模拟逐 tile 推理: 分段等待，每段之后检查取消
+                deadline = time.time() + self.delay
+                while True:
+                    check_cancelled()
+                    remaining = deadline - time.time()
+                    if remaining <= 0:
+                        break
+                    time.sleep(min(remaining, 0.05))
+            except PredictionCancelled:
+                set_progress_context(num_cases=len(cases))
+                report_progress("cancelled", case=case_id)
+                continue
+            report_progress("predict", tile=1, num_tiles=1)
+            report_progress("export", case=case_id)
+            out = nib.Nifti1Image(seg, nii.affine, nii.header)
+            out.set_data_dtype(np.uint8)
+            nib.save(out, case["output_file"])
+            report_progress("exported", case=case_id)
+        set_progress_context()
+        report_progress("done")
+
+
+class NnUNetPredictor:
+    """常驻的 nnU-Net 模型，初始化时调用一次 load_model_and_checkpoint_files"""
+
+    name = "nnunet"
+
+    def __init__(self, model_folder, folds, checkpoint_name, do_tta=False, step_size=0.5,
+                 mixed_precision=True, num_threads_preprocessing=6, num_threads_nifti_save=2,
+                 device_target="GPU", device_id=0, tile_batch_size=0, tta_mirror_axes=None,
+                 device_aggregation_mb=None, skip_background_tiles=True):
+        from mindspore import context
+        from src.nnunet.training.model_restore import load_model_and_checkpoint_files
+
+        context.set_context(mode=context.GRAPH_MODE, device_target=device_target, device_id=device_id,
+                            save_graphs=False)
+
+        self.model_folder = model_folder
+        self.do_tta = do_tta
+        self.step_size = step_size
+        self.mixed_precision = mixed_precision
+        self.num_threads_preprocessing = num_threads_preprocessing
+        self.num_threads_nifti_save = num_threads_nifti_save
+        self.tile_batch_size = tile_batch_size
+        self.tta_mirror_axes = tta_mirror_axes
+        self.device_aggregation_mb = device_aggregation_mb
+        self.skip_background_tiles = skip_background_tiles
+        self.trainer, self.params = load_model_and_checkpoint_files(model_folder, folds,
+                                                                    mixed_precision=mixed_precision,
+                                                                    checkpoint_name=checkpoint_name)
+
+    def predict(self, cases):
+        from src.nnunet.inference.predict import predict_cases_preloaded
+
+        for case in cases:
+            os.makedirs(os.path.dirname(case["output_file"]), exist_ok=True)
+        predict_cases_preloaded(self.trainer, self.params, self.model_folder,
+                                [case["input_files"] for case in cases],
+                                [case["output_file"] for case in cases],
+                                False, self.num_threads_preprocessing, self.num_threads_nifti_save,
+                                do_tta=self.do_tta, mixed_precision=self.mixed_precision,
+                                step_size=self.step_size, tile_batch_size=self.tile_batch_size,
+                                tta_mirror_axes=self.tta_mirror_axes,
+                                device_aggregation_mb=self.device_aggregation_mb,
+                                skip_background_tiles=self.skip_background_tiles)
+
+
+class ModelServer(socketserver.ThreadingMixIn, socketserver.UnixStreamServer):
+    """每个连接一个线程，predict 用锁串行化，保证设备上同时只跑一个病例"""
+
+    daemon_threads = True
+
+    def __init__(self, socket_path, predictor):
+        if os.path.exists(socket_path):
+            os.unlink(socket_path)
+        self.socket_path = socket_path
+        self.predictor = predictor
+        self.predict_lock = threading.Lock()
+        # 正在推理或等待 predict_lock 的病例 (同一病例可能被重复提交，按次数计)
+        self.active_cases = collections.Counter()
+        self.active_lock = threading.Lock()
+        super().__init__(socket_path, ModelRequestHandler)
+
+    def _enter_cases(self, case_ids):
+        """登记本次提交的病例，并清除之前遗留的取消标记"""
+        with self.active_lock:
+            reset_cancel(case_ids)
+            self.active_cases.update(case_ids)
+
+    def _leave_cases(self, case_ids):
+        """注销病例，不再有提交引用的病例清除取消标记"""
+        with self.active_lock:
+            self.active_cases.subtract(case_ids)
+            finished = [case_id for case_id in set(case_ids) if self.active_cases[case_id] <= 0]
+            for case_id in finished:
+                del self.active_cases[case_id]
+            reset_cancel(finished)
+
+    def _acquire_predict_lock(self, send):
+        """等待其它提交推理完成，期间定时发送 queued"""
+        while True:
+            if send is not None:
+                send({"event": PROGRESS_EVENT, "stage": "queued"})
+            if self.predict_lock.acquire(timeout=QUEUE_HEARTBEAT_INTERVAL):
+                return
+
+    def dispatch(self, request, send=None):
+        """send: 可选，向当前连接写一行 JSON，用于在最终响应前推送进度"""
+        cmd = request.get("cmd")
+        if cmd == "ping":
+            return {"ok": True, "pid": os.getpid(), "predictor": self.predictor.name}
+        if cmd == "predict":
+            start = time.time()
+            try:
+                case_ids = [case_id_of(case) for case in request["cases"]]
+                self._enter_cases(case_ids)
+                try:
+                    self._acquire_predict_lock(send)
+                    try:
+                        if send is not None:
+                            send({"event": PROGRESS_EVENT, "stage": "started"})
+                            set_progress_callback(lambda event: send(dict(event, event=PROGRESS_EVENT)))
+                        try:
+                            self.predictor.predict(request["cases"])
+                        finally:
+                            set_progress_callback(None)
+                    finally:
+                        self.predict_lock.release()
+                finally:
+                    self._leave_cases(case_ids)
+            except Exception as e:
+                print(f"predict failed: {e}", flush=True)
+                return {"ok": False, "error": str(e)}
+            return {"ok": True, "elapsed": time.time() - start}
+        if cmd == "cancel":
+            # 不拿 predict_lock: 正在推理的病例在下一个 tile 处停止，排队中的病例开始时即跳过
+            with self.active_lock:
+                cancelled = [case_id for case_id in request.get("cases", []) if self.active_cases[case_id] > 0]
+                for case_id in cancelled:
+                    request_cancel(case_id)
+            return {"ok": True, "cancelled": cancelled}
+        if cmd == "shutdown":
+            threading.Thread(target=self.shutdown, daemon=True).start()
+            return {"ok": True}
+        return {"ok": False, "error": f"unknown cmd: {cmd}"}
+
+    def server_close(self):
+        super().server_close()
+        if os.path.exists(self.socket_path):
+            os.unlink(self.socket_path)
+
+
+class ModelRequestHandler(socketserver.StreamRequestHandler):
+    def handle(self):
+        for line in self.rfile:
+            if not line.strip():
+                continue
+            try:
+                response = self.server.dispatch(json.loads(line), send=self.send)
+            except ValueError as e:
+                response = {"ok": False, "error": f"bad request: {e}"}
+            self.send(response)
+
+    def send(self, message):
+        self.wfile.write((json.dumps(message) + "\n").encode("utf-8"))
+        self.wfile.flush()
+
+
+def build_predictor(args):
+    if args.stand_in:
+        return StandInPredictor(delay=args.stand_in_delay)
+
+    from batchgenerators.utilities.file_and_folder_operations import join, isdir
+    from src.nnunet.paths import network_training_output_dir
+
+    model_folder_name = join(network_training_output_dir, args.model, args.task_name,
+                             args.trainer_class_name + "__" + args.plans_identifier)
+    assert isdir(model_folder_name), "model output folder not found. Expected: %s" % model_folder_name
+    folds = args.folds
+    if folds == ["all"]:
+        pass
+    elif folds == "None":
+        folds = None
+    else:
+        folds = [int(i) for i in folds]
+    return NnUNetPredictor(model_folder_name, folds, args.chk, do_tta=not args.disable_tta,
+                           step_size=args.step_size, mixed_precision=not args.disable_mixed_precision,
+                           num_threads_preprocessing=args.num_threads_preprocessing,
+                           num_threads_nifti_save=args.num_threads_nifti_save,
+                           device_target=args.device_target, device_id=int(os.getenv('DEVICE_ID', 0)),
+                           tile_batch_size=args.tile_batch_size, tta_mirror_axes=args.tta_axes,
+                           device_aggregation_mb=args.device_aggregation_mb,
+                           skip_background_tiles=not args.disable_tile_skipping)
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--socket", required=True, help="Unix socket path to listen on")
+    parser.add_argument('-t', '--task_name', default="Task001_kits")
+    parser.add_argument('-tr', '--trainer_class_name', default="nnUNetTrainerV2")
+    parser.add_argument('-m', '--model', default="3d_fullres")
+    parser.add_argument('-p', '--plans_identifier', default="nnUNetPlansv2.1")
+    parser.add_argument('-f', '--folds', nargs='+', default='None')
+    parser.add_argument('-chk', default='model_best', help='checkpoint name, default: model_best')
+    parser.add_argument("--num_threads_preprocessing", default=6, type=int)
+    parser.add_argument("--num_threads_nifti_save", default=2, type=int)
+    parser.add_argument("--disable_tta", default=False, action="store_true")
+    parser.add_argument("--tta_axes", type=int, nargs="+", default=None,
+                        help="only mirror along these axes for test time augmentation, default: all trained axes")
+    parser.add_argument("--device_aggregation_mb", type=int, default=None,
+                        help="device memory (MB) for aggregating on the device, 0: on the host, default: 2048")
+    parser.add_argument("--disable_tile_skipping", default=False, action="store_true",
+                        help="predict every sliding window tile instead of skipping tiles outside the body mask")
+    parser.add_argument("--step_size", type=float, default=0.5)
+    parser.add_argument("--tile_batch_size", type=int, default=0,
+                        help="sliding window tiles per forward pass, 0: pick from the patch size")
+    parser.add_argument('--disable_mixed_precision', default=False, action='store_true')
+    parser.add_argument("--device_target", default="GPU")
+    parser.add_argument("--stand_in", default=False, action="store_true",
+                        help="use the CPU stand-in model instead of nnU-Net (no GPU / MindSpore needed)")
+    parser.add_argument("--stand_in_delay", type=float, default=0.0, help="seconds the stand-in sleeps per case")
+    args = parser.parse_args()
+
+    predictor = build_predictor(args)
+    server = ModelServer(args.socket, predictor)
+    print(f"model server ({predictor.name}) listening on {args.socket}", flush=True)
+    try:
+        server.serve_forever()
+    finally:
+        server.server_close()
+
+
+if __name__ == "__main__":
+    main()
@@ -16,6 +16,7 @@
 """inference predict"""
 
 import shutil
+import tempfile
 from copy import deepcopy
 from multiprocessing import Pool, Process, Queue
 from multiprocessing.pool import ThreadPool
@@ -32,6 +33,8 @@ from src.nnunet.postprocessing.connected_components import load_remove_save, loa
 from src.nnunet.training.model_restore import load_model_and_checkpoint_files
 from src.nnunet.training.network_training.nnUNetTrainer import nnUNetTrainer
 from src.nnunet.utilities.one_hot_encoding import to_one_hot
+from src.nnunet.utilities.progress import PredictionCancelled, check_cancelled, report_progress, \
+    set_progress_context
 
 
 def _get_pool(num_processes: int):
@@ -46,6 +49,20 @@ def _get_pool(num_processes: int):
     except PermissionError as exc:
         print(f"PermissionError creating multiprocessing Pool, using ThreadPool instead: {exc}")
         return ThreadPool(num_processes)
+
+
+def _case_id(output_filename):
+    """case identifier used in progress events: output file name without .nii.gz"""
+    name = os.path.basename(output_filename)
+    return name[:-7] if name.endswith(".nii.gz") else os.path.splitext(name)[0]
+
+
+def _tta_mirror_axes(trainer, tta_mirror_axes=None):
+    """mirror axes for test time augmentation: the ones the model was trained with, optionally only a subset of them"""
+    mirror_axes = tuple(trainer.data_aug_params['mirror_axes'])
+    if tta_mirror_axes is not None:
+        mirror_axes = tuple(a for a in mirror_axes if a in tta_mirror_axes)
+    return mirror_axes
 
 
 def preprocess_save_to_queue(preprocess_fn, q, list_of_lists, output_files, segs_from_prev_stage, classes,
@@ -170,7 +187,9 @@ def preprocess_multithreaded(trainer, list_of_lists, output_files, num_processes
 def predict_cases(model, list_of_lists, output_filenames, folds, save_npz, num_threads_preprocessing,
                   num_threads_nifti_save, segs_from_prev_stage=None, do_tta=True, mixed_precision=True,
                   overwrite_existing=False, all_in_gpu=False, step_size=0.5, checkpoint_name="model_best.model",
-                  segmentation_export_kwargs: dict = None, disable_postprocessing: bool = False):
+                  segmentation_export_kwargs: dict = None, disable_postprocessing: bool = False,
+                  tile_batch_size: int = None, tta_mirror_axes: Tuple[int, ...] = None,
+                  device_aggregation_mb: int = None, skip_background_tiles: bool = None):
     """
     :param segmentation_export_kwargs:
     :param model: folder where the model is saved, must contain fold_x subfolders
@@ -182,8 +201,6 @@ def predict_cases(model, list_of_lists, output_filenames, folds, save_npz, num_t
 
     assert len(list_of_lists) == len(output_filenames)
     if segs_from_prev_stage is not None: assert len(segs_from_prev_stage) == len(output_filenames)
-    pool = _get_pool(num_threads_nifti_save)
-    results = []
 
     cleaned_output_files = []
     for o in output_filenames:
@@ -213,6 +230,43 @@ def predict_cases(model, list_of_lists, output_filenames, folds, save_npz, num_t
     trainer, params = load_model_and_checkpoint_files(model, folds, mixed_precision=mixed_precision,
                                                       checkpoint_name=checkpoint_name)
 
+    return predict_cases_preloaded(trainer, params, model, list_of_lists, cleaned_output_files, save_npz,
+                                   num_threads_preprocessing, num_threads_nifti_save,
+                                   segs_from_prev_stage=segs_from_prev_stage, do_tta=do_tta,
+                                   mixed_precision=mixed_precision, all_in_gpu=all_in_gpu, step_size=step_size,
+                                   segmentation_export_kwargs=segmentation_export_kwargs,
+                                   disable_postprocessing=disable_postprocessing, tile_batch_size=tile_batch_size,
+                                   tta_mirror_axes=tta_mirror_axes, device_aggregation_mb=device_aggregation_mb,
+                                   skip_background_tiles=skip_background_tiles)
+
+
+def predict_cases_preloaded(trainer, params, model, list_of_lists, output_filenames, save_npz,
+                            num_threads_preprocessing, num_threads_nifti_save, segs_from_prev_stage=None,
+                            do_tta=True, mixed_precision=True, all_in_gpu=False, step_size=0.5,
+                            segmentation_export_kwargs: dict = None, disable_postprocessing: bool = False,
+                            tile_batch_size: int = None, tta_mirror_axes: Tuple[int, ...] = None,
+                            device_aggregation_mb: int = None, skip_background_tiles: bool = None):
+    """
+    predict_cases without the model loading part. trainer and params are what load_model_and_checkpoint_files
+    returns, so a long-lived process (see serve.py) can load them once and reuse them for every case.
+    :param model: folder where the model is saved, only used to look up postprocessing.json
+    :param output_filenames: [output_file_case0.nii.gz, ...], must end with .nii.gz and their folders must exist
+    :param tile_batch_size: sliding window tiles per forward pass, None or 0: pick automatically
+    :param tta_mirror_axes: with do_tta, only mirror along these axes (subset of the training mirror axes).
+    None: all of them. Each axis doubles the number of network evaluations per tile
+    :param device_aggregation_mb: device memory for aggregating the sliding window predictions on the device, larger
+    volumes are aggregated on the host. 0: always on the host, None: keep the network default
+    :param skip_background_tiles: skip sliding window tiles outside the body mask, None: keep the network default
+    """
+    trainer.network.tile_batch_size = tile_batch_size
+    if device_aggregation_mb is not None:
+        trainer.network.device_aggregation_bytes = device_aggregation_mb * 1024 ** 2
+    if skip_background_tiles is not None:
+        trainer.network.skip_background_tiles = skip_background_tiles
+    mirror_axes = _tta_mirror_axes(trainer, tta_mirror_axes)
+    pool = _get_pool(num_threads_nifti_save)
+    results = []
+
     if segmentation_export_kwargs is None:
         if 'segmentation_export_params' in trainer.plans.keys():
             force_separate_z = trainer.plans['segmentation_export_params']['force_separate_z']
@@ -229,10 +283,17 @@ def predict_cases(model, list_of_lists, output_filenames, folds, save_npz, num_t
 
     print("starting preprocessing generator")
 
-    preprocessing = preprocess_multithreaded(trainer, list_of_lists, cleaned_output_files, num_threads_preprocessing,
+    num_cases = len(output_filenames)
+    set_progress_context(num_cases=num_cases)
+    for i, o in enumerate(output_filenames):
+        report_progress("preprocess", case=_case_id(o), index=i)
+
+    preprocessing = preprocess_multithreaded(trainer, list_of_lists, output_filenames, num_threads_preprocessing,
                                              segs_from_prev_stage)
     print("starting prediction...")
     all_output_files = []
+    exports = []
+    exported_filenames = []
     for preprocessed in preprocessing:
         output_filename, (d, dct) = preprocessed
         all_output_files.append(all_output_files)
@@ -244,19 +305,32 @@ def predict_cases(model, list_of_lists, output_filenames, folds, save_npz, num_t
         print("predicting", output_filename)
 
         output_filename_bin = os.path.basename(output_filename)
+        case_id = _case_id(output_filename)
 
-        trainer.load_checkpoint_ram(params[0], False)
-        softmax = trainer.predict_preprocessed_data_return_seg_and_softmax(
-            d, do_mirroring=do_tta, mirror_axes=trainer.data_aug_params['mirror_axes'], use_sliding_window=True,
-            step_size=step_size, use_gaussian=True, all_in_gpu=all_in_gpu,
-            mixed_precision=mixed_precision, file_name=output_filename_bin)[1]
-
-        for p in params[1:]:
-            trainer.load_checkpoint_ram(p, False)
-            softmax += trainer.predict_preprocessed_data_return_seg_and_softmax(
-                d, do_mirroring=do_tta, mirror_axes=trainer.data_aug_params['mirror_axes'], use_sliding_window=True,
+        set_progress_context(case=case_id, index=len(exports), num_cases=num_cases, fold=0, num_folds=len(params))
+        try:
+            # cancelled cases are skipped between folds and (inside the sliding window) between tiles
+            check_cancelled()
+            trainer.load_checkpoint_ram(params[0], False)
+            softmax = trainer.predict_preprocessed_data_return_seg_and_softmax(
+                d, do_mirroring=do_tta, mirror_axes=mirror_axes, use_sliding_window=True,
                 step_size=step_size, use_gaussian=True, all_in_gpu=all_in_gpu,
-                mixed_precision=mixed_precision, file_name=output_filename)[1]
+                mixed_precision=mixed_precision, file_name=output_filename_bin)[1]
+
+            for fold, p in enumerate(params[1:], start=1):
+                set_progress_context(case=case_id, index=len(exports), num_cases=num_cases, fold=fold,
+                                     num_folds=len(params))
+                check_cancelled()
+                trainer.load_checkpoint_ram(p, False)
+                softmax += trainer.predict_preprocessed_data_return_seg_and_softmax(
+                    d, do_mirroring=do_tta, mirror_axes=mirror_axes,
+                    use_sliding_window=True, step_size=step_size, use_gaussian=True, all_in_gpu=all_in_gpu,
+                    mixed_precision=mixed_precision, file_name=output_filename)[1]
+        except PredictionCancelled:
+            print("cancelled", output_filename)
+            set_progress_context(num_cases=num_cases)
+            report_progress("cancelled", case=case_id)
+            continue
 
         if len(params) > 1:
             softmax /= len(params)
@@ -285,44 +359,57 @@ def predict_cases(model, list_of_lists, output_filenames, folds, save_npz, num_t
             np.save(output_filename[:-7] + ".npy", softmax)
             softmax = output_filename[:-7] + ".npy"
 
+        set_progress_context(num_cases=num_cases)
+        report_progress("export", case=case_id, index=len(exports))
+        exported_filenames.append(output_filename)
         if pool:
             results.append(pool.starmap_async(save_segmentation_nifti_from_softmax,
                                               ((softmax, output_filename, dct, interpolation_order,
                                                 region_class_order, None, None, npz_file, None, force_separate_z,
                                                 interpolation_order_z),)
                                               ))
+            exports.append((case_id, results[-1]))
         else:
             save_segmentation_nifti_from_softmax(softmax, output_filename, dct, interpolation_order,
                                                  region_class_order, None, None, npz_file, None, force_separate_z,
                                                  interpolation_order_z)
+            exports.append((case_id, None))
+            report_progress("exported", case=case_id)
 
     print("inference done. Now waiting for the segmentation export to finish...")
-    _ = [i.get() for i in results]
+    for case_id, result in exports:
+        if result is not None:
+            result.get()
+            report_progress("exported", case=case_id)
     # now apply postprocessing
     # first load the postprocessing properties if they are present. Else raise a well visible warning
-    if not disable_postprocessing:
+    if not disable_postprocessing and exported_filenames:
         results = []
         pp_file = join(model, "postprocessing.json")
         if isfile(pp_file):
             print("postprocessing...")
-            shutil.copy(pp_file, os.path.abspath(os.path.dirname(output_filenames[0])))
+            report_progress("postprocess")
+            shutil.copy(pp_file, os.path.abspath(os.path.dirname(exported_filenames[0])))
             # for_which_classes stores for which of the classes everything but the largest connected component needs to be
             # removed
             for_which_classes, min_valid_obj_size = load_postprocessing(pp_file)
             if pool:
                 results.append(pool.starmap_async(load_remove_save,
-                                                  zip(output_filenames, output_filenames,
-                                                      [for_which_classes] * len(output_filenames),
-                                                      [min_valid_obj_size] * len(output_filenames))))
+                                                  zip(exported_filenames, exported_filenames,
+                                                      [for_which_classes] * len(exported_filenames),
+                                                      [min_valid_obj_size] * len(exported_filenames))))
                 _ = [i.get() for i in results]
             else:
-                for fname in output_filenames:
+                for fname in exported_filenames:
                     load_remove_save(fname, fname, for_which_classes, min_valid_obj_size)
         else:
             print("WARNING! Cannot run postprocessing because the postprocessing file is missing. Make sure to run "
                   "consolidate_folds in the output folder of the model first!\nThe folder you need to run this in is "
                   "%s" % model)
 
+    report_progress("done")
+    set_progress_context()
+
     if pool:
         pool.close()
         pool.join()
@@ -654,17 +741,60 @@ def check_input_folder_and_return_caseIDs(input_folder, expected_num_modalities)
     return maybe_case_ids
 
 
+def stage_input_files(input_files: List[str], staging_dir: str) -> str:
+    """
+    symlink input files into staging_dir using the nnU-Net naming scheme (CASE_XXXX.nii.gz).
+    Files not ending with _0000.nii.gz are aliased as modality 0000 (same rule as eval.py check()).
+    Nothing is copied unless symlinks are not supported, so every invocation can get its own staging dir.
+    """
+    maybe_mkdir_p(staging_dir)
+    for f in input_files:
+        basename = os.path.basename(f)
+        if not basename.endswith("_0000.nii.gz"):
+            basename = basename[:-len(".nii.gz")] + "_0000.nii.gz"
+        dst = join(staging_dir, basename)
+        if os.path.lexists(dst):
+            os.remove(dst)
+        try:
+            os.symlink(os.path.abspath(f), dst)
+        except OSError:
+            shutil.copy(f, dst)
+    return staging_dir
+
+
 def predict_from_folder(model: str, input_folder: str, output_folder: str, folds: Union[Tuple[int], List[int]],
                         save_npz: bool, num_threads_preprocessing: int, num_threads_nifti_save: int,
                         lowres_segmentations: Union[str, None], part_id: int, num_parts: int, tta: bool,
                         mixed_precision: bool = True, overwrite_existing: bool = True, mode: str = 'normal',
                         overwrite_all_in_gpu: bool = None, step_size: float = 0.5,
                         checkpoint_name: str = "model_best.model",
-                        segmentation_export_kwargs: dict = None, disable_postprocessing: bool = False):
+                        segmentation_export_kwargs: dict = None, disable_postprocessing: bool = False,
+                        input_files: List[str] = None, tile_batch_size: int = None,
+                        tta_mirror_axes: Tuple[int, ...] = None, device_aggregation_mb: int = None,
+                        skip_background_tiles: bool = None):
     """
         here we use the standard naming scheme to generate list_of_lists and output_files needed by predict_cases
 
+        input_files: optional explicit list of .nii.gz files. They are symlinked into a private staging dir
+        (input_folder is ignored) which is removed afterwards, so concurrent calls never share inputs.
     """
+    if input_files is not None:
+        staging_dir = tempfile.mkdtemp(prefix="nnunet_input_")
+        try:
+            stage_input_files(input_files, staging_dir)
+            return predict_from_folder(model, staging_dir, output_folder, folds, save_npz, num_threads_preprocessing,
+                                       num_threads_nifti_save, lowres_segmentations, part_id, num_parts, tta,
+                                       mixed_precision=mixed_precision, overwrite_existing=overwrite_existing,
+                                       mode=mode, overwrite_all_in_gpu=overwrite_all_in_gpu, step_size=step_size,
+                                       checkpoint_name=checkpoint_name,
+                                       segmentation_export_kwargs=segmentation_export_kwargs,
+                                       disable_postprocessing=disable_postprocessing,
+                                       tile_batch_size=tile_batch_size, tta_mirror_axes=tta_mirror_axes,
+                                       device_aggregation_mb=device_aggregation_mb,
+                                       skip_background_tiles=skip_background_tiles)
+        finally:
+            shutil.rmtree(staging_dir, ignore_errors=True)
+
     maybe_mkdir_p(output_folder)
     shutil.copy(join(model, 'plans.pkl'), output_folder)
 
@@ -699,7 +829,9 @@ def predict_from_folder(model: str, input_folder: str, output_folder: str, folds
                              mixed_precision=mixed_precision, overwrite_existing=overwrite_existing,
                              all_in_gpu=all_in_gpu, step_size=step_size, checkpoint_name=checkpoint_name,
                              segmentation_export_kwargs=segmentation_export_kwargs,
-                             disable_postprocessing=disable_postprocessing)
+                             disable_postprocessing=disable_postprocessing, tile_batch_size=tile_batch_size,
+                             tta_mirror_axes=tta_mirror_axes, device_aggregation_mb=device_aggregation_mb,
+                             skip_background_tiles=skip_background_tiles)
     if mode == "fast":
         if overwrite_all_in_gpu is None:
             all_in_gpu = False
@@ -34,6 +34,9 @@ class ConvDropoutNormNonlin(nn.SequentialCell):
     fixes a bug in ConvDropoutNormNonlin where lrelu was used regardless of nonlin. Bad.
     """
 
+    # 归一化层的参数按 (批内槽位, 通道) 排列，槽位数为训练时的 batch size
+    NORM_SLOTS = 2
+
     def __init__(self, input_channels, output_channels,
                  conv_op=nn.Conv2d, conv_kwargs=None,
                  norm_op=nn.BatchNorm2d, norm_op_kwargs=None,
@@ -66,7 +69,7 @@ class ConvDropoutNormNonlin(nn.SequentialCell):
             self.dropout = self.dropout_op(**self.dropout_op_kwargs)
         else:
             self.dropout = None
-        self.instancenorm = self.norm_op(output_channels * 2, **self.norm_op_kwargs)  # for task04 * 9  for task01 * 2 和 取消 norm reshape
+        self.instancenorm = self.norm_op(output_channels * self.NORM_SLOTS, **self.norm_op_kwargs)  # for task04 * 9  for task01 * 2 和 取消 norm reshape
         self.lrelu = self.nonlin(**self.nonlin_kwargs)
         # print('output_channels*2:', output_channels*2)
 
@@ -76,7 +79,11 @@ class ConvDropoutNormNonlin(nn.SequentialCell):
         shape = ops.Shape()
         x = self.conv(x)
         n, c, d, w, h = shape(x)
-        x = ops.Reshape()(x, (1, n * c, d, h, w)) # 修改了 Reshape
+        if self.training:
+            x = ops.Reshape()(x, (1, n * c, d, h, w)) # 修改了 Reshape
+        else:
+            # 推理时使用滑动统计量，按槽位分组即可，批大小可以是 NORM_SLOTS 的任意倍数 (一次前向多个 tile)
+            x = ops.Reshape()(x, (n // self.NORM_SLOTS, self.NORM_SLOTS * c, d, h, w))
         x = self.instancenorm(x) 
         x = ops.Reshape()(x, (n, c, d, h, w))
         return self.lrelu(x)
@@ -308,6 +315,7 @@ class Generic_UNet(SegmentationNetwork):
                 conv_kernel_sizes = [(3, 3, 3)] * (num_pool + 1)
         else:
             raise ValueError("unknown convolution dimensionality, conv op: %s" % str(conv_op))
+        self.norm_slots = getattr(basic_block, "NORM_SLOTS", self.norm_slots)
 
         self.input_shape_must_be_divisible_by = np.prod(pool_op_kernel_sizes, 0, dtype=np.int64)
         self.pool_op_kernel_sizes = pool_op_kernel_sizes
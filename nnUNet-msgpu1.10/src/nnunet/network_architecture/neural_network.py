@@ -22,11 +22,42 @@ import mindspore.nn as nn
 import mindspore.ops as ops
 import numpy as np
 from batchgenerators.augmentations.utils import pad_nd_image
+from scipy.ndimage import binary_dilation, binary_fill_holes, binary_opening
 from scipy.ndimage.filters import gaussian_filter
 
+from src.nnunet.utilities.aggregation import TileAggregator, device_aggregation_bytes
+from src.nnunet.utilities.progress import check_cancelled, report_progress
 from src.nnunet.utilities.random_stuff import no_op
 from src.nnunet.utilities.to_mindspore import maybe_to_mindspore
 
+# when tile_batch_size is not set, batch as many tiles as fit in this many voxels (4 tiles of 128^3). Inference keeps
+# no activations for a backward pass, so this stays well below what training needed for the same patch size.
+# Every tile is run once per mirror variant, so the budget counts tiles * variants. The tile batch never drops below
+# norm_slots; if norm_slots tiles with all variants still exceed the budget, the mirror variants are split over
+# several forward passes instead
+AUTO_TILE_BATCH_VOXELS = 4 * 128 ** 3
+
+# default device memory budget for aggregating the sliding window predictions on the device, larger volumes are
+# aggregated on the host
+DEFAULT_DEVICE_AGGREGATION_BYTES = 2 * 1024 ** 3
+
+# body mask for skipping sliding window tiles that only contain air and table: computed on every
+# BODY_MASK_DOWNSAMPLING-th voxel, a voxel belongs to the body if it is more than BODY_MASK_THRESHOLD (normalized
+# intensity) above the lowest value of the case
+BODY_MASK_DOWNSAMPLING = 4
+BODY_MASK_THRESHOLD = 0.1
+
+
+def mirror_variants(mirror_axes: tuple, do_mirroring: bool, offset: int = 2) -> List[Tuple[int, ...]]:
+    """
+    all combinations of the mirror axes for test time augmentation, identity first. Spatial axes are shifted by offset
+    to index a (b, c, x, y, z) tensor. Without mirroring only the identity is returned
+    """
+    if not do_mirroring or not mirror_axes:
+        return [()]
+    axes = sorted(set(int(a) + offset for a in mirror_axes))
+    return [tuple(a for i, a in enumerate(axes) if combination >> i & 1) for combination in range(2 ** len(axes))]
+
 
 
 
@@ -55,12 +86,69 @@ class SegmentationNetwork(nn.Cell):
         # can be expensive, so it makes sense to save and reuse them.
         self._gaussian_3d = self._patch_size_for_gaussian_3d = None
         self._gaussian_2d = self._patch_size_for_gaussian_2d = None
+        # The sum of the tile weights over the volume only depends on the geometry (padded shape, patch size, steps)
+        # and is the same for every class, so it is kept as a single channel and reused while the geometry repeats
+        self._weight_map_3d = self._geometry_for_weight_map_3d = None
         self.expand_dims = ops.ExpandDims()
 
+        # The normalization layers may hold separate affine parameters / running stats per batch slot (the training
+        # batch size, 2 for the shipped models), so every forward pass must use a multiple of norm_slots samples.
+        # share_norm_slots() copies the slot 0 parameters to all slots; after that any sample can go into any slot
+        # and tiles can be batched.
+        self.norm_slots = 2
+        self._norm_slots_shared = False
+
+        # number of sliding window tiles per forward pass, None or 0 -> pick from AUTO_TILE_BATCH_VOXELS. Rounded down to
+        # a multiple of norm_slots (at least norm_slots)
+        self.tile_batch_size = None
+
+        # device memory the sliding window aggregation may use, 0 -> always aggregate on the host
+        self.device_aggregation_bytes = DEFAULT_DEVICE_AGGREGATION_BYTES
+
+        # skip sliding window tiles outside the body mask, their voxels get the background prior
+        self.skip_background_tiles = True
+
     def g(self, x):
         """lambda function x"""
         return x
 
+    def share_norm_slots(self):
+        """copy the slot 0 normalization parameters to all batch slots (inference only, call after loading params)"""
+        if self.norm_slots > 1:
+            for _, cell in self.cells_and_names():
+                norm = getattr(cell, "instancenorm", None)
+                if getattr(cell, "NORM_SLOTS", 1) != self.norm_slots or norm is None:
+                    continue
+                for param in (norm.gamma, norm.beta, norm.moving_mean, norm.moving_variance):
+                    values = param.asnumpy()
+                    per_slot = values.shape[0] // self.norm_slots
+                    param.set_data(mindspore.Tensor(np.tile(values[:per_slot], self.norm_slots)))
+        self._norm_slots_shared = True
+
+    def _get_tile_batch_size(self, patch_size, num_tiles: int, num_variants: int = 1) -> int:
+        """
+        tiles per forward pass: configured or automatic, rounded down to a multiple of norm_slots but at least
+        norm_slots, and never more than needed for num_tiles. Each tile is run once per mirror variant, the automatic
+        value keeps tiles * variants within AUTO_TILE_BATCH_VOXELS. At the norm_slots floor the budget may still be
+        exceeded, _get_variants_per_pass then splits the mirror variants over several forward passes
+        """
+        if not self._norm_slots_shared:
+            # every tile still needs a full set of slots, see _internal_maybe_mirror_and_pred_3D
+            return 1
+        batch_size = self.tile_batch_size or AUTO_TILE_BATCH_VOXELS // (int(np.prod(patch_size)) * num_variants)
+        batch_size = max(self.norm_slots, batch_size // self.norm_slots * self.norm_slots)
+        return min(batch_size, int(np.ceil(num_tiles / self.norm_slots)) * self.norm_slots)
+
+    @staticmethod
+    def _get_variants_per_pass(num_samples: int, patch_size, num_variants: int) -> int:
+        """
+        mirror variants per forward pass: all of them if num_samples * num_variants patches fit into
+        AUTO_TILE_BATCH_VOXELS, otherwise the largest divisor of num_variants that fits (at least 1), so that every
+        pass has the same input shape
+        """
+        fit = max(1, AUTO_TILE_BATCH_VOXELS // (num_samples * int(np.prod(patch_size))))
+        return max(d for d in range(1, num_variants + 1) if num_variants % d == 0 and d <= fit)
+
     def predict_3D(self, x: np.ndarray, do_mirroring: bool, mirror_axes: Tuple[int, ...] = (0, 1, 2),
                    use_sliding_window: bool = False,
                    step_size: float = 0.5, patch_size: Tuple[int, ...] = None,
@@ -256,6 +344,59 @@ class SegmentationNetwork(nn.Cell):
 
         return gaussian_importance_map
 
+    def _get_weight_map_3d(self, image_size: Tuple[int, ...], tile_slicers: list, tile_weight: np.ndarray,
+                           use_gaussian: bool, verbose: bool = True) -> Tuple[np.ndarray, np.ndarray]:
+        """
+        single channel sum of tile_weight over the given sliding window tiles, cached for the last geometry.
+        Also returns the mask of voxels no tile covers (None if there are none); their weight is set to 1 so that
+        they can be filled with a prior
+        """
+        geometry = (tuple(image_size), tuple(tile_weight.shape), use_gaussian,
+                    tuple(tuple(s.start for s in tile_slicer[1:]) for tile_slicer in tile_slicers))
+        if self._weight_map_3d is not None and self._geometry_for_weight_map_3d == geometry:
+            if verbose: print("using precomputed weight map")
+            return self._weight_map_3d
+
+        if verbose: print("computing weight map")
+        weight_map = np.zeros(image_size, dtype=np.float32)
+        for tile_slicer in tile_slicers:
+            weight_map[tile_slicer[1:]] += tile_weight
+        uncovered = weight_map == 0
+        if uncovered.any():
+            weight_map[uncovered] = 1
+        else:
+            uncovered = None
+        self._weight_map_3d = weight_map, uncovered
+        self._geometry_for_weight_map_3d = geometry
+        return self._weight_map_3d
+
+    @staticmethod
+    def _get_body_mask(data: np.ndarray) -> np.ndarray:
+        """
+        cheap low resolution body mask of the normalized input (c, x, y, z), one voxel per BODY_MASK_DOWNSAMPLING
+        voxels along each axis. Thresholds the first channel just above its lowest value (air and everything the CT
+        normalization clipped), removes noise and the thin table with an opening, fills holes (lungs, bowel gas) and
+        adds a margin of one low resolution voxel
+        """
+        f = BODY_MASK_DOWNSAMPLING
+        small = data[0, ::f, ::f, ::f]
+        mask = small > small.min() + BODY_MASK_THRESHOLD
+        mask = binary_opening(mask, iterations=1)
+        mask = binary_fill_holes(mask)
+        return binary_dilation(mask, iterations=1)
+
+    def _skip_background_tiles(self, data: np.ndarray, tile_slicers: list, verbose: bool = True) -> list:
+        """tiles that overlap the body mask. Keeps all tiles if the mask is empty (e.g. a constant image)"""
+        mask = self._get_body_mask(data)
+        if not mask.any():
+            return tile_slicers
+        f = BODY_MASK_DOWNSAMPLING
+        kept = [tile_slicer for tile_slicer in tile_slicers
+                if mask[tuple(slice(s.start // f, -(-s.stop // f)) for s in tile_slicer[1:])].any()]
+        if verbose: print("skipping %d of %d tiles outside the body mask" % (len(tile_slicers) - len(kept),
+                                                                           len(tile_slicers)))
+        return kept
+
     @staticmethod
     def _compute_steps_for_sliding_window(patch_size: Tuple[int, ...],
                                           image_size: Tuple[int, ...], step_size: float) -> \
@@ -343,46 +484,55 @@ class SegmentationNetwork(nn.Cell):
             add_for_nb_of_preds = self._gaussian_3d
         else:
             add_for_nb_of_preds = np.ones(patch_size, dtype=np.float32)
-        aggregated_results = np.zeros([self.num_classes] + list(data.shape[1:]), dtype=np.float32)
-        aggregated_nb_of_predictions = np.zeros([self.num_classes] + list(data.shape[1:]), dtype=np.float32)
-        for x_axis in steps[0]:
-            lb_x = x_axis
-            ub_x = x_axis + patch_size[0]
-            for y in steps[1]:
-                lb_y = y
-                ub_y = y + patch_size[1]
-                for z in steps[2]:
-                    lb_z = z
-                    ub_z = z + patch_size[2]
-
-                    predicted_patch = self._internal_maybe_mirror_and_pred_3D(
-                        data[None, :, lb_x:ub_x, lb_y:ub_y, lb_z:ub_z], mirror_axes, do_mirroring,
-                        gaussian_importance_map)[0]
-                    predicted_patch = predicted_patch.asnumpy()
-                    # print("predicted_patch", predicted_patch.shape)
-                    aggregated_results[:, lb_x:ub_x, lb_y:ub_y, lb_z:ub_z] += predicted_patch
-
-                    aggregated_nb_of_predictions[:, lb_x:ub_x, lb_y:ub_y, lb_z:ub_z] += add_for_nb_of_preds
+        tile_slicers = [(slice(None), slice(lb_x, lb_x + patch_size[0]), slice(lb_y, lb_y + patch_size[1]),
+                         slice(lb_z, lb_z + patch_size[2]))
+                        for lb_x in steps[0] for lb_y in steps[1] for lb_z in steps[2]]
+        if self.skip_background_tiles and num_tiles > 1:
+            tile_slicers = self._skip_background_tiles(data, tile_slicers, verbose)
+        skipped_tiles = num_tiles - len(tile_slicers)
+
+        aggregated_nb_of_predictions, uncovered = self._get_weight_map_3d(data.shape[1:], tile_slicers,
+                                                                          add_for_nb_of_preds,
+                                                                          use_gaussian and num_tiles > 1, verbose)
+        # keep the accumulator on the device if it fits into the budget, TileAggregator moves to the host by itself if
+        # the device runs out of memory on the way. Voxels of skipped tiles that no other tile covers get the
+        # background prior (only with a background class, i.e. not for regions)
+        required_bytes = device_aggregation_bytes(self.num_classes, data.shape[1:])
+        on_device = required_bytes <= (self.device_aggregation_bytes or 0)
+        aggregator = TileAggregator(self.num_classes, aggregated_nb_of_predictions, on_device, verbose,
+                                    background=uncovered if regions_class_order is None else None)
+
+        # gather tile_batch_size tiles per forward pass and scatter the predictions back. The last batch is padded
+        # with copies of its last tile so that the graph is only compiled for one input shape
+        tile_batch_size = self._get_tile_batch_size(patch_size, len(tile_slicers),
+                                                    len(mirror_variants(mirror_axes, do_mirroring)))
+        if verbose: print("tiles per forward pass:", tile_batch_size)
+
+        tiles_done = 0
+        num_tiles = len(tile_slicers)
+        report_progress("predict", tile=0, num_tiles=num_tiles, skipped_tiles=skipped_tiles)
+        for start in range(0, num_tiles, tile_batch_size):
+            batch_slicers = tile_slicers[start:start + tile_batch_size]
+            batch = np.stack([data[s] for s in batch_slicers])
+            if len(batch_slicers) < tile_batch_size:
+                batch = np.concatenate([batch] + [batch[-1:]] * (tile_batch_size - len(batch_slicers)))
+
+            predicted_patches = self._internal_maybe_mirror_and_pred_3D(
+                batch, mirror_axes, do_mirroring, gaussian_importance_map)
+            aggregator.add(predicted_patches, batch_slicers)
+
+            tiles_done += len(batch_slicers)
+            report_progress("predict", tile=tiles_done, num_tiles=num_tiles, skipped_tiles=skipped_tiles)
+            check_cancelled()
 
         # we reverse the padding here (remember that we padded the input to be at least as large as the patch size
         slicer = tuple(
-            [slice(0, aggregated_results.shape[i]) for i in
-             range(len(aggregated_results.shape) - (len(slicer) - 1))] + slicer[1:])
-
-        aggregated_results = aggregated_results[slicer]
-        aggregated_nb_of_predictions = aggregated_nb_of_predictions[slicer]
-
-        # computing the class_probabilities by dividing the aggregated result with result_numsamples
-        class_probabilities = aggregated_results / aggregated_nb_of_predictions
-        # Mindspore record bboxes nb_of_predictions
+            [slice(0, aggregator.shape[i]) for i in
+             range(len(aggregator.shape) - (len(slicer) - 1))] + slicer[1:])
 
-        if regions_class_order is None:
-            predicted_segmentation = class_probabilities.argmax(0)
-        else:
-            class_probabilities_here = class_probabilities
-            predicted_segmentation = np.zeros(class_probabilities_here.shape[1:], dtype=np.float32)
-            for i, c in enumerate(regions_class_order):
-                predicted_segmentation[class_probabilities_here[i] > 0.5] = c
+        # computing the class_probabilities by dividing the aggregated result with result_numsamples. The single
+        # channel weight map is broadcast over the classes
+        predicted_segmentation, class_probabilities = aggregator.finalize(slicer, regions_class_order)
 
         if verbose: print("prediction done")
         print("predicted_segmentation.shape", predicted_segmentation.shape)
@@ -469,67 +619,44 @@ class SegmentationNetwork(nn.Cell):
 
 
         x = maybe_to_mindspore(x)
-        result_torch = mindspore.ops.Zeros()(tuple([1, self.num_classes] + list(x.shape[2:])), mindspore.float32)
+        num_samples = x.shape[0]
+        if self._norm_slots_shared:
+            # pad the batch to a multiple of norm_slots, every slot behaves the same
+            num_pad = -num_samples % self.norm_slots
+            if num_pad:
+                x = mindspore.ops.Concat(0)(tuple([x] + [x[-1:]] * num_pad))
+        else:
+            # each slot has its own normalization parameters: give every sample a full set of slots and keep the
+            # prediction from slot 0
+            x = mindspore.Tensor(np.repeat(x.asnumpy(), self.norm_slots, 0))
+        result_torch = mindspore.ops.Zeros()(tuple([x.shape[0], self.num_classes] + list(x.shape[2:])),
+                                             mindspore.float32)
         if mult is not None:
             mult = maybe_to_mindspore(mult)
 
-        do_mirroring = False
-        if do_mirroring:
-            mirror_idx = 8
-            num_results = 2 ** len(mirror_axes)
-        else:
-            mirror_idx = 1
-            num_results = 1
-
-        x = x.asnumpy()
-        input_tensor = np.repeat(x, 2, 0) ##### task04??? 9 2 
-
-        x = mindspore.Tensor(input_tensor)
-        for m in range(mirror_idx):
-            if m == 0:
-                pred = self.inference_apply_nonlin(self(x)[0])[0]
-                pred = self.expand_dims(pred, 0)
-                result_torch += 1 / num_results * pred
-
-            if m == 1 and (2 in mirror_axes):
-                pred = self.inference_apply_nonlin(self(mindspore.ops.ReverseV2((4,))(x)))[0]
-                pred = self.expand_dims(pred, 0)
-                result_torch += 1 / num_results * mindspore.ops.ReverseV2((4,))(pred)
-
-            if m == 2 and (1 in mirror_axes):
-                pred = self.inference_apply_nonlin(self(mindspore.ops.ReverseV2((3,))(x)))[0]
-                pred = self.expand_dims(pred, 0)
-                result_torch += 1 / num_results * mindspore.ops.ReverseV2((3,))(pred)
-
-            if m == 3 and (2 in mirror_axes) and (1 in mirror_axes):
-                pred = self.inference_apply_nonlin(self(mindspore.ops.ReverseV2((4, 3))(x)))[0]
-                pred = self.expand_dims(pred, 0)
-                result_torch += 1 / num_results * mindspore.ops.ReverseV2((4, 3))(pred)
-
-            if m == 4 and (0 in mirror_axes):
-                pred = self.inference_apply_nonlin(self(mindspore.ops.ReverseV2((2,))(x)))[0]
-                pred = self.expand_dims(pred, 0)
-                result_torch += 1 / num_results * mindspore.ops.ReverseV2((2,))(pred)
-
-            if m == 5 and (0 in mirror_axes) and (2 in mirror_axes):
-                pred = self.inference_apply_nonlin(self(mindspore.ops.ReverseV2((4, 2))(x)))[0]
-                pred = self.expand_dims(pred, 0)
-                result_torch += 1 / num_results * mindspore.ops.ReverseV2((4, 2))(pred)
-
-            if m == 6 and (0 in mirror_axes) and (1 in mirror_axes):
-                pred = self.inference_apply_nonlin(self(mindspore.ops.ReverseV2((3, 2))(x)))[0]
-                pred = self.expand_dims(pred, 0)
-                result_torch += 1 / num_results * mindspore.ops.ReverseV2((3, 2))(pred)
-
-            if m == 7 and (0 in mirror_axes) and (1 in mirror_axes) and (2 in mirror_axes):
-                pred = self.inference_apply_nonlin(self(mindspore.ops.ReverseV2((4, 3, 2))(x)))[0]
-                pred = self.expand_dims(pred, 0)
-                result_torch += 1 / num_results * mindspore.ops.ReverseV2((4, 3, 2))(pred)
+        # the mirror variants of all samples go through the network together (all in one forward pass unless that
+        # exceeds AUTO_TILE_BATCH_VOXELS), then each variant is flipped back (one op for the whole batch) and the
+        # variants are averaged
+        variants = mirror_variants(mirror_axes, do_mirroring)
+        batch_size = x.shape[0]
+        variants_per_pass = self._get_variants_per_pass(batch_size, x.shape[2:], len(variants))
+        for first in range(0, len(variants), variants_per_pass):
+            chunk = variants[first:first + variants_per_pass]
+            flipped = tuple(mindspore.ops.ReverseV2(axes)(x) if axes else x for axes in chunk)
+            pred = self.inference_apply_nonlin(self(mindspore.ops.Concat(0)(flipped) if len(flipped) > 1
+                                                    else flipped[0])[0])
+            for i, axes in enumerate(chunk):
+                variant = pred[i * batch_size:(i + 1) * batch_size]
+                if axes:
+                    variant = mindspore.ops.ReverseV2(axes)(variant)
+                result_torch += 1 / len(variants) * variant
 
         if mult is not None:
-            result_torch[:, :] *= mult
+            result_torch *= mult
 
-        return result_torch
+        if not self._norm_slots_shared:
+            result_torch = result_torch[::self.norm_slots]
+        return result_torch[:num_samples]
 
     def _internal_maybe_mirror_and_pred_2D(self, x: Union[np.ndarray, mindspore.Tensor], mirror_axes: tuple,
                                            do_mirroring: bool = True,
@@ -311,6 +311,11 @@ class NetworkTrainer():
             new_state_dict[key] = value
 
         load_param_into_net(self.network, new_state_dict)
+        # the loaded params have per-slot normalization again. For inference, share slot 0 across all slots so that
+        # sliding window tiles can be batched
+        self.network._norm_slots_shared = False
+        if not train:
+            self.network.share_norm_slots()
         if train:
             optimizer_state_dict = checkpoint['optimizer_state_dict']
             if optimizer_state_dict is not None:
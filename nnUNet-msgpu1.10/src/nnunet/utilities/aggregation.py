@@ -0,0 +1,145 @@
+# Copyright 2022 Huawei Technologies Co., Ltd
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+# http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+# ============================================================================
+
+"""
+aggregation of sliding window predictions
+
+TileAggregator sums the (already weighted) tile predictions into a [num_classes, x, y, z] accumulator and divides by
+the single channel weight map at the end. On the device the accumulator and the weight map stay in device memory:
+tiles are added without a device -> host copy and only the final probabilities and the argmax are copied back once.
+On the host every forward pass is copied back with asnumpy() and added in NumPy.
+
+On the device the accumulator is a Parameter laid out as [x, y, z, num_classes] and every tile is added in place with
+ScatterNdAdd (one index per tile voxel, each updating the num_classes values of that voxel). A slice update
+(results[slicer] += tile) would copy the whole accumulator once per tile.
+
+The device mode only uses generic tensor ops, so it behaves the same with device_target="CPU" (no GPU needed).
+If the accumulator does not fit into the budget, or a device allocation fails on the way, the aggregator moves to the
+host and continues there.
+
+Voxels that no tile covers (tiles skipped outside the body mask) can be given a background prior: class 0 starts at
+probability 1 there and the weight map is 1.
+"""
+
+import mindspore
+import numpy as np
+from mindspore import ops
+
+
+def device_aggregation_bytes(num_classes: int, image_size) -> int:
+    """device memory needed to aggregate on the device: the accumulator and the weight map"""
+    return (num_classes + 1) * int(np.prod(image_size)) * 4
+
+
+class TileAggregator:
+    """accumulates sliding window predictions on the device or on the host"""
+
+    def __init__(self, num_classes: int, weight_map: np.ndarray, on_device: bool = False, verbose: bool = True,
+                 background: np.ndarray = None):
+        """background: optional mask (same shape as weight_map) of voxels that get the background prior"""
+        self.shape = tuple([num_classes] + list(weight_map.shape))
+        self.verbose = verbose
+        self.on_device = False
+        # voxel indices of a tile at the origin, (n, 3) int32, cached per tile shape
+        self._tile_indices = self._tile_shape = None
+        if on_device:
+            try:
+                results = ops.Zeros()(tuple(weight_map.shape) + (num_classes,), mindspore.float32)
+                if background is not None:
+                    prior = mindspore.Tensor(background[..., None].astype(np.float32))
+                    results = ops.Concat(-1)((prior, results[..., 1:]))
+                self.results = mindspore.Parameter(results, name="tile_aggregator_results", requires_grad=False)
+                self.weight_map = mindspore.Tensor(weight_map, mindspore.float32)
+                self._scatter_add = ops.ScatterNdAdd()
+                self.on_device = True
+            except RuntimeError as e:
+                self._log("device aggregation not possible, aggregating on the host: %s" % e)
+        if not self.on_device:
+            self.results = np.zeros(self.shape, dtype=np.float32)
+            if background is not None:
+                self.results[0][background] = 1
+            self.weight_map = weight_map
+        self._log("aggregating on the %s" % ("device" if self.on_device else "host"))
+
+    def _log(self, message):
+        if self.verbose: print(message)
+
+    def _to_host(self, error):
+        """copy what was accumulated so far to the host and continue there"""
+        self._log("device aggregation failed, moving the accumulator to the host: %s" % error)
+        self.results = np.ascontiguousarray(np.moveaxis(self.results.asnumpy(), -1, 0))
+        self.weight_map = self.weight_map.asnumpy()
+        self.on_device = False
+
+    def _indices_for(self, tile_shape, slicer) -> mindspore.Tensor:
+        """accumulator indices of all voxels of a tile of tile_shape placed at slicer"""
+        if self._tile_shape != tuple(tile_shape):
+            grid = np.indices(tile_shape, dtype=np.int32).reshape(len(tile_shape), -1).T
+            self._tile_indices = mindspore.Tensor(np.ascontiguousarray(grid))
+            self._tile_shape = tuple(tile_shape)
+        offset = mindspore.Tensor(np.array([[s.start or 0 for s in slicer[1:]]], dtype=np.int32))
+        return self._tile_indices + offset
+
+    def add(self, predicted_patches: mindspore.Tensor, slicers):
+        """
+        add predicted_patches (b, c, x, y, z) at slicers. Only the first len(slicers) samples are used, the rest of
+        the batch is padding
+        """
+        if self.on_device:
+            tile_shape = predicted_patches.shape[2:]
+            for i, slicer in enumerate(slicers):
+                try:
+                    updates = ops.Transpose()(predicted_patches[i], (1, 2, 3, 0)).reshape((-1, self.shape[0]))
+                    self._scatter_add(self.results, self._indices_for(tile_shape, slicer), updates)
+                except RuntimeError as e:
+                    self._to_host(e)
+                    self.add(predicted_patches[i:], slicers[i:])
+                    return
+            return
+
+        predicted_patches = predicted_patches[:len(slicers)].asnumpy()
+        for predicted_patch, slicer in zip(predicted_patches, slicers):
+            self.results[slicer] += predicted_patch
+
+    def finalize(self, slicer, regions_class_order=None):
+        """
+        divide by the weight map and crop to slicer (c, x, y, z). Returns the segmentation (argmax, or thresholded
+        regions if regions_class_order is given) and the class probabilities as numpy arrays
+        """
+        if self.on_device:
+            try:
+                spatial = tuple(slicer[1:])
+                class_probabilities = self.results[spatial][..., slicer[0]] / \
+                    ops.ExpandDims()(self.weight_map[spatial], -1)
+                predicted_segmentation = None
+                if regions_class_order is None:
+                    predicted_segmentation = ops.Argmax(axis=-1)(class_probabilities).asnumpy()
+                class_probabilities = np.ascontiguousarray(np.moveaxis(class_probabilities.asnumpy(), -1, 0))
+            except RuntimeError as e:
+                self._to_host(e)
+                return self.finalize(slicer, regions_class_order)
+        else:
+            # in place, the accumulator is not used afterwards
+            class_probabilities = self.results[slicer]
+            class_probabilities /= self.weight_map[slicer[1:]][None]
+            predicted_segmentation = None
+            if regions_class_order is None:
+                predicted_segmentation = class_probabilities.argmax(0)
+
+        if regions_class_order is not None:
+            predicted_segmentation = np.zeros(class_probabilities.shape[1:], dtype=np.float32)
+            for i, c in enumerate(regions_class_order):
+                predicted_segmentation[class_probabilities[i] > 0.5] = c
+        return predicted_segmentation, class_probabilities
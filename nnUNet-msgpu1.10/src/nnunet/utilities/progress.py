@@ -0,0 +1,120 @@
+# Copyright 2022 Huawei Technologies Co., Ltd
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+# http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+# ============================================================================
+
+"""
+progress reporting for inference
+
+predict_cases and the sliding window loop call report_progress(stage, ...). Nothing happens unless a callback
+was installed with set_progress_callback, e.g. json_lines_writer() which prints one JSON object per line:
+
+    {"event": "progress", "stage": "predict", "case": "case_00000", "fold": 0, "num_folds": 1, "tile": 12, "num_tiles": 96}
+
+stages: preprocess -> predict (per fold, per tile) -> export -> postprocess -> done
+
+cancellation is cooperative: request_cancel(case) marks a case, the sliding window loop calls check_cancelled()
+after every tile and predict_cases_preloaded skips the rest of that case (reported as stage "cancelled").
+"""
+
+import json
+import sys
+import threading
+
+PROGRESS_EVENT = "progress"
+
+_callback = None
+_context = {}
+_write_lock = threading.Lock()
+_cancel_lock = threading.Lock()
+_cancelled_cases = set()
+_cancel_all = False
+
+
+class PredictionCancelled(Exception):
+    """raised by check_cancelled when the current case was cancelled"""
+
+
+def set_progress_callback(callback):
+    """install a callable(event: dict), None to disable reporting"""
+    global _callback
+    _callback = callback
+
+
+def set_progress_context(**fields):
+    """fields merged into every following event (e.g. case, fold), replaces the previous context"""
+    _context.clear()
+    _context.update(fields)
+
+
+def progress_enabled():
+    return _callback is not None
+
+
+def report_progress(stage, **fields):
+    """report one progress event, never raises"""
+    if _callback is None:
+        return
+    event = dict(_context)
+    event.update(fields)
+    event["stage"] = stage
+    try:
+        _callback(event)
+    except Exception as e:
+        print("progress callback failed:", e)
+
+
+def json_lines_writer(stream=None):
+    """callback writing each event as one JSON line to stream (default: stdout)"""
+    def write(event):
+        line = json.dumps(dict(event, event=PROGRESS_EVENT))
+        out = stream if stream is not None else sys.stdout
+        with _write_lock:
+            out.write(line + "\n")
+            out.flush()
+    return write
+
+
+def request_cancel(case=None):
+    """cancel one case by id, or every case when case is None"""
+    global _cancel_all
+    with _cancel_lock:
+        if case is None:
+            _cancel_all = True
+        else:
+            _cancelled_cases.add(case)
+
+
+def reset_cancel(cases=None):
+    """forget cancellation requests for the given cases, or all of them when cases is None"""
+    global _cancel_all
+    with _cancel_lock:
+        if cases is None:
+            _cancel_all = False
+            _cancelled_cases.clear()
+        else:
+            _cancelled_cases.difference_update(cases)
+
+
+def is_cancelled(case=None):
+    """whether case (default: the case in the current progress context) was cancelled"""
+    if case is None:
+        case = _context.get("case")
+    with _cancel_lock:
+        return _cancel_all or case in _cancelled_cases
+
+
+def check_cancelled():
+    """raise PredictionCancelled if the current case was cancelled"""
+    if is_cancelled():
+        raise PredictionCancelled(_context.get("case"))
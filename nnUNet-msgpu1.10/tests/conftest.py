@@ -0,0 +1,17 @@
+import sys
+from pathlib import Path
+
+# the nnUNet-msgpu1.10 root must be on sys.path, modules are imported as src.nnunet.*
+ROOT_DIR = Path(__file__).resolve().parents[1]
+if str(ROOT_DIR) not in sys.path:
+    sys.path.insert(0, str(ROOT_DIR))
+
+import pytest
+
+
+@pytest.fixture
+def cpu_context():
+    """MindSpore on the CPU backend in PyNative mode, no GPU needed"""
+    mindspore = pytest.importorskip("mindspore")
+    mindspore.context.set_context(mode=mindspore.context.PYNATIVE_MODE, device_target="CPU")
+    return mindspore
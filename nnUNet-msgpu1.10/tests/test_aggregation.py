@@ -0,0 +1,100 @@
+import numpy as np
+import pytest
+
+pytest.importorskip("mindspore")
+
+import mindspore
+
+from src.nnunet.utilities.aggregation import TileAggregator, device_aggregation_bytes
+
+NUM_CLASSES = 3
+IMAGE_SIZE = (10, 8, 6)
+TILE = (4, 4, 4)
+
+
+def tile_slicers(starts):
+    return [(slice(None),) + tuple(slice(s, s + t) for s, t in zip(start, TILE)) for start in starts]
+
+
+def all_slicers():
+    steps = [range(0, n - t + 1, 2) for n, t in zip(IMAGE_SIZE, TILE)]
+    return tile_slicers([(x, y, z) for x in steps[0] for y in steps[1] for z in steps[2]])
+
+
+def weight_map_for(slicers):
+    weight_map = np.zeros(IMAGE_SIZE, dtype=np.float32)
+    for slicer in slicers:
+        weight_map[slicer[1:]] += 1
+    uncovered = weight_map == 0
+    weight_map[uncovered] = 1
+    return weight_map, uncovered
+
+
+def random_batches(slicers, batch_size=4):
+    """(batch, slicers) pairs, the last batch is padded with large values that must never be aggregated"""
+    rng = np.random.default_rng(0)
+    batches = []
+    for start in range(0, len(slicers), batch_size):
+        batch_slicers = slicers[start:start + batch_size]
+        patches = rng.random((batch_size, NUM_CLASSES) + TILE, dtype=np.float32)
+        patches[len(batch_slicers):] = 1000
+        batches.append((patches, batch_slicers))
+    return batches
+
+
+def expected(batches, weight_map, uncovered=None):
+    results = np.zeros((NUM_CLASSES,) + IMAGE_SIZE, dtype=np.float32)
+    if uncovered is not None:
+        results[0][uncovered] = 1
+    for patches, slicers in batches:
+        for patch, slicer in zip(patches, slicers):
+            results[slicer] += patch
+    return results / weight_map[None]
+
+
+def run(aggregator, batches, fail_after=None):
+    for index, (patches, slicers) in enumerate(batches):
+        if index == fail_after:
+            aggregator._to_host(RuntimeError("forced"))
+        aggregator.add(mindspore.Tensor(patches), slicers)
+    full = (slice(0, NUM_CLASSES),) + tuple(slice(0, n) for n in IMAGE_SIZE)
+    return aggregator.finalize(full)
+
+
+@pytest.mark.parametrize("on_device, fail_after", [(False, None), (True, None), (True, 2)])
+def test_device_host_and_fallback_agree(cpu_context, on_device, fail_after):
+    slicers = all_slicers()
+    weight_map, _ = weight_map_for(slicers)
+    batches = random_batches(slicers)
+    assert len(slicers) % 4 and len(batches) > 2
+
+    aggregator = TileAggregator(NUM_CLASSES, weight_map, on_device=on_device, verbose=False)
+    assert aggregator.on_device == on_device
+    segmentation, probabilities = run(aggregator, batches, fail_after)
+
+    assert aggregator.on_device == (on_device and fail_after is None)
+    reference = expected(batches, weight_map)
+    assert probabilities.shape == reference.shape
+    np.testing.assert_allclose(probabilities, reference, rtol=1e-5)
+    np.testing.assert_array_equal(segmentation, reference.argmax(0))
+
+
+@pytest.mark.parametrize("on_device", [False, True])
+def test_background_prior_fills_uncovered_voxels(cpu_context, on_device):
+    # keep only the tiles in the first part along x, nothing covers the rest
+    slicers = [s for s in all_slicers() if s[1].stop <= 6]
+    weight_map, uncovered = weight_map_for(slicers)
+    assert uncovered.any()
+    batches = random_batches(slicers)
+
+    aggregator = TileAggregator(NUM_CLASSES, weight_map, on_device=on_device, verbose=False, background=uncovered)
+    segmentation, probabilities = run(aggregator, batches)
+
+    np.testing.assert_allclose(probabilities, expected(batches, weight_map, uncovered), rtol=1e-5)
+    assert (probabilities[0][uncovered] == 1).all()
+    assert (probabilities[1:, uncovered] == 0).all()
+    assert (segmentation[uncovered] == 0).all()
+
+
+def test_device_budget_counts_accumulator_and_weight_map():
+    assert device_aggregation_bytes(NUM_CLASSES, IMAGE_SIZE) == (NUM_CLASSES + 1) * int(np.prod(IMAGE_SIZE)) * 4
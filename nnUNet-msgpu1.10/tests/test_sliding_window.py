@@ -0,0 +1,192 @@
+import numpy as np
+import pytest
+
+pytest.importorskip("mindspore")
+pytest.importorskip("batchgenerators")
+
+import mindspore.nn as nn
+from mindspore import ops
+
+from src.nnunet.network_architecture import neural_network
+from src.nnunet.network_architecture.neural_network import AUTO_TILE_BATCH_VOXELS, SegmentationNetwork, \
+    mirror_variants
+
+
+class VoxelwiseNetwork(SegmentationNetwork):
+    """two classes p and 1 - p of the first input channel, voxel by voxel, so it commutes with flips"""
+
+    def __init__(self):
+        super().__init__()
+        self.conv_op = nn.Conv3d
+        self.num_classes = 2
+        self.batch_sizes = []
+
+    def construct(self, x):
+        self.batch_sizes.append(x.shape[0])
+        return (ops.Concat(1)((x[:, :1], 1 - x[:, :1])),)
+
+
+@pytest.fixture
+def network(cpu_context):
+    net = VoxelwiseNetwork()
+    net.set_train(False)
+    net.share_norm_slots()
+    return net
+
+
+def predict(net, x, patch_size=(8, 8, 8), do_mirroring=False, mirror_axes=(0, 1, 2)):
+    return net.predict_3D(x, do_mirroring, mirror_axes, use_sliding_window=True, step_size=0.5,
+                          patch_size=patch_size, use_gaussian=True, verbose=False)
+
+
+@pytest.mark.parametrize("patch_size", [(64, 64, 64), (128, 128, 128), (80, 160, 160), (96, 192, 192)])
+@pytest.mark.parametrize("num_variants", [1, 2, 4, 8])
+def test_tile_batch_stays_within_budget(network, patch_size, num_variants):
+    voxels = int(np.prod(patch_size))
+    batch_size = network._get_tile_batch_size(patch_size, 1000, num_variants)
+    assert batch_size >= network.norm_slots and batch_size % network.norm_slots == 0
+
+    per_pass = network._get_variants_per_pass(batch_size, patch_size, num_variants)
+    assert num_variants % per_pass == 0
+    # only norm_slots tiles of a single variant may exceed the budget, none of these patch sizes does
+    assert batch_size * per_pass * voxels <= AUTO_TILE_BATCH_VOXELS
+
+
+def test_tile_batch_is_not_larger_than_needed(network):
+    assert network._get_tile_batch_size((32, 32, 32), 3) == 4
+    assert network._get_tile_batch_size((32, 32, 32), 1) == network.norm_slots
+    network.tile_batch_size = 5
+    assert network._get_tile_batch_size((32, 32, 32), 100) == 4
+
+
+def test_padded_batch_samples_are_not_aggregated(network):
+    x = np.random.default_rng(0).random((1, 20, 18, 16), dtype=np.float32)
+    network.tile_batch_size = 4
+    network.skip_background_tiles = False
+    steps = network._compute_steps_for_sliding_window((8, 8, 8), x.shape[1:], 0.5)
+    assert int(np.prod([len(s) for s in steps])) % 4
+
+    for device_aggregation_bytes in (0, neural_network.DEFAULT_DEVICE_AGGREGATION_BYTES):
+        network.device_aggregation_bytes = device_aggregation_bytes
+        segmentation, probabilities = predict(network, x)
+        np.testing.assert_allclose(probabilities[0], x[0], rtol=1e-5, atol=1e-6)
+        np.testing.assert_allclose(probabilities[1], 1 - x[0], rtol=1e-5, atol=1e-6)
+        np.testing.assert_array_equal(segmentation, (x[0] < 0.5).astype(segmentation.dtype))
+
+
+def test_mirror_variants_honour_axis_subset():
+    assert mirror_variants((0, 1, 2), False) == [()]
+    assert mirror_variants((), True) == [()]
+    assert mirror_variants((0, 2), True) == [(), (2,), (4,), (2, 4)]
+    assert mirror_variants((2, 0, 2), True) == [(), (2,), (4,), (2, 4)]
+    assert len(mirror_variants((0, 1, 2), True)) == 8
+    assert mirror_variants((1,), True, offset=0) == [(), (1,)]
+
+
+@pytest.mark.parametrize("mirror_axes", [(0,), (1, 2), (0, 1, 2)])
+def test_mirrored_predictions_are_flipped_back(network, mirror_axes):
+    # not symmetric along any axis: a variant that is not flipped back lands on other voxels
+    x = np.random.default_rng(1).random((1, 8, 8, 8), dtype=np.float32)
+    batch = np.stack([x, x[:, ::-1]])
+    network.batch_sizes.clear()
+
+    pred = network._internal_maybe_mirror_and_pred_3D(batch, mirror_axes, True).asnumpy()
+
+    np.testing.assert_allclose(pred[:, 0], batch[:, 0], rtol=1e-5, atol=1e-6)
+    # the mirror variants of the batch (2 samples, one norm slot each) go through one forward pass
+    assert network.batch_sizes == [2 * 2 ** len(mirror_axes)]
+
+
+def test_mirror_variants_split_over_passes(network, monkeypatch):
+    x = np.random.default_rng(2).random((1, 20, 18, 16), dtype=np.float32)
+    network.skip_background_tiles = False
+    _, reference = predict(network, x)
+    # budget for 2 tiles of 2 variants: the 8 variants of a 2 tile batch need 4 passes
+    monkeypatch.setattr(neural_network, "AUTO_TILE_BATCH_VOXELS", 4 * 8 ** 3)
+    network.batch_sizes.clear()
+
+    _, probabilities = predict(network, x, do_mirroring=True)
+
+    assert set(network.batch_sizes) == {4}
+    np.testing.assert_allclose(probabilities, reference, rtol=1e-5, atol=1e-6)
+
+
+def sliding_window_slicers(image_size, patch_size, step_size=0.5):
+    steps = SegmentationNetwork._compute_steps_for_sliding_window(patch_size, image_size, step_size)
+    return [(slice(None), slice(x, x + patch_size[0]), slice(y, y + patch_size[1]), slice(z, z + patch_size[2]))
+            for x in steps[0] for y in steps[1] for z in steps[2]]
+
+
+def test_weight_map_matches_per_class_sum(network):
+    image_size, patch_size = (20, 18, 16), (8, 8, 8)
+    tile_weight = SegmentationNetwork._get_gaussian(patch_size)
+    slicers = sliding_window_slicers(image_size, patch_size)
+
+    weight_map, uncovered = network._get_weight_map_3d(image_size, slicers, tile_weight, True, verbose=False)
+
+    # what the weight map replaced: the tile weight added to every class channel
+    per_class = np.zeros((network.num_classes,) + image_size, dtype=np.float32)
+    for slicer in slicers:
+        per_class[slicer] += tile_weight
+    assert uncovered is None
+    for channel in per_class:
+        np.testing.assert_allclose(weight_map, channel, rtol=1e-6)
+    # same geometry: cached
+    assert network._get_weight_map_3d(image_size, slicers, tile_weight, True, verbose=False)[0] is weight_map
+
+
+def test_weight_map_marks_uncovered_voxels(network):
+    image_size, patch_size = (20, 18, 16), (8, 8, 8)
+    slicers = [s for s in sliding_window_slicers(image_size, patch_size) if s[1].start < 8 and s[3].stop <= 12]
+    tile_weight = np.ones(patch_size, dtype=np.float32)
+
+    weight_map, uncovered = network._get_weight_map_3d(image_size, slicers, tile_weight, False, verbose=False)
+
+    covered = np.zeros(image_size, dtype=bool)
+    for slicer in slicers:
+        covered[slicer[1:]] = True
+    np.testing.assert_array_equal(uncovered, ~covered)
+    assert (weight_map[uncovered] == 1).all()
+    assert (weight_map[covered] >= 1).all()
+
+
+def body_phantom(shape=(64, 64, 48)):
+    """normalized CT: air at the lowest value, a body block off the centre and a thin table below it"""
+    data = np.full((1,) + shape, -1.0, dtype=np.float32)
+    data[0, 8:30, 10:40, 6:30] = np.random.default_rng(3).random((22, 30, 24), dtype=np.float32)
+    data[0, 8:30, 10:40, 6:30] += 0.5
+    data[0, 31, :, :] = 0.5  # table, one voxel thick
+    return data
+
+
+def test_tiles_overlapping_the_body_are_kept(network):
+    data = body_phantom()
+    slicers = sliding_window_slicers(data.shape[1:], (16, 16, 16))
+    body = np.zeros(data.shape[1:], dtype=bool)
+    body[8:30, 10:40, 6:30] = True
+
+    kept = network._skip_background_tiles(data, slicers, verbose=False)
+
+    assert 0 < len(kept) < len(slicers)
+    for slicer in slicers:
+        if body[slicer[1:]].any():
+            assert slicer in kept
+    # a constant image has no body mask: nothing is skipped
+    assert network._skip_background_tiles(np.zeros_like(data), slicers, verbose=False) == slicers
+
+
+def test_skipped_tiles_get_the_background_prior(network):
+    data = body_phantom()
+    patch_size = (16, 16, 16)
+    kept = network._skip_background_tiles(data, sliding_window_slicers(data.shape[1:], patch_size), verbose=False)
+    covered = np.zeros(data.shape[1:], dtype=bool)
+    for slicer in kept:
+        covered[slicer[1:]] = True
+    assert not covered.all()
+
+    segmentation, probabilities = predict(network, data, patch_size)
+
+    assert (probabilities[0][~covered] == 1).all()
+    assert (probabilities[1][~covered] == 0).all()
+    assert (segmentation[~covered] == 0).all()
+    np.testing.assert_allclose(probabilities[0][covered], data[0][covered], rtol=1e-5, atol=1e-6)